@@ -1,5 +1,6 @@
 from transformers import AutoTokenizer, AutoModelForCausalLM
-import re
+import os
+import sys
 
 from typing import List
 
@@ -12,6 +13,10 @@ import torch
 import json
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from sharding import current_shard, shard_frame
+from sql_normalizer import extract_tagged_blocks
+
 
 template = template = """\
 You are an SQL expert. The task you are going to perform is to generate reasoning chains and SQLite query given instructions, user questions, and relevant schema. Always follow the instructions given to you as it will help you generate reasoning chains and SQLite query in a structured manner. Give your output in a txt code block. Do not use asterisk to highlight SQLite keywords. Encapsulate chains within <chains> and </chains>. Encapsulate SQLite query within <SQL> and </SQL>.
@@ -115,10 +120,11 @@ def get_dataset() -> DatasetDict:
     )
 
 def get_answer_sql_block(answer: str):
-    matches = re.findall(r"<SQL>(.*?)</SQL>", answer, re.DOTALL)
+    # The first two <SQL> blocks belong to the prompt
+    matches = extract_tagged_blocks(answer, "SQL")
 
     if len(matches) >= 3:
-        return matches[2].strip()
+        return matches[2]
     else:
         return None
 
@@ -133,6 +139,9 @@ def evaluate_model():
 
     # Open output file
     eval_df = pd.read_csv(eval_file)
+    # One contiguous slice of the rows per shard_runner.py worker or SLURM array task
+    shard = current_shard()
+    eval_df = shard_frame(eval_df, shard)
     # eval_df = eval_df[eval_df["score"] == 1]
     # eval_df = eval_df[eval_df["classification"] == "EASY"]
     eval_df['model_predicted_sql'] = None
@@ -178,7 +187,7 @@ def evaluate_model():
     
     result_dict = convert_int64_to_int(result_dict)
 
-    with open(output_file, 'w') as f:
+    with open(shard.path(output_file), 'w') as f:
         json.dump(result_dict, f, indent=4)
 
 
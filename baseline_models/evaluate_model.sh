@@ -42,17 +42,31 @@ fi
 # Download NLTK tokenizer
 python -c "import nltk; nltk.download('punkt_tab')"
 
-# Predict queries using model
-if [[ -z "$1" ]]; then
-  python ./src/evaluate_model.py --batch_size 4
-else
-  python ./src/evaluate_model.py --model_name "$1" --batch_size 4
+# Decoding strategies to compare, e.g. DECODING="greedy beam-4 sample"
+DECODING="${DECODING:-beam-4}"
+MODEL_ARGS=()
+if [[ -n "$1" ]]; then
+  MODEL_ARGS=(--model_name "$1")
 fi
 
-# Run benchmark
-python ./benchmarks/test-suite-sql-eval/evaluation.py \
-  --gold gold_query.txt \
-  --pred generated.txt \
-  --db ./benchmarks/spider_data/database \
-  --table ./benchmarks/spider_data/tables.json \
-  --etype all 
+for strategy in $DECODING; do
+  # Predict queries using model
+  python ./src/evaluate_model.py "${MODEL_ARGS[@]}" --batch_size 4 \
+    --decoding "$strategy" --output_dir "./results/$strategy"
+
+  # Run benchmark
+  python ./benchmarks/test-suite-sql-eval/evaluation.py \
+    --gold "./results/$strategy/gold_query.txt" \
+    --pred "./results/$strategy/generated.txt" \
+    --db ./benchmarks/spider_data/database \
+    --table ./benchmarks/spider_data/tables.json \
+    --etype all | tee "./results/$strategy/evaluation.txt"
+done
+
+# Throughput next to accuracy for every strategy
+for strategy in $DECODING; do
+  echo "== $strategy"
+  grep -E "^(execution|exact match) " "./results/$strategy/evaluation.txt"
+  cat "./results/$strategy/throughput.json"
+  echo
+done
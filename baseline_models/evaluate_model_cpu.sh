@@ -0,0 +1,84 @@
+#!/bin/bash
+
+#SBATCH --account=swabhas_1457
+#SBATCH --partition=main
+#SBATCH --nodes=1
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=32
+#SBATCH --mem=64G
+#SBATCH --time=12:00:00
+
+module purge
+module load gcc git python/3.12.2
+
+export HF_HOME="$PWD/cache/huggingface"
+
+# Clone submodules
+if [[ ! -f ./benchmarks/test-suite-sql-eval/evaluation.py ]]; then
+  pushd $(git rev-parse --show-toplevel)
+  git submodule update --init --recursive
+  popd
+fi
+
+# Setup virtualenv
+if [[ -d venv ]]; then
+  source ./venv/bin/activate
+else
+  python -m venv venv
+  source ./venv/bin/activate
+  python -m pip install -r requirements.txt
+fi
+
+# Download spider dataset
+if [[ ! -d ./benchmarks/spider_data ]]; then
+  python -m pip install gdown
+  gdown -O spider_data.zip 1403EGqzIDoHMdQF4c9Bkyl7dZLZ5Wt6J
+  unzip spider_data.zip -d ./benchmarks
+  rm -rf ./benchmarks/__MACOSX
+fi
+
+# Download NLTK tokenizer
+python -c "import nltk; nltk.download('punkt_tab')"
+
+# Decoding strategies to compare, e.g. DECODING="greedy beam-4 sample"
+DECODING="${DECODING:-greedy}"
+# Model replicas, each pinned to its share of the cores and evaluating a slice of the dev set
+SHARDS="${SHARDS:-1}"
+MODEL_ARGS=()
+if [[ -n "$1" ]]; then
+  MODEL_ARGS=(--model_name "$1")
+fi
+
+for strategy in $DECODING; do
+  # Predict queries using model
+  if [[ "$SHARDS" -gt 1 ]]; then
+    # Each replica collates in-process and uses all of its pinned cores for generation
+    python ../common/shard_runner.py run --shards "$SHARDS" \
+      --outputs "./results/$strategy/gold_query.txt" "./results/$strategy/generated.txt" -- \
+      python ./src/evaluate_model.py "${MODEL_ARGS[@]}" --batch_size 4 \
+      --device cpu --num_workers 0 \
+      --decoding "$strategy" --output_dir "./results/$strategy"
+  else
+    # One worker prepares batches; the generating process uses the remaining cores
+    python ./src/evaluate_model.py "${MODEL_ARGS[@]}" --batch_size 4 \
+      --device cpu --threads $((${SLURM_CPUS_PER_TASK:-$(nproc)} - 1)) --num_workers 1 \
+      --decoding "$strategy" --output_dir "./results/$strategy"
+  fi
+
+  # Run benchmark
+  python ./benchmarks/test-suite-sql-eval/evaluation.py \
+    --gold "./results/$strategy/gold_query.txt" \
+    --pred "./results/$strategy/generated.txt" \
+    --db ./benchmarks/spider_data/database \
+    --table ./benchmarks/spider_data/tables.json \
+    --etype all | tee "./results/$strategy/evaluation.txt"
+done
+
+# Throughput next to accuracy for every strategy
+for strategy in $DECODING; do
+  echo "== $strategy"
+  grep -E "^(execution|exact match) " "./results/$strategy/evaluation.txt"
+  # One throughput file per shard
+  cat "./results/$strategy"/throughput*.json
+  echo
+done
@@ -0,0 +1,101 @@
+import importlib.util
+import os
+
+from typing import Optional
+
+import torch
+
+DEVICES = ("auto", "cuda", "cpu")
+DTYPES = ("auto", "bfloat16", "float16", "float32")
+
+
+def resolve_device(device: str = "auto") -> str:
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("--device cuda was requested but CUDA is not available")
+    return device
+
+
+def available_cores() -> int:
+    """Cores this process may run on (respects taskset and SLURM cpu binding)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether oneDNN has native bf16 kernels on this CPU (AVX512-BF16 or AMX); otherwise bf16 is emulated and slow"""
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_dtype(device: str, dtype: str = "auto", quantize: bool = False) -> torch.dtype:
+    if device == "cpu" and quantize:
+        # Dynamic int8 quantization converts float32 linear layers
+        return torch.float32
+    if dtype == "auto":
+        if device == "cpu":
+            return torch.bfloat16 if cpu_supports_bf16() else torch.float32
+        # Use torch.float16 for GPUs older than Ampere (RTX 3000 series)
+        return torch.bfloat16
+    return getattr(torch, dtype)
+
+
+def attention_implementation(device: str) -> str:
+    """Fastest attention the installed packages provide: flash-attn on CUDA, else PyTorch SDPA, else eager"""
+    if device == "cuda" and importlib.util.find_spec("flash_attn") is not None:
+        return "flash_attention_2"
+    if hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+        return "sdpa"
+    return "eager"
+
+
+def configure_cpu_threads(intra_op: Optional[int] = None, inter_op: Optional[int] = None) -> int:
+    """
+    Intra-op threads default to the available cores, inter-op threads to 1:
+    generation is a chain of dependent ops, so parallelism comes from within each
+    matmul. Must run before the first parallel op; returns the intra-op count.
+    """
+    intra_op = intra_op or available_cores()
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op or 1)
+    except RuntimeError:
+        # The inter-op pool is already running and can no longer be resized
+        pass
+    return intra_op
+
+
+def load_model(model_name: str, device: str, dtype: torch.dtype, quantization_config=None):
+    from transformers import AutoModelForCausalLM
+
+    options = dict(
+        quantization_config=quantization_config,
+        trust_remote_code=True,
+        torch_dtype=dtype,
+        device_map=device,
+        use_cache=True,
+    )
+    try:
+        return AutoModelForCausalLM.from_pretrained(
+            model_name, attn_implementation=attention_implementation(device), **options
+        )
+    except (ImportError, ValueError):
+        # The architecture does not support the chosen attention implementation
+        return AutoModelForCausalLM.from_pretrained(model_name, attn_implementation="eager", **options)
+
+
+def quantize_dynamic_int8(model):
+    """Replace the linear layers by int8 dynamically quantized ones (CPU only)"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def synchronize(device) -> None:
+    """Wait for queued kernels and release cached blocks; nothing to do on CPU"""
+    if torch.device(device).type == "cuda":
+        # empty cache to generate more results w/o memory crashing
+        torch.cuda.empty_cache()
+        torch.cuda.synchronize()
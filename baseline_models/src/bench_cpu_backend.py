@@ -0,0 +1,143 @@
+"""
+CPU generation throughput of the evaluate_model backend across thread counts.
+
+Loads the model once per variant (bfloat16, float32, int8 dynamic quantization),
+then generates a fixed number of tokens for the first dev set prompts with every
+intra-op thread count and reports generated tokens/s. Run from baseline_models/:
+
+    python ./src/bench_cpu_backend.py
+    python ./src/bench_cpu_backend.py --model_name seeklhy/codes-1b --threads 1 2 4 8 16 --variants float32 int8
+"""
+import time
+
+from argparse import ArgumentParser
+from typing import List, Optional
+
+import torch
+
+from transformers import AutoTokenizer
+
+from backend import (
+    attention_implementation,
+    available_cores,
+    configure_cpu_threads,
+    cpu_supports_bf16,
+    load_model,
+    quantize_dynamic_int8,
+)
+from spider_dataset import DynamicPaddingCollator, get_spider_devset
+
+VARIANTS = ("bfloat16", "float32", "int8")
+
+
+def default_thread_counts() -> List[int]:
+    cores = available_cores()
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    return counts if counts[-1] == cores else counts + [cores]
+
+
+def load_variant(model_name: str, variant: str, pad_token_id: int):
+    dtype = torch.float32 if variant == "int8" else getattr(torch, variant)
+    model = load_model(model_name, "cpu", dtype)
+    model.config.pad_token_id = pad_token_id
+    return quantize_dynamic_int8(model) if variant == "int8" else model
+
+
+def time_generation(model, batches, max_new_tokens: int, pad_token_id: int) -> float:
+    started = time.perf_counter()
+    for inputs in batches:
+        model.generate(
+            **inputs,
+            do_sample=False,
+            num_beams=1,
+            # A fixed length, so every run generates the same number of tokens
+            min_new_tokens=max_new_tokens,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=pad_token_id,
+        )
+    return time.perf_counter() - started
+
+
+def main(
+    model_name: str = "seeklhy/codes-1b",
+    threads: Optional[List[int]] = None,
+    variants: Optional[List[str]] = None,
+    prompts: int = 16,
+    batch_size: int = 4,
+    max_new_tokens: int = 64,
+    prompt_cache: str = "./cache/prompts",
+):
+    threads = threads or default_thread_counts()
+    variants = variants or list(VARIANTS)
+    # The inter-op pool can only be sized before its first use
+    configure_cpu_threads(max(threads), 1)
+    print(
+        f"{model_name}: {available_cores()} cores available, native bf16: {cpu_supports_bf16()}, "
+        f"attention: {attention_implementation('cpu')}"
+    )
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    dataset = get_spider_devset(tokenizer, dynamic_padding=True, cache_dir=prompt_cache)
+    collate = DynamicPaddingCollator(tokenizer)
+    # The shortest prompts first keeps the sweep short; prefill is included in the timings
+    order = sorted(range(len(dataset)), key=lambda idx: dataset.lengths[idx])[:prompts]
+    batches = [
+        collate([dataset[idx] for idx in order[start : start + batch_size]])[0]
+        for start in range(0, len(order), batch_size)
+    ]
+    n_tokens = len(order) * max_new_tokens
+    print(f"{len(order)} prompts in batches of {batch_size}, {max_new_tokens} new tokens each\n")
+
+    print(f"{'variant':<10} {'threads':>7} {'seconds':>9} {'tokens/s':>10}")
+    with torch.no_grad():
+        for variant in variants:
+            model = load_variant(model_name, variant, tokenizer.pad_token_id)
+            # Warm-up: oneDNN primitive creation and allocator growth
+            time_generation(model, batches[:1], 4, tokenizer.pad_token_id)
+            for count in threads:
+                torch.set_num_threads(count)
+                seconds = time_generation(model, batches, max_new_tokens, tokenizer.pad_token_id)
+                print(f"{variant:<10} {count:>7} {seconds:>9.2f} {n_tokens / seconds:>10.1f}")
+            del model
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="CPU generation throughput across thread counts")
+
+    parser.add_argument(
+        "--model_name", type=str, default="seeklhy/codes-1b", help="(default: seeklhy/codes-1b)"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Intra-op thread counts to try (default: powers of two up to the available cores)",
+    )
+    parser.add_argument(
+        "--variants",
+        type=str,
+        nargs="+",
+        choices=VARIANTS,
+        default=None,
+        help="Weight formats to try (default: all of them)",
+    )
+    parser.add_argument("--prompts", type=int, default=16, help="Dev set prompts per run (default: 16)")
+    parser.add_argument("-B", "--batch_size", type=int, default=4, help="(default: 4)")
+    parser.add_argument(
+        "--max_new_tokens", type=int, default=64, help="Tokens generated per prompt (default: 64)"
+    )
+    parser.add_argument(
+        "--prompt_cache",
+        type=str,
+        default="./cache/prompts",
+        help="Directory of the tokenized prompt cache, empty to disable (default: ./cache/prompts)",
+    )
+
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,85 @@
+import re
+import time
+
+from typing import Dict, List
+
+import torch
+
+from transformers import StoppingCriteria
+
+# greedy: one argmax sequence; beam-K: the best of K beams; sample: one nucleus-sampled sequence
+DECODING_STRATEGIES = ("greedy", "beam-K", "sample")
+
+_BEAM_PATTERN = re.compile(r"beam-(\d+)")
+
+
+def generation_options(strategy: str, temperature: float = 0.7, top_p: float = 0.95) -> Dict:
+    """model.generate arguments of a decoding strategy; every strategy returns one sequence per prompt"""
+    if strategy == "greedy":
+        return {"do_sample": False, "num_beams": 1}
+    if strategy == "sample":
+        return {"do_sample": True, "num_beams": 1, "temperature": temperature, "top_p": top_p}
+    beam = _BEAM_PATTERN.fullmatch(strategy)
+    if beam and int(beam.group(1)) > 0:
+        return {"do_sample": False, "num_beams": int(beam.group(1)), "num_return_sequences": 1}
+    raise ValueError(f"Unknown decoding strategy {strategy!r}, expected one of {', '.join(DECODING_STRATEGIES)}")
+
+
+def stop_token_ids(tokenizer, stop: str = "[") -> List[int]:
+    """Ids of the (non-special) tokens whose text contains `stop`"""
+    special = set(tokenizer.all_special_ids)
+    texts = tokenizer.batch_decode([[token_id] for token_id in range(len(tokenizer))])
+    return [token_id for token_id, text in enumerate(texts) if stop in text and token_id not in special]
+
+
+class SQLAnswerStoppingCriteria(StoppingCriteria):
+    """
+    Ends a sequence once its generated part contains a token with `[`: the answer
+    after the prompt's [SQL] marker is finished ([/SQL], a new [QUESTION], ...),
+    and extract_after_marker would cut the text there anyway.
+
+    Greedy and sampled sequences stop one by one; beam search stops once all beams have.
+    """
+
+    def __init__(self, stop_ids: List[int], prompt_length: int) -> None:
+        self.stop_ids = torch.tensor(stop_ids, dtype=torch.long)
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.stop_ids.device != input_ids.device:
+            self.stop_ids = self.stop_ids.to(input_ids.device)
+        # The whole generated part, since beam search reorders rows between steps
+        generated = input_ids[:, self.prompt_length :]
+        return torch.isin(generated, self.stop_ids).any(dim=1)
+
+
+class ThroughputMeter:
+    """Generation time, prompts and generated tokens of one evaluation run"""
+
+    def __init__(self, strategy: str) -> None:
+        self.strategy = strategy
+        self.seconds = 0.0
+        self.examples = 0
+        self.new_tokens = 0
+        self._started = None
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+
+    def stop(self, new_ids: torch.Tensor, pad_token_id: int) -> None:
+        """Count a finished batch; `new_ids` are the generated tokens without the prompt"""
+        self.seconds += time.perf_counter() - self._started
+        self.examples += new_ids.shape[0]
+        self.new_tokens += int((new_ids != pad_token_id).sum())
+
+    def report(self) -> Dict:
+        seconds = self.seconds or float("nan")
+        return {
+            "decoding": self.strategy,
+            "examples": self.examples,
+            "generated_tokens": self.new_tokens,
+            "seconds": round(self.seconds, 2),
+            "examples_per_second": round(self.examples / seconds, 3),
+            "tokens_per_second": round(self.new_tokens / seconds, 1),
+            "mean_new_tokens": round(self.new_tokens / max(self.examples, 1), 1),
+        }
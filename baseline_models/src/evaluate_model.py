@@ -1,13 +1,38 @@
+import json
+import os
+import sys
+
 from argparse import ArgumentParser
 from typing import Optional
 
 import torch
 
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 from tqdm import tqdm
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import AutoTokenizer, BitsAndBytesConfig, StoppingCriteriaList
+
+from backend import (
+    DEVICES,
+    DTYPES,
+    configure_cpu_threads,
+    load_model,
+    quantize_dynamic_int8,
+    resolve_device,
+    resolve_dtype,
+    synchronize,
+)
+from decoding import (
+    DECODING_STRATEGIES,
+    SQLAnswerStoppingCriteria,
+    ThroughputMeter,
+    generation_options,
+    stop_token_ids,
+)
+from spider_dataset import DynamicPaddingCollator, LengthBucketBatchSampler, get_spider_devset
 
-from spider_dataset import get_spider_devset
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from sharding import current_shard
+from sql_normalizer import extract_after_marker
 
 # Some models to try
 # model = "defog/sqlcoder-7b-2"
@@ -16,28 +41,49 @@ from spider_dataset import get_spider_devset
 # model = "seeklhy/codes-7b-merged"
 
 
-def main(model_name: Optional[str] = None, batch_size: int = 1, quantize: bool = False):
+def move_to_device(inputs, device):
+    """Copy one batch to the model's device (asynchronous when it comes from pinned memory)"""
+    return {key: value.to(device, non_blocking=True) for key, value in inputs.items()}
+
+
+def main(
+    model_name: Optional[str] = None,
+    batch_size: int = 1,
+    quantize: bool = False,
+    dynamic_padding: bool = False,
+    prompt_cache: str = "./cache/prompts",
+    num_workers: int = 1,
+    decoding: str = "beam-4",
+    temperature: float = 0.7,
+    top_p: float = 0.95,
+    max_new_tokens: int = 256,
+    seed: int = 0,
+    output_dir: str = ".",
+    device: str = "auto",
+    dtype: str = "auto",
+    threads: Optional[int] = None,
+    interop_threads: Optional[int] = None,
+):
 
     if model_name is None:
         model_name = "seeklhy/codes-7b-merged"
 
+    decoding_options = generation_options(decoding, temperature, top_p)
+    torch.manual_seed(seed)
+
+    device = resolve_device(device)
+    on_cuda = device == "cuda"
+
     quantization_config = None
-    if quantize:
+    if quantize and on_cuda:
         quantization_config = BitsAndBytesConfig(load_in_4bit=True)
-
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if not on_cuda:
+        print(f"CPU backend: {configure_cpu_threads(threads, interop_threads)} intra-op threads")
 
     tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
 
-    # Use torch.float16 for GPUs older than Ampere (RTX 3000 series)
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        quantization_config=quantization_config,
-        trust_remote_code=True,
-        torch_dtype=torch.bfloat16,
-        attn_implementation="flash_attention_2",
-        device_map=device,
-        use_cache=True,
+    model = load_model(
+        model_name, device, resolve_dtype(device, dtype, quantize), quantization_config=quantization_config
     )
     device = model.device
 
@@ -46,51 +92,91 @@ def main(model_name: Optional[str] = None, batch_size: int = 1, quantize: bool =
         model.resize_token_embeddings(len(tokenizer))
         model.config.pad_token_id = tokenizer.pad_token_id
 
-    dataset = get_spider_devset(tokenizer)
+    if quantize and not on_cuda:
+        # bitsandbytes 4-bit needs CUDA; on CPU the linear layers run in int8 instead
+        model = quantize_dynamic_int8(model)
 
-    dataset.encodings.to(device)
+    dataset = get_spider_devset(tokenizer, dynamic_padding=dynamic_padding, cache_dir=prompt_cache)
+    # Under shard_runner.py or a SLURM array this process evaluates one contiguous slice of the dev set
+    shard = current_shard()
+    shard_indices = range(*shard.bounds(len(dataset)))
+    lengths = [dataset.lengths[idx] for idx in shard_indices]
+    dataset = Subset(dataset, shard_indices)
+    if shard.sharded:
+        print(f"Evaluating {shard}: dev set examples {shard_indices.start}-{shard_indices.stop - 1}")
 
-    gold = open("./gold_query.txt", "w")
-    generated = open("./generated.txt", "w")
+    # The encodings stay in host memory; worker processes collate the next batches
+    # (into pinned memory on CUDA) while the model generates for the current one
+    if num_workers > 0:
+        # Each worker is a fork of this process; keep the fast tokenizer single-threaded in there
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    loader_options = {
+        "num_workers": num_workers,
+        "pin_memory": on_cuda,
+        "prefetch_factor": 2 if num_workers > 0 else None,
+    }
+    if dynamic_padding:
+        # Batches of similar-length prompts, each padded only to its own longest prompt
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=LengthBucketBatchSampler(lengths, batch_size or 1),
+            collate_fn=DynamicPaddingCollator(tokenizer),
+            **loader_options,
+        )
+    else:
+        dataloader = DataLoader(dataset, batch_size=batch_size or 1, **loader_options)
 
-    dataloader = DataLoader(dataset, batch_size=batch_size)
+    # (dev set index, generated SQL, gold line) of every example
+    results = []
 
-    # generation params
-    num_beams = 4
+    # Tokens that close the answer after the prompt's [SQL] marker
+    answer_stop_ids = stop_token_ids(tokenizer, "[")
+    meter = ThroughputMeter(decoding)
 
     with torch.no_grad():
         for batch in tqdm(dataloader):
             inputs, labels = batch
+            # Only the current batch lives on the device
+            inputs = move_to_device(inputs, device)
+            # Prompts are left-padded, so the generated tokens start at the same column in every row
+            prompt_length = inputs["input_ids"].shape[1]
 
-            # Generation parameters
+            meter.start()
             generated_ids = model.generate(
                 **inputs,
-                num_return_sequences=4,
+                **decoding_options,
                 eos_token_id=tokenizer.eos_token_id,
                 pad_token_id=tokenizer.eos_token_id,
-                max_new_tokens=256,
-                do_sample=False,
-                num_beams=num_beams,
+                max_new_tokens=max_new_tokens,
+                stopping_criteria=StoppingCriteriaList(
+                    [SQLAnswerStoppingCriteria(answer_stop_ids, prompt_length)]
+                ),
             )
-            outputs = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+            # One sequence per prompt; only the generated part is decoded
+            new_ids = generated_ids[:, prompt_length:]
+            outputs = tokenizer.batch_decode(new_ids, skip_special_tokens=True)
 
-            # empty cache to generate more results w/o memory crashing
-            torch.cuda.empty_cache()
-            torch.cuda.synchronize()
+            synchronize(device)
+            meter.stop(new_ids, tokenizer.eos_token_id)
 
-            # Write outputs
-            for output in outputs[::num_beams]:
-                generated_sql = (
-                    output.split("[SQL]")[-1].split("[")[0].replace("\n", " ").strip()
-                )
-                generated.write(generated_sql + "\n")
+            # Collect outputs with their gold queries
+            for output, sql, db, index in zip(outputs, labels["sql"], labels["database"], labels["index"]):
+                generated_sql = extract_after_marker(output, "[SQL]")
+                results.append((int(index), generated_sql, f"{sql}\t{db}"))
 
-            # Write gold queries
-            for sql, db in zip(labels["sql"], labels["database"]):
-                gold.write(f"{sql}\t{db}\n")
+    # Length-bucketed batches run out of order; both files follow the dev set order
+    os.makedirs(output_dir, exist_ok=True)
+    with open(shard.path(os.path.join(output_dir, "gold_query.txt")), "w") as gold, open(
+        shard.path(os.path.join(output_dir, "generated.txt")), "w"
+    ) as generated:
+        for _, generated_sql, gold_line in sorted(results):
+            generated.write(generated_sql + "\n")
+            gold.write(gold_line + "\n")
 
-    gold.close()
-    generated.close()
+    throughput = meter.report()
+    with open(shard.path(os.path.join(output_dir, "throughput.json")), "w") as f:
+        json.dump(throughput, f, indent=2)
+    print(json.dumps(throughput))
 
 
 if __name__ == "__main__":
@@ -98,7 +184,78 @@ if __name__ == "__main__":
 
     parser.add_argument("--model_name", type=str, required=False)
     parser.add_argument("-B", "--batch_size", type=int, required=False)
-    parser.add_argument("-Q", "--quantize", action="store_true")
+    parser.add_argument(
+        "-Q",
+        "--quantize",
+        action="store_true",
+        help="4-bit bitsandbytes weights on CUDA, int8 dynamic quantization of the linear layers on CPU",
+    )
+    parser.add_argument(
+        "-D",
+        "--dynamic_padding",
+        action="store_true",
+        help="Pad each batch of length-sorted prompts to its own longest prompt",
+    )
+    parser.add_argument(
+        "--prompt_cache",
+        type=str,
+        default="./cache/prompts",
+        help="Directory of the tokenized prompt cache, empty to disable (default: ./cache/prompts)",
+    )
+    parser.add_argument(
+        "-W",
+        "--num_workers",
+        type=int,
+        default=1,
+        help="DataLoader worker processes preparing batches in the background, 0 for none (default: 1)",
+    )
+
+    parser.add_argument(
+        "--decoding",
+        type=str,
+        default="beam-4",
+        help=f"Decoding strategy: {', '.join(DECODING_STRATEGIES)} (default: beam-4)",
+    )
+    parser.add_argument(
+        "--temperature", type=float, default=0.7, help="Sampling temperature (default: 0.7)"
+    )
+    parser.add_argument(
+        "--top_p", type=float, default=0.95, help="Nucleus sampling probability mass (default: 0.95)"
+    )
+    parser.add_argument(
+        "--max_new_tokens",
+        type=int,
+        default=256,
+        help="Upper bound on generated tokens; answers usually stop earlier at their closing [ (default: 256)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for sampling (default: 0)")
+    parser.add_argument(
+        "-O",
+        "--output_dir",
+        type=str,
+        default=".",
+        help="Directory for gold_query.txt, generated.txt and throughput.json (default: .)",
+    )
+    parser.add_argument(
+        "--device", type=str, choices=DEVICES, default="auto", help="Execution backend (default: auto)"
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        choices=DTYPES,
+        default="auto",
+        help="Model weights dtype; auto is bfloat16 on CUDA and on CPUs with native bf16, else float32 (default: auto)",
+    )
+    parser.add_argument(
+        "-T",
+        "--threads",
+        type=int,
+        default=None,
+        help="CPU intra-op threads (default: the cores available to the process)",
+    )
+    parser.add_argument(
+        "--interop_threads", type=int, default=None, help="CPU inter-op threads (default: 1)"
+    )
 
     args = parser.parse_args()
 
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Bump when build_prompt or the schema rendering changes in a way the template text does not show
+CACHE_VERSION = 1
+
+
+class TokenArray(Sequence):
+    """
+    Variable-length token id sequences stored as one flat memory-mapped array
+    plus offsets; item i is tokens[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, tokens: np.ndarray, offsets: np.ndarray) -> None:
+        self.tokens = tokens
+        self.offsets = offsets
+
+    @property
+    def lengths(self) -> List[int]:
+        return np.diff(self.offsets).tolist()
+
+    def __getitem__(self, idx):
+        return self.tokens[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer) -> Dict[str, str]:
+    """What makes two tokenizers produce the same ids: name, class, vocabulary and special tokens"""
+    fingerprint = {
+        "name": tokenizer.name_or_path,
+        "class": type(tokenizer).__name__,
+        "vocab_size": str(len(tokenizer)),
+        "special_tokens": json.dumps(tokenizer.special_tokens_map, sort_keys=True),
+    }
+    if getattr(tokenizer, "is_fast", False):
+        # The serialized fast tokenizer covers the vocabulary, merges and normalizers
+        fingerprint["tokenizer_json"] = hashlib.sha256(
+            tokenizer.backend_tokenizer.to_str().encode("utf-8")
+        ).hexdigest()
+    return fingerprint
+
+
+def cache_key(tokenizer, template: str, source_paths: List[str], max_length: int) -> str:
+    parts = {
+        "version": CACHE_VERSION,
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "template": hashlib.sha256(template.encode("utf-8")).hexdigest(),
+        "sources": [file_digest(path) for path in source_paths],
+        "max_length": max_length,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+def load_tokenized(cache_dir: str, key: str) -> Optional[Tuple[TokenArray, List[dict]]]:
+    """Memory-mapped token ids and labels of a cached split, or None when not cached"""
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+        return None
+    tokens = np.load(os.path.join(path, "tokens.npy"), mmap_mode="r")
+    offsets = np.load(os.path.join(path, "offsets.npy"))
+    with open(os.path.join(path, "labels.json")) as f:
+        labels = json.load(f)
+    return TokenArray(tokens, offsets), labels
+
+
+def save_tokenized(cache_dir: str, key: str, input_ids: List[List[int]], labels: List[dict]) -> None:
+    """Write a split to a temporary directory and rename it into place, so readers never see half an entry"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key)
+    tmp_path = tempfile.mkdtemp(dir=cache_dir, prefix=f".{key}.")
+    try:
+        offsets = np.zeros(len(input_ids) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in input_ids], out=offsets[1:])
+        tokens = np.fromiter(
+            (token for ids in input_ids for token in ids), dtype=np.int32, count=int(offsets[-1])
+        )
+        np.save(os.path.join(tmp_path, "tokens.npy"), tokens)
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        with open(os.path.join(tmp_path, "labels.json"), "w") as f:
+            json.dump(labels, f)
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another job may have written the same entry first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
@@ -1,8 +1,12 @@
 import json
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence
 
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
+
+from prompt_cache import cache_key, load_tokenized, save_tokenized
+
+MAX_LENGTH = 4096
 
 prompt = """\
 ### Task
@@ -21,6 +25,11 @@ Given the database schema, here is the SQL query that answers [QUESTION]{questio
 """
 
 
+def token_list(ids: Sequence[int]) -> List[int]:
+    """Token ids as Python ints; prompts read from the prompt cache are numpy int32 slices"""
+    return [int(token) for token in ids]
+
+
 def build_prompt(query, schemas) -> str:
     """
     Generate Text2SQL prompt containing database schema and natural language query
@@ -34,22 +43,83 @@ def build_prompt(query, schemas) -> str:
 
 
 class SpiderDataset(Dataset):
-    def __init__(self, tokenizer, sql_queries, schemas) -> None:
+    """
+    Tokenized Spider prompts with their gold queries.
+
+    By default every prompt is padded to the longest prompt of the whole dataset.
+    With `dynamic_padding` the token ids are stored unpadded; batch them with
+    `LengthBucketBatchSampler` and `DynamicPaddingCollator` so each batch is only
+    padded to its own longest prompt.
+
+    `input_ids` are the already tokenized prompts (e.g. memory-mapped from the prompt
+    cache); without them the prompts are rendered from `schemas` and tokenized.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        sql_queries,
+        schemas=None,
+        dynamic_padding: bool = False,
+        input_ids: Optional[Sequence[Sequence[int]]] = None,
+    ) -> None:
         super().__init__()
-        prompts = [build_prompt(query, schemas) for query in sql_queries]
-        self.encodings = tokenizer(
-            prompts, truncation=True, padding=True, max_length=4096, return_tensors="pt"
-        )
+        if input_ids is None:
+            prompts = [build_prompt(query, schemas) for query in sql_queries]
+            input_ids = tokenizer(prompts, truncation=True, max_length=MAX_LENGTH)["input_ids"]
+        self.dynamic_padding = dynamic_padding
+        self.input_ids = input_ids
+        self.lengths = [len(ids) for ids in input_ids]
+        self.encodings = None
+        if not dynamic_padding:
+            # The same tensors as tokenizing with padding=True: every prompt padded to the longest one
+            self.encodings = tokenizer.pad(
+                {"input_ids": [token_list(ids) for ids in input_ids]}, padding=True, return_tensors="pt"
+            )
         self.labels = sql_queries
 
     def __getitem__(self, idx):
-        item = {key: val[idx] for key, val in self.encodings.items()}
-        return item, self.labels[idx]
+        if self.dynamic_padding:
+            ids = token_list(self.input_ids[idx])
+            item = {"input_ids": ids, "attention_mask": [1] * len(ids)}
+        else:
+            item = {key: val[idx] for key, val in self.encodings.items()}
+        # The position in the dev set lets outputs of reordered batches be written back in order
+        return item, {**self.labels[idx], "index": idx}
 
     def __len__(self):
         return len(self.labels)
 
 
+class LengthBucketBatchSampler(Sampler):
+    """Batches of dataset indices with similar prompt lengths, longest batch first"""
+
+    def __init__(self, lengths: List[int], batch_size: int) -> None:
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+        self.batches = [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+class DynamicPaddingCollator:
+    """
+    Pads a batch of unpadded examples to its longest prompt (on the tokenizer's
+    padding side) and collects the labels field by field, in batch order.
+    """
+
+    def __init__(self, tokenizer) -> None:
+        self.tokenizer = tokenizer
+
+    def __call__(self, batch):
+        inputs = self.tokenizer.pad([item for item, _ in batch], padding="longest", return_tensors="pt")
+        labels = [label for _, label in batch]
+        return inputs, {key: [label[key] for label in labels] for key in labels[0]}
+
+
 def parse_spider_schemas(schema_path) -> Dict[str, str]:
     databases = {}
 
@@ -123,7 +193,25 @@ def parse_spider_queries(query_path) -> List[Dict[str, str]]:
     return queries
 
 
-def get_spider_dataset(tokenizer, json_path, schema_path) -> SpiderDataset:
+def get_spider_dataset(
+    tokenizer,
+    json_path,
+    schema_path,
+    dynamic_padding: bool = False,
+    cache_dir: Optional[str] = None,
+) -> SpiderDataset:
+    """
+    Load a Spider split. With `cache_dir` the tokenized prompts are read from (or
+    written to) the prompt cache, keyed by the tokenizer, the prompt template and
+    the contents of both source files.
+    """
+    key = None
+    if cache_dir:
+        key = cache_key(tokenizer, prompt, [json_path, schema_path], MAX_LENGTH)
+        cached = load_tokenized(cache_dir, key)
+        if cached is not None:
+            input_ids, queries = cached
+            return SpiderDataset(tokenizer, queries, dynamic_padding=dynamic_padding, input_ids=input_ids)
 
     # Parse database schema
     db_schema_str = parse_spider_schemas(schema_path)
@@ -131,22 +219,29 @@ def get_spider_dataset(tokenizer, json_path, schema_path) -> SpiderDataset:
     # Parse spider queries
     queries = parse_spider_queries(json_path)
 
-    dataset = SpiderDataset(tokenizer, queries, db_schema_str)
+    dataset = SpiderDataset(tokenizer, queries, db_schema_str, dynamic_padding=dynamic_padding)
+
+    if key is not None:
+        save_tokenized(cache_dir, key, dataset.input_ids, queries)
 
     return dataset
 
 
-def get_spider_devset(tokenizer):
+def get_spider_devset(tokenizer, dynamic_padding: bool = False, cache_dir: Optional[str] = None):
     return get_spider_dataset(
         tokenizer,
         json_path="./benchmarks/spider_data/dev.json",
         schema_path="./benchmarks/spider_data/tables.json",
+        dynamic_padding=dynamic_padding,
+        cache_dir=cache_dir,
     )
 
 
-def get_spider_testset(tokenizer):
+def get_spider_testset(tokenizer, dynamic_padding: bool = False, cache_dir: Optional[str] = None):
     return get_spider_dataset(
         tokenizer,
         json_path="./benchmarks/spider_data/test.json",
         schema_path="./benchmarks/spider_data/test_tables.json",
+        dynamic_padding=dynamic_padding,
+        cache_dir=cache_dir,
     )
@@ -0,0 +1,87 @@
+"""
+Throughput benchmark: SQL normalization over the SQL columns of the shipped result CSVs.
+
+Compares the regex passes data_gen used before (patterns compiled per call, one
+re.sub per keyword) with format_sql, which writes the same output in one pass,
+times the comparison forms, and reports how many distinct queries remain after
+canonicalization.
+
+    python common/bench_sql_normalizer.py
+    python common/bench_sql_normalizer.py "FINAL INFERENCE/din_sql_val_results_test_4o.csv" --repeat 20
+"""
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+import time
+
+from sql_normalizer import canonical_sql, format_sql, normalize_sql, sql_hash
+
+SQL_COLUMNS = ('predicted_sql', 'gold_sql', 'model_predicted_sql')
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def legacy_normalize(sql):
+    """The SQL post-processing of the old DINSQLPipeline._extract_reasoning_and_sql"""
+    re.compile(r'<REASONING>\s*(.*?)\s*</REASONING>.*?<SQL>\s*(.*?)\s*</SQL>', re.DOTALL | re.IGNORECASE)
+    sql = ' '.join(sql.split())
+    keywords = ['SELECT', 'FROM', 'WHERE', 'JOIN', 'ON', 'GROUP BY', 'ORDER BY', 'LIMIT', 'HAVING', 'COUNT', 'SUM', 'AVG', 'MIN', 'MAX']
+    for kw in keywords:
+        sql = re.sub(r'\b' + kw + r'\b', kw, sql, flags=re.IGNORECASE)
+    return sql
+
+
+def load_queries(paths):
+    csv.field_size_limit(sys.maxsize)
+    queries = []
+    for path in paths:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                queries.extend(row[column] for column in SQL_COLUMNS if row.get(column))
+    return queries
+
+
+def bench(name, fn, queries, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for sql in queries:
+            fn(sql)
+    elapsed = time.perf_counter() - started
+    n = len(queries) * repeat
+    print(f"{name:<18} {n / elapsed:>12,.0f} queries/s  ({elapsed / n * 1e6:.1f} us/query)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQL normalizer throughput benchmark')
+    parser.add_argument('csv_files', nargs='*',
+                        help='Result CSVs with SQL columns (default: every CSV in the repository)')
+    parser.add_argument('--repeat', type=int, default=10, help='Passes over the queries (default: 10)')
+    args = parser.parse_args()
+
+    paths = args.csv_files or sorted(glob.glob(os.path.join(REPO_ROOT, '**', '*.csv'), recursive=True))
+    queries = load_queries(paths)
+    if not queries:
+        parser.error("No SQL columns found in the given CSV files")
+    print(f"{len(queries)} SQL strings from {len(paths)} file(s), {args.repeat} passes\n")
+
+    legacy = bench('legacy regex', legacy_normalize, queries, args.repeat)
+    current = bench('format_sql', format_sql, queries, args.repeat)
+    bench('normalize_sql', normalize_sql, queries, args.repeat)
+    bench('canonical_sql', canonical_sql, queries, args.repeat)
+    bench('sql_hash', sql_hash, queries, args.repeat)
+    print(f"\nformat_sql speedup over legacy: {legacy / current:.1f}x")
+    # Only quoted text differs: the legacy passes also upper-cased keywords inside literals
+    changed = sum(format_sql(sql) != legacy_normalize(sql) for sql in queries)
+    print(f"format_sql output differs from legacy for {changed}/{len(queries)} queries")
+
+    distinct = len(set(queries))
+    distinct_normalized = len({normalize_sql(sql) for sql in queries})
+    distinct_canonical = len({sql_hash(sql) for sql in queries})
+    print(f"Distinct queries: {distinct} raw, {distinct_normalized} normalized, {distinct_canonical} canonical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""
+Loading of the DIN-SQL result files (see data_gen/result_writer.py) for the
+scripts that post-process them with pandas.
+"""
+import pandas as pd
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+
+
+def read_results(path: str) -> pd.DataFrame:
+    """
+    Load a DIN-SQL result file written as a JSON array, JSONL or Parquet (by extension).
+    The whole file is read into one DataFrame.
+    """
+    if path.endswith(PARQUET_EXTENSIONS):
+        return pd.read_parquet(path)
+    return pd.read_json(path, lines=path.endswith(JSONL_EXTENSIONS))
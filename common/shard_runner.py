@@ -0,0 +1,118 @@
+"""
+Runs an inference script as N data-parallel worker processes, one model replica
+each, and merges their outputs in the original row order.
+
+The cores this process may use are split into N disjoint groups; each worker is
+pinned to its group (sched_setaffinity, OMP_NUM_THREADS / MKL_NUM_THREADS set to
+the group size) and gets SHARD_INDEX / NUM_SHARDS, from which the script picks
+its rows (see sharding.py). With --gpus the workers are spread over the listed
+GPUs instead of sharing one.
+
+    python common/shard_runner.py run --shards 4 --outputs predictions.json -- python eval.py
+    python ../common/shard_runner.py run --shards 8 \\
+        --outputs gold_query.txt generated.txt -- python ./src/evaluate_model.py --device cpu
+
+Across nodes, submit the script as a SLURM array (each task evaluates the shard
+of its SLURM_ARRAY_TASK_ID) and merge once all tasks have finished:
+
+    jobid=$(sbatch --parsable --array=0-7 eval.sh)
+    sbatch --dependency=afterok:$jobid --wrap "python common/shard_runner.py merge --shards 8 predictions.json"
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+from sharding import NUM_SHARDS_ENV, SHARD_INDEX_ENV, Shard, merge_shards
+
+THREAD_ENVS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_groups(cores: List[int], shards: int, cores_per_shard: Optional[int] = None) -> List[List[int]]:
+    """Disjoint runs of neighbouring cores, one per shard"""
+    per_shard = cores_per_shard or len(cores) // shards
+    if per_shard < 1 or per_shard * shards > len(cores):
+        raise ValueError(f"{len(cores)} cores cannot be split into {shards} groups of {per_shard or 'at least 1'}")
+    return [cores[i * per_shard:(i + 1) * per_shard] for i in range(shards)]
+
+
+def shard_environment(shard: Shard, cores: List[int], gpu: Optional[str]) -> dict:
+    env = dict(os.environ, **{SHARD_INDEX_ENV: str(shard.index), NUM_SHARDS_ENV: str(shard.count)})
+    for name in THREAD_ENVS:
+        env[name] = str(len(cores))
+    if gpu is not None:
+        env['CUDA_VISIBLE_DEVICES'] = gpu
+    return env
+
+
+def run_shards(command: List[str], shards: int, cores_per_shard: Optional[int] = None,
+               gpus: Optional[List[str]] = None) -> List[int]:
+    """Start one pinned worker per shard and wait for all of them; returns the exit codes"""
+    groups = core_groups(available_cores(), shards, cores_per_shard)
+    workers = []
+    for index, cores in enumerate(groups):
+        shard = Shard(index, shards)
+        gpu = gpus[index % len(gpus)] if gpus else None
+        print(f"Starting {shard} on cores {cores[0]}-{cores[-1]}" + (f", GPU {gpu}" if gpu else ""), flush=True)
+        workers.append(subprocess.Popen(
+            command,
+            env=shard_environment(shard, cores, gpu),
+            # Pinned before exec, so every thread the worker starts stays on its cores
+            preexec_fn=(lambda cores=cores: os.sched_setaffinity(0, cores))
+            if hasattr(os, 'sched_setaffinity') else None,
+        ))
+    return [worker.wait() for worker in workers]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded data-parallel inference runner')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    run = subparsers.add_parser('run', help='Run the command once per shard, then merge its outputs')
+    run.add_argument('--shards', type=int, required=True, help='Number of worker processes')
+    run.add_argument('--cores-per-shard', type=int, default=None,
+                     help='Cores pinned to each worker (default: the available cores split evenly)')
+    run.add_argument('--gpus', nargs='+', default=None,
+                     help='GPU ids to spread the workers over, round robin (default: leave CUDA_VISIBLE_DEVICES as is)')
+    run.add_argument('--outputs', nargs='*', default=[],
+                     help='Output files the command writes, merged from the shard outputs (default: none)')
+    run.add_argument('--keep-parts', action='store_true', help='Keep the per-shard outputs after merging')
+    run.add_argument('command', nargs=argparse.REMAINDER, help='Inference command, after --')
+
+    merge = subparsers.add_parser('merge', help='Merge the shard outputs of finished SLURM array tasks')
+    merge.add_argument('--shards', type=int, required=True, help='Number of shards (array tasks)')
+    merge.add_argument('--keep-parts', action='store_true', help='Keep the per-shard outputs after merging')
+    merge.add_argument('outputs', nargs='+', help='Output files to merge')
+
+    args = parser.parse_args()
+
+    if args.action == 'run':
+        command = args.command[1:] if args.command[:1] == ['--'] else args.command
+        if not command:
+            parser.error("Missing the inference command after --")
+        started = time.perf_counter()
+        try:
+            codes = run_shards(command, args.shards, args.cores_per_shard, args.gpus)
+        except ValueError as e:
+            parser.error(str(e))
+        failed = [index for index, code in enumerate(codes) if code != 0]
+        if failed:
+            print(f"Shards {', '.join(map(str, failed))} failed; outputs were not merged", file=sys.stderr)
+            sys.exit(1)
+        print(f"{args.shards} shards finished in {time.perf_counter() - started:.1f} s")
+
+    for output in args.outputs:
+        merge_shards(output, args.shards, remove_parts=not args.keep_parts)
+        print(f"Merged {args.shards} shards into {output}")
+
+
+if __name__ == "__main__":
+    main()
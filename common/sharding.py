@@ -0,0 +1,124 @@
+"""
+Data-parallel sharding of the evaluation rows of the inference scripts.
+
+A shard is one contiguous slice of the rows, so concatenating the shard outputs
+in shard order gives the rows in their original order. Each inference process
+finds its shard in the environment:
+
+    SHARD_INDEX / NUM_SHARDS            set by shard_runner.py for its worker processes
+    SLURM_ARRAY_TASK_ID / _COUNT        one shard per task of an `sbatch --array` job
+
+and writes its outputs next to the unsharded paths (`generated.txt` becomes
+`generated.shard-00001-of-00004.txt`). merge_shards joins them back. Without
+either variable a script sees the single shard covering all rows and writes
+the usual paths. Scripts working on a pandas DataFrame take their rows with
+shard_frame, so they all number and label rows the same way.
+"""
+import json
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+SHARD_INDEX_ENV = 'SHARD_INDEX'
+NUM_SHARDS_ENV = 'NUM_SHARDS'
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int = 0
+    count: int = 1
+
+    def __post_init__(self):
+        if self.count < 1 or not 0 <= self.index < self.count:
+            raise ValueError(f"Invalid shard {self.index} of {self.count}")
+
+    @property
+    def sharded(self) -> bool:
+        return self.count > 1
+
+    def bounds(self, n_rows: int) -> Tuple[int, int]:
+        """[start, stop) of this shard's rows; shard sizes differ by at most one row"""
+        return n_rows * self.index // self.count, n_rows * (self.index + 1) // self.count
+
+    def slice(self, n_rows: int) -> slice:
+        return slice(*self.bounds(n_rows))
+
+    def path(self, path: str) -> str:
+        """Where this shard writes the output that unsharded runs write to `path`"""
+        if not self.sharded:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.shard-{self.index:05d}-of-{self.count:05d}{ext}"
+
+    def __str__(self):
+        return f"shard {self.index + 1}/{self.count}"
+
+
+def current_shard() -> Shard:
+    if NUM_SHARDS_ENV in os.environ:
+        return Shard(int(os.environ.get(SHARD_INDEX_ENV, 0)), int(os.environ[NUM_SHARDS_ENV]))
+    if 'SLURM_ARRAY_TASK_COUNT' in os.environ:
+        # Array ids need not start at 0 (--array=1-8)
+        first = int(os.environ.get('SLURM_ARRAY_TASK_MIN', 0))
+        return Shard(int(os.environ['SLURM_ARRAY_TASK_ID']) - first, int(os.environ['SLURM_ARRAY_TASK_COUNT']))
+    return Shard()
+
+
+def shard_frame(df, shard: Optional[Shard] = None):
+    """
+    The rows of the pandas DataFrame `df` that belong to `shard` (default: current_shard()),
+    as a copy labelled by position in the whole of `df`: row labels, and any numbering
+    derived from them, are those of an unsharded run, so the shard outputs merge back in order.
+    """
+    shard = shard or current_shard()
+    return df.reset_index(drop=True).iloc[shard.slice(len(df))].copy()
+
+
+def shard_paths(path: str, count: int) -> List[str]:
+    return [Shard(index, count).path(path) for index in range(count)]
+
+
+def _merge_json(parts: list):
+    """Lists are concatenated; column-oriented dicts ({column: {row: value}}) are merged per column"""
+    if all(isinstance(part, list) for part in parts):
+        return [item for part in parts for item in part]
+    if all(isinstance(part, dict) and all(isinstance(value, dict) for value in part.values()) for part in parts):
+        merged = {}
+        for part in parts:
+            for column, rows in part.items():
+                merged.setdefault(column, {}).update(rows)
+        return merged
+    raise ValueError("Only JSON lists and column-oriented JSON objects can be merged")
+
+
+def merge_shards(path: str, count: int, remove_parts: bool = True) -> str:
+    """
+    Join the `count` shard outputs of `path` in shard order: .json files as JSON,
+    anything else line-oriented. The merged file is written under a temporary
+    name and renamed, so `path` is never left half written.
+    """
+    parts = shard_paths(path, count)
+    missing = [part for part in parts if not os.path.exists(part)]
+    if missing:
+        raise FileNotFoundError(f"Missing shard outputs of {path}: {', '.join(missing)}")
+    tmp_path = path + '.tmp'
+    if path.endswith('.json'):
+        loaded = []
+        for part in parts:
+            with open(part, encoding='utf-8') as f:
+                loaded.append(json.load(f))
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(_merge_json(loaded), f, indent=4)
+    else:
+        with open(tmp_path, 'wb') as out:
+            for part in parts:
+                with open(part, 'rb') as f:
+                    data = f.read()
+                out.write(data)
+                if data and not data.endswith(b'\n'):
+                    out.write(b'\n')
+    os.replace(tmp_path, path)
+    if remove_parts:
+        for part in parts:
+            os.remove(part)
+    return path
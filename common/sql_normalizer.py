@@ -0,0 +1,191 @@
+"""
+SQL normalization shared by data generation and evaluation.
+
+SQL strings are split by one precompiled tokenizer pattern in a single pass, so
+keyword casing never touches string literals or quoted identifiers.
+
+    format_sql      the output form of generated SQL: whitespace collapsed and the
+                    clause keywords and aggregates of OUTPUT_KEYWORDS upper-cased,
+                    as data_gen has always written predicted_sql
+    normalize_sql   whitespace collapsed, comments dropped and every SQL keyword
+                    upper-cased (for comparing queries, never written to outputs)
+    canonical_sql   normalized form that ignores identifier case, quoting style and
+                    spacing; semantically equivalent for SQLite
+    sql_hash        stable hash of canonical_sql, for dedup and cache keys
+
+It also holds the answer extraction used on model outputs (<SQL> tags, [SQL] markers).
+
+Scripts outside this directory import it after adding it to sys.path:
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+"""
+import hashlib
+import re
+from typing import Iterator, List, Optional, Tuple
+
+KEYWORDS = frozenset("""
+    SELECT FROM WHERE JOIN INNER LEFT RIGHT FULL OUTER CROSS NATURAL ON USING AS
+    GROUP BY ORDER HAVING LIMIT OFFSET DISTINCT ALL UNION INTERSECT EXCEPT
+    AND OR NOT IN IS NULL LIKE GLOB BETWEEN EXISTS CASE WHEN THEN ELSE END
+    ASC DESC WITH RECURSIVE
+""".split())
+
+# Upper-cased only when called, so columns named e.g. "count" keep their case
+FUNCTIONS = frozenset("COUNT SUM AVG MIN MAX CAST".split())
+
+# The words format_sql upper-cases: the set data_gen's training data has always used
+OUTPUT_KEYWORDS = ('SELECT', 'FROM', 'WHERE', 'JOIN', 'ON', 'GROUP BY', 'ORDER BY', 'LIMIT', 'HAVING',
+                   'COUNT', 'SUM', 'AVG', 'MIN', 'MAX')
+
+# Token kinds, in match order
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:[^']|'')*'?)
+  | (?P<quoted>"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[^\W\d]\w*|\$\w+)
+  | (?P<operator><=|>=|<>|!=|==|\|\||<<|>>|[-+*/%<>=~&|])
+  | (?P<punct>[(),.;])
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# normalize_sql only visits literals (kept), whitespace/comment runs (one space),
+# keywords and called functions; everything else is copied by re.sub without a Python call
+_NORMALIZE_PATTERN = re.compile(rf"""
+    (?P<literal>'(?:[^']|'')*'?|"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?)
+  | (?P<gap>(?:\s|--[^\n]*|/\*.*?(?:\*/|\Z))+)
+  | \b(?:{'|'.join(sorted(KEYWORDS))})\b
+  | \b(?:{'|'.join(sorted(FUNCTIONS))})\b(?=\s*\()
+""", re.VERBOSE | re.DOTALL | re.IGNORECASE)
+# String literals and quoted identifiers (kept) or an output keyword (upper-cased)
+_FORMAT_PATTERN = re.compile(rf"""
+    (?P<literal>'(?:[^']|'')*'?|"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?)
+  | \b(?:{'|'.join(map(re.escape, OUTPUT_KEYWORDS))})\b
+""", re.VERBOSE | re.IGNORECASE)
+_SIMPLE_IDENTIFIER = re.compile(r"[^\W\d]\w*")
+_TAGGED_BLOCKS = {}
+_REASONING_AND_SQL = {
+    tag: re.compile(rf'<{tag}>\s*(.*?)\s*</{tag}>.*?<SQL>\s*(.*?)\s*</SQL>', re.DOTALL | re.IGNORECASE)
+    for tag in ('REASONING', 'chains')
+}
+
+
+def tokenize(sql: str) -> Iterator[Tuple[str, str]]:
+    """(kind, text) for every token of `sql`, whitespace and comments included"""
+    for match in _TOKEN_PATTERN.finditer(sql):
+        yield match.lastgroup, match.group()
+
+
+def _significant_tokens(sql: str) -> List[Tuple[str, str]]:
+    return [(kind, text) for kind, text in tokenize(sql) if kind not in ('space', 'comment')]
+
+
+def _case_words(tokens: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Upper-case keywords and called functions"""
+    cased = []
+    for i, (kind, text) in enumerate(tokens):
+        if kind == 'word':
+            upper = text.upper()
+            if upper in KEYWORDS:
+                text = upper
+            elif upper in FUNCTIONS and i + 1 < len(tokens) and tokens[i + 1][1] == '(':
+                text = upper
+        cased.append((kind, text))
+    return cased
+
+
+def _normalize_token(match: re.Match) -> str:
+    kind = match.lastgroup
+    if kind == 'gap':
+        return ' '
+    if kind == 'literal':
+        return match.group()
+    return match.group().upper()
+
+
+def _format_token(match: re.Match) -> str:
+    return match.group() if match.lastgroup == 'literal' else match.group().upper()
+
+
+def format_sql(sql: str) -> str:
+    """Collapse whitespace and upper-case OUTPUT_KEYWORDS outside quotes, keeping everything else as written"""
+    return _FORMAT_PATTERN.sub(_format_token, ' '.join(sql.split()))
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace, drop comments and upper-case keywords, keeping everything else as written"""
+    return _NORMALIZE_PATTERN.sub(_normalize_token, sql).strip()
+
+
+def _canonical_identifier(text: str) -> str:
+    """
+    `name` and [name] as a bare lower-case name when that is unambiguous, else "name".
+    Double-quoted tokens are kept verbatim: SQLite reads "x" as a string literal when
+    no column x exists, and Spider uses them as strings throughout.
+    """
+    if text[0] == '"':
+        return text
+    if text[0] == '[':
+        name = text[1:-1]
+    else:
+        name = text[1:-1].replace('``', '`')
+    if _SIMPLE_IDENTIFIER.fullmatch(name) and name.upper() not in KEYWORDS:
+        return name.lower()
+    return '"' + name.replace('"', '""') + '"'
+
+
+def canonical_sql(sql: str) -> str:
+    """
+    Canonical form for comparing and hashing SQL: keywords upper-case, identifiers
+    lower-case with uniform quoting, one space between tokens except around '(',
+    ')', ',' and '.', no trailing semicolon. String literals are kept verbatim.
+    """
+    tokens = _case_words(_significant_tokens(sql))
+    while tokens and tokens[-1][1] == ';':
+        tokens.pop()
+    out = []
+    previous = None
+    for kind, text in tokens:
+        if kind == 'word' and text not in KEYWORDS and text not in FUNCTIONS:
+            text = text.lower()
+        elif kind == 'quoted':
+            text = _canonical_identifier(text)
+        if previous is not None and previous not in ('(', '.') and text not in (')', ',', '.', ';') \
+                and not (text == '(' and previous in FUNCTIONS):
+            out.append(' ')
+        out.append(text)
+        previous = text
+    return ''.join(out)
+
+
+def sql_hash(sql: str) -> str:
+    """Stable (process- and run-independent) 16-hex-digit hash of canonical_sql"""
+    return hashlib.blake2b(canonical_sql(sql).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def extract_tagged_blocks(text: str, tag: str = 'SQL') -> List[str]:
+    """Stripped contents of every <tag>...</tag> block"""
+    pattern = _TAGGED_BLOCKS.get(tag)
+    if pattern is None:
+        pattern = _TAGGED_BLOCKS[tag] = re.compile(rf'<{tag}>(.*?)</{tag}>', re.DOTALL)
+    return [block.strip() for block in pattern.findall(text)]
+
+
+def extract_reasoning_and_sql(response: str) -> Optional[Tuple[str, str]]:
+    """
+    Reasoning (<REASONING> or <chains>) and SQL (<SQL>) of an LLM response, both with
+    whitespace collapsed and the SQL in format_sql form; None when the tags are missing.
+    """
+    tag = 'chains' if '<chains>' in response else 'REASONING' if '<REASONING>' in response else None
+    if tag is None:
+        return None
+    match = _REASONING_AND_SQL[tag].search(response)
+    if not match:
+        return None
+    return ' '.join(match.group(1).split()), format_sql(match.group(2))
+
+
+def extract_after_marker(output: str, marker: str = '[SQL]', stop: str = '[') -> str:
+    """SQL following the last `marker` up to the next `stop` (prompt formats with [SQL] markers), on one line"""
+    return output.split(marker)[-1].split(stop)[0].replace('\n', ' ').strip()
@@ -0,0 +1,179 @@
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from retry_policy import RETRYABLE_STATUS, TransientError, parse_retry_after
+
+BACKENDS = ('openai', 'hf')
+
+
+@dataclass
+class BackendResponse:
+    """Completion text and the token usage reported (or counted) by the backend"""
+    text: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+
+
+class OpenAIBackend:
+    """
+    Chat completions through the OpenAI API, or any OpenAI-compatible server
+    (vLLM, llama.cpp, TGI, ...) when `base_url` is given.
+
+    The client's own retries are disabled; rate limits, server errors and lost
+    connections are raised as TransientError for the engine's retry policy.
+    """
+    kind = 'openai'
+
+    def __init__(self, model: str, base_url: Optional[str] = None, api_key: Optional[str] = None):
+        import openai
+
+        self.openai = openai
+        self.model = model
+        self.base_url = base_url
+        # Local servers usually ignore the key, but the client refuses to start without one
+        api_key = api_key or os.getenv('OPENAI_API_KEY') or ('EMPTY' if base_url else None)
+        self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.tokenizer = None
+
+    async def acreate(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> BackendResponse:
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+        except self.openai.APIStatusError as e:
+            if e.status_code not in RETRYABLE_STATUS:
+                raise
+            raise TransientError(str(e), status=e.status_code,
+                                 retry_after=parse_retry_after(e.response.headers)) from e
+        except self.openai.APIConnectionError as e:
+            raise TransientError(str(e)) from e
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return BackendResponse(response.choices[0].message.content)
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return BackendResponse(
+            text=response.choices[0].message.content,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens or 0,
+            cached_prompt_tokens=getattr(details, 'cached_tokens', None) or 0,
+        )
+
+
+class HFBackend:
+    """
+    Local generation with a Hugging Face `AutoModelForCausalLM` (e.g. seeklhy/codes-7b).
+
+    Requests arriving on the engine's event loop within `batch_wait` seconds of each
+    other are padded into one batch of up to `batch_size` prompts and generated
+    together on a worker thread, so concurrent questions share the forward passes.
+    Chat messages go through the tokenizer's chat template when it has one;
+    base models get the message contents concatenated.
+    """
+    kind = 'hf'
+    base_url = None
+
+    def __init__(self, model: str, device: Optional[str] = None, dtype: str = 'auto', batch_size: int = 8,
+                 batch_wait: float = 0.05):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.torch = torch
+        self.model = model
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        torch_dtype = dtype if dtype == 'auto' else getattr(torch, dtype)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model, padding_side="left")
+        self.lm = AutoModelForCausalLM.from_pretrained(
+            model,
+            trust_remote_code=True,
+            torch_dtype=torch_dtype,
+            device_map=device,
+        )
+        self.lm.eval()
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self._queue = None
+        self._batcher = None
+
+    def render(self, messages: List[Dict[str, str]]) -> str:
+        if getattr(self.tokenizer, 'chat_template', None):
+            return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return "".join(message['content'] for message in messages)
+
+    def generate(self, batch: List[tuple]) -> List[BackendResponse]:
+        """Generate one padded batch of (messages, temperature, max_tokens) requests"""
+        torch = self.torch
+        prompts = [self.render(messages) for messages, _, _ in batch]
+        temperature = max(temperature for _, temperature, _ in batch)
+        max_new_tokens = max(max_tokens for _, _, max_tokens in batch)
+
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.lm.device)
+        sampling = {'do_sample': True, 'temperature': temperature} if temperature > 0 else {'do_sample': False}
+        with torch.inference_mode():
+            outputs = self.lm.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **sampling,
+            )
+
+        generated = outputs[:, inputs['input_ids'].shape[1]:]
+        prompt_tokens = inputs['attention_mask'].sum(dim=1).tolist()
+        completion_tokens = (generated != self.tokenizer.pad_token_id).sum(dim=1).tolist()
+        texts = self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+        return [BackendResponse(text, prompt, completion)
+                for text, prompt, completion in zip(texts, prompt_tokens, completion_tokens)]
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, _ in batch]
+            try:
+                responses = await loop.run_in_executor(None, self.generate, requests)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+    async def acreate(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> BackendResponse:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.get_running_loop().create_task(self._batch_loop())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((messages, temperature, max_tokens), future))
+        return await future
+
+
+def create_backend(config: dict):
+    """Build the completion backend described by a pipeline config's `backend` entry"""
+    kind = config.get('kind', 'openai')
+    if kind == 'openai':
+        return OpenAIBackend(config['model'], base_url=config.get('base_url'), api_key=config.get('api_key'))
+    if kind == 'hf':
+        return HFBackend(config['model'], device=config.get('device'), dtype=config.get('dtype', 'auto'),
+                         batch_size=config.get('batch_size', 8), batch_wait=config.get('batch_wait', 0.05))
+    raise ValueError(f"Unknown backend: {kind}")
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from prompt_layout import messages_key
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# local_batch_runner.py next to this file, run by the current interpreter, so the command works from any directory
+LOCAL_BATCH_COMMAND = " ".join([
+    shlex.quote(sys.executable),
+    shlex.quote(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_batch_runner.py')),
+    "--input {input} --output {output}",
+])
+
+
+def write_batch_requests(path: str, prompts: Dict[str, List[dict]], model: str, temperature: float,
+                         max_tokens: int):
+    """Write one chat completion request per message list in the OpenAI Batch API JSONL format"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for custom_id, messages in prompts.items():
+            request = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": model,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                },
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + '\n')
+
+
+def read_batch_results(path: str, usage: Optional[dict] = None) -> Dict[str, Optional[str]]:
+    """
+    Map custom_id to the completion text of a Batch API output file (None for failed requests).
+    If `usage` is given it is filled with custom_id -> (prompt_tokens, completion_tokens, cached_prompt_tokens).
+    """
+    results = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            body = response.get('body') or {}
+            if record.get('error') or response.get('status_code', 200) != 200 or not body.get('choices'):
+                logger.warning("Batch request %s failed: %s", record.get('custom_id'),
+                               record.get('error') or body.get('error'))
+                results[record['custom_id']] = None
+                continue
+            results[record['custom_id']] = body['choices'][0]['message']['content']
+            if usage is not None:
+                tokens = body.get('usage') or {}
+                details = tokens.get('prompt_tokens_details') or {}
+                usage[record['custom_id']] = (tokens.get('prompt_tokens', 0), tokens.get('completion_tokens', 0),
+                                              details.get('cached_tokens') or 0)
+    return results
+
+
+class OpenAIBatchExecutor:
+    """Submit a request file to the OpenAI Batch API and wait for its output file"""
+
+    def __init__(self, client, poll_interval: float = 60, completion_window: str = "24h"):
+        self.client = client
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+
+    def run(self, requests_path: str, results_path: str):
+        with open(requests_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window=self.completion_window)
+        logger.info("Submitted batch %s for %s", batch.id, requests_path)
+
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            logger.info("Batch %s: %s %s", batch.id, batch.status, batch.request_counts)
+
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+
+        # Failed requests are reported in a separate error file with the same line format
+        with open(results_path, 'w', encoding='utf-8') as f:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    f.write(self.client.files.content(file_id).text)
+
+
+class CommandBatchExecutor:
+    """
+    Run a local stand-in for the Batch API, e.g. LOCAL_BATCH_COMMAND or
+    `python local_batch_runner.py --input {input} --output {output} --base-url http://localhost:8000/v1`.
+    The command must read the request file and write a result file in the Batch API output format.
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+
+    def run(self, requests_path: str, results_path: str):
+        command = self.command.format(input=shlex.quote(requests_path), output=shlex.quote(results_path))
+        logger.info("Running batch command: %s", command)
+        subprocess.run(command, shell=True, check=True)
+
+
+def run_batch_stage(name: str, prompts: Dict[str, List[dict]], work_dir: str, executor, model: str,
+                    temperature: float, max_tokens: int, cache=None, usage=None, backend: str = 'openai',
+                    base_url: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """
+    Get completions for every prompt (a chat message list) of one pipeline stage through a single batch.
+
+    Prompts already in the completion cache are answered locally. If the stage's
+    result file exists and was produced from an identical request file, it is
+    ingested instead of being submitted again, so an interrupted run (or a batch
+    submitted by hand) picks up where it stopped. Token usage of every request is
+    added to the `usage` recorder when one is given. `backend` and `base_url` only
+    enter the cache keys, so they match those of the interactive requests.
+    """
+    responses = {}
+    keys = {}
+    if cache is not None:
+        for custom_id, prompt in prompts.items():
+            keys[custom_id] = cache.make_key(model, messages_key(prompt), temperature, max_tokens,
+                                             backend=backend, base_url=base_url)
+            cached = cache.get(keys[custom_id])
+            if cached is not None:
+                responses[custom_id] = cached
+                if usage is not None:
+                    usage.record(name, cached=True)
+
+    pending = {custom_id: prompt for custom_id, prompt in prompts.items() if custom_id not in responses}
+    logger.info("Stage %s: %d prompts, %d cached, %d to run in batch", name, len(prompts), len(responses), len(pending))
+    if not pending:
+        return responses
+
+    requests_path = os.path.join(work_dir, f"{name}.requests.jsonl")
+    results_path = os.path.join(work_dir, f"{name}.results.jsonl")
+    tmp_path = requests_path + '.tmp'
+    write_batch_requests(tmp_path, pending, model, temperature, max_tokens)
+
+    reuse = False
+    if os.path.exists(requests_path) and os.path.exists(results_path):
+        with open(tmp_path, 'rb') as new, open(requests_path, 'rb') as old:
+            reuse = new.read() == old.read()
+    os.replace(tmp_path, requests_path)
+
+    if reuse:
+        logger.info("Stage %s: ingesting existing results from %s", name, results_path)
+    else:
+        if os.path.exists(results_path):
+            os.remove(results_path)
+        executor.run(requests_path, results_path)
+
+    tokens = {}
+    results = read_batch_results(results_path, usage=tokens)
+    for custom_id in pending:
+        response = results.get(custom_id)
+        responses[custom_id] = response
+        if usage is not None:
+            prompt_tokens, completion_tokens, cached_prompt_tokens = tokens.get(custom_id, (0, 0, 0))
+            usage.record(name, prompt_tokens, completion_tokens, error=response is None,
+                         cached_prompt_tokens=cached_prompt_tokens)
+        if cache is not None and response is not None:
+            cache.put(keys[custom_id], model, response)
+    return responses
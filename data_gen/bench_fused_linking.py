@@ -0,0 +1,85 @@
+"""
+Benchmark: schema linking + classification as two serial requests vs. one fused request.
+
+Runs the same sample of questions through both paths with the completion cache off
+and reports, per question, the wall-clock latency and the prompt/completion tokens of
+steps 1+2, plus how often the fused response had to fall back to the separate calls.
+
+    python bench_fused_linking.py --schema spider/tables.json --input spider/dev.json --limit 50
+"""
+import argparse
+import json
+import random
+import time
+
+from din_sql_modified import MODEL_NAME, DINSQLPipeline
+from metrics import percentile
+from schema_catalog import load_schema_catalog
+
+
+def describe(values):
+    values = sorted(values)
+    mean = sum(values) / len(values) if values else 0
+    return f"mean {mean:8.1f}  p50 {percentile(values, 50) or 0:8.1f}  p90 {percentile(values, 90) or 0:8.1f}"
+
+
+def run_path(pipeline, questions, schemas, fused):
+    """Per-question (latency, prompt tokens, completion tokens, requests) of steps 1+2"""
+    samples = []
+    for q in questions:
+        schema = schemas[q['db_id']]
+        pipeline.usage.drain()
+        start = time.perf_counter()
+        if fused:
+            pipeline.link_and_classify(q['question'], schema, q['db_id'])
+        else:
+            schema_links = pipeline.schema_linking(q['question'], schema, q['db_id'])
+            pipeline.classify_query(q['question'], schema_links, schema, q['db_id'])
+        latency = time.perf_counter() - start
+        records = pipeline.usage.drain()
+        samples.append((latency, sum(r.prompt_tokens for r in records),
+                        sum(r.completion_tokens for r in records), len(records)))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fused schema linking + classification benchmark')
+    parser.add_argument('--schema', default="spider/tables.json", help='Path to tables.json')
+    parser.add_argument('--input', default="spider/dev.json", help='Questions JSON (question, db_id)')
+    parser.add_argument('--limit', type=int, default=50, help='Questions to sample (default: 50)')
+    parser.add_argument('--seed', type=int, default=0, help='Sampling seed (default: 0)')
+    parser.add_argument('--model', default=MODEL_NAME, help=f'Model name (default: {MODEL_NAME})')
+    parser.add_argument('--base-url', default=None, help='Base URL of an OpenAI-compatible server')
+    args = parser.parse_args()
+
+    with open(args.input) as f:
+        questions = json.load(f)
+    pipeline = DINSQLPipeline(backend_config={'kind': 'openai', 'model': args.model, 'base_url': args.base_url})
+    schemas = pipeline.attach_catalog(load_schema_catalog(args.schema))
+    questions = [q for q in questions if q['db_id'] in schemas]
+    questions = random.Random(args.seed).sample(questions, min(args.limit, len(questions)))
+
+    results = {}
+    for name, fused in (('two-call', False), ('fused', True)):
+        results[name] = run_path(pipeline, questions, schemas, fused)
+    pipeline.engine.close()
+
+    print(f"\n{len(questions)} questions, model {args.model}")
+    for name, samples in results.items():
+        latency, prompt_tokens, completion_tokens, requests = zip(*samples)
+        print(f"{name:>9}: latency ms   {describe([x * 1000 for x in latency])}")
+        print(f"{'':>9}  prompt tok   {describe(prompt_tokens)}")
+        print(f"{'':>9}  output tok   {describe(completion_tokens)}")
+        print(f"{'':>9}  requests     {sum(requests) / len(requests):.2f} per question")
+
+    # Fused questions that needed more than one request fell back to the separate calls
+    fallbacks = sum(1 for sample in results['fused'] if sample[3] > 1)
+    base = [sum(x) for x in zip(*results['two-call'])][:2]
+    fused = [sum(x) for x in zip(*results['fused'])][:2]
+    print(f"\nFused fallbacks: {fallbacks}/{len(questions)}")
+    print(f"Latency saved: {(1 - fused[0] / base[0]) * 100:.1f}%, "
+          f"prompt tokens saved: {(1 - fused[1] / base[1]) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Micro-benchmark: per-question CPU spent rendering schema strings for the DIN-SQL prompts.
+
+Compares the old approach (filter the full schema DataFrames by db_id and build the
+strings with iterrows on every call) with the precomputed per-db_id renderings.
+
+    python bench_schema_rendering.py --schema spider/tables.json
+"""
+import argparse
+import json
+import random
+import time
+
+import pandas as pd
+
+from schema_catalog import build_schema_renderings, parse_schema_rows
+
+
+# The DataFrame-based helpers as they were before the renderings were precomputed
+def legacy_fields(spider_schema, db_name):
+    df = spider_schema[spider_schema['Database name'] == db_name]
+    df = df.groupby('Table Name')
+    output = ""
+    for name, group in df:
+        output += "Table " + name + ', columns = ['
+        for index, row in group.iterrows():
+            output += row["Field Name"] + ','
+        output = output[:-1]
+        output += "]\n"
+    return output
+
+
+def legacy_primary_keys(spider_primary, db_name):
+    df = spider_primary[spider_primary['Database name'] == db_name]
+    output = "["
+    for index, row in df.iterrows():
+        output += row['Table Name'] + '.' + row['Primary Key'] + ','
+    output = output[:-1] + "]" if output != "[" else "[]"
+    return output
+
+
+def legacy_foreign_keys(spider_foreign, db_name):
+    df = spider_foreign[spider_foreign['Database name'] == db_name]
+    output = "["
+    for index, row in df.iterrows():
+        output += row['First Table Name'] + '.' + row['First Table Foreign Key'] + \
+                  " = " + row['Second Table Name'] + '.' + row['Second Table Foreign Key'] + ','
+    output = output[:-1] + "]" if output != "[" else "[]"
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Schema rendering micro-benchmark')
+    parser.add_argument('--schema', default="spider/tables.json", help='Path to tables.json')
+    parser.add_argument('--questions', type=int, default=500, help='Simulated questions (default: 500)')
+    args = parser.parse_args()
+
+    with open(args.schema) as f:
+        databases = json.load(f)
+    schema, p_keys, f_keys = parse_schema_rows(databases)
+
+    spider_schema = pd.DataFrame(schema, columns=['Database name', 'Table Name', 'Field Name', 'Type'])
+    spider_primary = pd.DataFrame(p_keys, columns=['Database name', 'Table Name', 'Primary Key'])
+    spider_foreign = pd.DataFrame(f_keys, columns=['Database name', 'First Table Name', 'Second Table Name',
+                                                   'First Table Foreign Key', 'Second Table Foreign Key'])
+
+    start = time.perf_counter()
+    renderings = build_schema_renderings(schema, p_keys, f_keys)
+    build_time = time.perf_counter() - start
+
+    db_ids = sorted(renderings)
+    print(f"{len(db_ids)} databases, {len(schema)} fields, {len(p_keys)} primary keys, {len(f_keys)} foreign keys")
+
+    # The renderings must be byte-identical to what the prompt makers used to build
+    for db_id in db_ids:
+        assert renderings[db_id].fields == legacy_fields(spider_schema, db_id), db_id
+        assert renderings[db_id].foreign_keys == legacy_foreign_keys(spider_foreign, db_id), db_id
+        assert renderings[db_id].primary_keys == legacy_primary_keys(spider_primary, db_id), db_id
+
+    rng = random.Random(0)
+    questions = [rng.choice(db_ids) for _ in range(args.questions)]
+
+    # One question renders fields + foreign keys for classification and again for generation
+    start = time.perf_counter()
+    for db_id in questions:
+        for _ in range(2):
+            legacy_fields(spider_schema, db_id)
+            legacy_foreign_keys(spider_foreign, db_id)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for db_id in questions:
+        for _ in range(2):
+            renderings[db_id].fields
+            renderings[db_id].foreign_keys
+    lookup_time = time.perf_counter() - start
+
+    legacy_us = legacy_time / len(questions) * 1e6
+    lookup_us = lookup_time / len(questions) * 1e6
+    print(f"One-time rendering of all databases: {build_time * 1e3:.1f} ms")
+    print(f"DataFrame filtering per question:   {legacy_us:10.1f} us")
+    print(f"Precomputed lookup per question:    {lookup_us:10.1f} us")
+    print(f"CPU saved per question:             {legacy_us - lookup_us:10.1f} us "
+          f"({legacy_us / max(lookup_us, 1e-9):.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
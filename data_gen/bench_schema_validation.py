@@ -0,0 +1,141 @@
+"""
+Micro-benchmark: schema-link validation on the Spider schemas.
+
+Times building the per-database indexes, the old linear validator and the indexed
+validator (with and without fuzzy repair). Link lists come from a result file when
+given, otherwise they are sampled from the schemas and perturbed (case changes,
+typos, table aliases, made-up columns), which also gives the repair accuracy.
+
+    python bench_schema_validation.py --schema spider/tables.json
+    python bench_schema_validation.py --schema spider/tables.json --links din_sql_results.json
+"""
+import argparse
+import csv
+import random
+import sys
+import time
+
+from result_writer import iter_result_file
+from schema_catalog import load_schema_catalog
+from schema_validator import build_schema_indexes
+
+
+def legacy_validate(schema_links, schema):
+    """The validator that used to be commented out in DINSQLPipeline.schema_linking"""
+    links = schema_links.strip('[]').split(',')
+    valid_links = []
+    valid_tables = set(schema.tables.keys())
+    for link in links:
+        link = link.strip()
+        if not link:
+            continue
+        if '=' in link:
+            left, right = link.split('=')[:2]
+            left, right = left.strip(), right.strip()
+            if '.' in left and '.' in right:
+                left_table, left_col = left.split('.')[:2]
+                right_table, right_col = right.split('.')[:2]
+                if (left_table in valid_tables and right_table in valid_tables and
+                        left_col in schema.tables[left_table] and right_col in schema.tables[right_table]):
+                    valid_links.append(f"{left} = {right}")
+        elif '.' in link:
+            table, column = link.split('.')[:2]
+            if table in valid_tables and column in schema.tables[table]:
+                valid_links.append(link)
+    return f"[{', '.join(valid_links)}]"
+
+
+def _typo(name, rng):
+    i = rng.randrange(len(name))
+    return name[:i] + name[i + 1:] if rng.random() < 0.5 else name[:i] + name[i] + name[i:]
+
+
+def synthetic_cases(schemas, per_db, seed):
+    """(db_id, perturbed links, expected links) with one perturbed column reference each"""
+    rng = random.Random(seed)
+    cases = []
+    for db_id, schema in sorted(schemas.items()):
+        refs = [(table, column) for table, columns in schema.tables.items() for column in columns]
+        if not refs:
+            continue
+        for _ in range(per_db):
+            table, column = rng.choice(refs)
+            others = [f"{t}.{c}" for t, c in rng.sample(refs, min(2, len(refs)))]
+            kind = rng.choice(['case', 'typo', 'alias', 'unknown'])
+            if kind == 'case':
+                broken = f"{table.lower()}.{column.upper()}"
+                expected = f"{table}.{column}"
+            elif kind == 'typo' and len(column) >= 8:
+                broken = f"{table}.{_typo(column, rng)}"
+                expected = f"{table}.{column}"
+            elif kind == 'alias' and sum(c.lower() == column.lower() for _, c in refs) == 1:
+                broken = f"T1.{column}"
+                expected = f"{table}.{column}"
+            else:
+                broken = f"{table}.made_up_column_{rng.randrange(1000)}"
+                expected = None
+            links = f"[{', '.join(others + [broken, repr('value')])}]"
+            expected_links = f"[{', '.join(others + ([expected] if expected else []) + [repr('value')])}]"
+            cases.append((db_id, links, expected_links))
+    return cases
+
+
+def load_link_cases(path):
+    if path.endswith('.csv'):
+        csv.field_size_limit(sys.maxsize)
+        with open(path, newline='', encoding='utf-8') as f:
+            records = list(csv.DictReader(f))
+    else:
+        records = list(iter_result_file(path))
+    return [(record['db_id'], record['schema_links'], None) for record in records if record.get('schema_links')]
+
+
+def timed(fn, cases, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for case in cases:
+            fn(case)
+    return (time.perf_counter() - started) / (len(cases) * repeat) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Schema-link validation micro-benchmark')
+    parser.add_argument('--schema', default="spider/tables.json", help='Spider tables.json (default: spider/tables.json)')
+    parser.add_argument('--links', default=None,
+                        help='Result file (JSON, JSONL, Parquet or CSV) with db_id and schema_links columns '
+                             '(default: perturbed links sampled from the schemas)')
+    parser.add_argument('--per-db', type=int, default=50, help='Synthetic link lists per database (default: 50)')
+    parser.add_argument('--repeat', type=int, default=5, help='Passes over the link lists (default: 5)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    schemas = load_schema_catalog(args.schema).schemas
+    started = time.perf_counter()
+    indexes = build_schema_indexes(schemas)
+    build_ms = (time.perf_counter() - started) * 1000
+    print(f"Indexed {len(indexes)} databases in {build_ms:.1f} ms")
+
+    cases = load_link_cases(args.links) if args.links else synthetic_cases(schemas, args.per_db, args.seed)
+    cases = [case for case in cases if case[0] in schemas]
+    print(f"{len(cases)} link lists, {args.repeat} passes\n")
+
+    legacy_us = timed(lambda case: legacy_validate(case[1], schemas[case[0]]), cases, args.repeat)
+    exact_us = timed(lambda case: indexes[case[0]].check(case[1], fuzzy=False), cases, args.repeat)
+    repair_us = timed(lambda case: indexes[case[0]].check(case[1], fuzzy=True), cases, args.repeat)
+    print(f"{'legacy linear':<22} {legacy_us:8.1f} us/question")
+    print(f"{'indexed (drop)':<22} {exact_us:8.1f} us/question")
+    print(f"{'indexed (repair)':<22} {repair_us:8.1f} us/question")
+
+    checks = [indexes[db_id].check(links) for db_id, links, _ in cases]
+    print(f"\nChanged {sum(check.changed for check in checks)}/{len(checks)} link lists: "
+          f"{sum(len(check.repaired) for check in checks)} links repaired, "
+          f"{sum(len(check.dropped) for check in checks)} dropped")
+    if not args.links:
+        correct = sum(check.links == expected for check, (_, _, expected) in zip(checks, cases))
+        legacy_correct = sum(legacy_validate(links, schemas[db_id]) == expected for db_id, links, expected in cases)
+        print(f"Restored the unperturbed links: indexed {correct / len(cases):.1%}, "
+              f"legacy {legacy_correct / len(cases):.1%}")
+
+
+if __name__ == "__main__":
+    main()
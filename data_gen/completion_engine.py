@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from retry_policy import CircuitBreaker, RetriesExhausted, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CompletionResult:
+    """Completion text plus what it cost: tokens from the response usage, timings in seconds"""
+    text: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+    elapsed: float
+    retries: int
+    # Prompt tokens the provider served from its prefix cache
+    cached_prompt_tokens: int = 0
+
+
+class TokenBucket:
+    """Token bucket that refills continuously up to `per_minute` tokens every 60 seconds"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are available now)"""
+        self._refill()
+        # A single request larger than the bucket can never fit, so cap it at a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits shared by every call on one event loop"""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._lock = None
+
+    async def acquire(self, n_tokens: int):
+        # The lock makes waiters queue up in FIFO order instead of racing for refills
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                wait = 0.0
+                if self.requests is not None:
+                    wait = max(wait, self.requests.wait_time(1))
+                if self.tokens is not None:
+                    wait = max(wait, self.tokens.wait_time(n_tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests is not None:
+                self.requests.consume(1)
+            if self.tokens is not None:
+                self.tokens.consume(n_tokens)
+
+    def refund(self, n_tokens: int):
+        """Give back tokens that were reserved but not used (e.g. unused max_tokens)"""
+        if self.tokens is not None and n_tokens > 0:
+            self.tokens.refund(n_tokens)
+
+
+class AsyncCompletionEngine:
+    """
+    Runs chat completions against a backend (see backends.py) on a private asyncio event loop.
+
+    At most `max_in_flight` requests are outstanding at once, and every request first
+    reserves `prompt tokens + max_tokens` from the tokens-per-minute bucket. Unused
+    completion tokens are refunded once the response reports its usage.
+
+    Transient failures are retried according to `retry_policy`, and no request is
+    sent while the circuit `breaker` is open. A request that keeps failing raises
+    RetriesExhausted; other errors are raised right away.
+
+    `complete` is a blocking, thread-safe entry point so the synchronous pipeline code
+    can be driven from a pool of threads that all share the same limits.
+    """
+
+    def __init__(self, backend, tokenizer, max_in_flight: int = 16,
+                 rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 temperature: float = 0, max_tokens: int = 1000,
+                 retry_policy: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None):
+        self.backend = backend
+        self.tokenizer = tokenizer
+        self.max_in_flight = max_in_flight
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = RateLimiter(rpm=rpm, tpm=tpm)
+        self._semaphore = None
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def count_tokens(self, messages: List[Dict[str, str]]) -> int:
+        return sum(len(self.tokenizer.encode(message['content'])) for message in messages)
+
+    def start(self):
+        """Start the background event loop (idempotent)"""
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever,
+                                            name="completion-engine", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the background event loop"""
+        with self._start_lock:
+            if self._loop is None:
+                return
+            # Background tasks (e.g. a backend's batching loop) are cancelled before the loop stops
+            asyncio.run_coroutine_threadsafe(self._cancel_tasks(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+    @staticmethod
+    async def _cancel_tasks():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def acomplete(self, messages: List[Dict[str, str]]) -> CompletionResult:
+        """Get a completion, waiting for a concurrency slot and rate-limit budget first"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        started = time.perf_counter()
+        prompt_tokens = self.count_tokens(messages)
+        reserved = prompt_tokens + self.max_tokens
+
+        async with self._semaphore:
+            policy = self.retry_policy
+            for attempt in range(policy.max_attempts):
+                await self.breaker.wait()
+                await self.limiter.acquire(reserved)
+                request_started = time.perf_counter()
+                try:
+                    response = await self.backend.acreate(messages, self.temperature, self.max_tokens)
+                except Exception as e:
+                    if not policy.is_retryable(e):
+                        raise
+                    self.breaker.record(failed=True)
+                    self.limiter.refund(reserved)
+                    if attempt == policy.max_attempts - 1:
+                        raise RetriesExhausted(e, attempt + 1) from e
+                    retry_after = getattr(e, 'retry_after', None)
+                    if retry_after is not None and getattr(e, 'status', None) == 429:
+                        self.breaker.open_for(retry_after, "rate limited (Retry-After)")
+                    delay = policy.delay(attempt, retry_after)
+                    logger.warning("Retrying in %.1fs after error (attempt %d/%d): %s",
+                                   delay, attempt + 1, policy.max_attempts, e)
+                    await asyncio.sleep(delay)
+                    continue
+
+                self.breaker.record(failed=False)
+                finished = time.perf_counter()
+                if response.prompt_tokens is not None:
+                    self.limiter.refund(self.max_tokens - response.completion_tokens)
+                return CompletionResult(
+                    text=response.text,
+                    prompt_tokens=response.prompt_tokens or prompt_tokens,
+                    completion_tokens=response.completion_tokens,
+                    latency=finished - request_started,
+                    elapsed=finished - started,
+                    retries=attempt,
+                    cached_prompt_tokens=response.cached_prompt_tokens,
+                )
+
+    def complete(self, messages: List[Dict[str, str]]) -> CompletionResult:
+        """Blocking wrapper around `acomplete`, safe to call from any thread"""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self.acomplete(messages), self._loop)
+        return future.result()
@@ -0,0 +1,22 @@
+from typing import Dict, Iterable, List, Tuple
+
+
+def normalize_question(question: str) -> str:
+    """Case- and whitespace-insensitive form of a question"""
+    return " ".join(question.split()).casefold()
+
+
+def question_key(record: dict) -> Tuple[str, str]:
+    """Rows with the same key get the same pipeline result"""
+    return record['db_id'], normalize_question(record['question'])
+
+
+def group_duplicates(rows: Iterable[Tuple[int, dict]]) -> List[List[Tuple[int, dict]]]:
+    """
+    Group (index, question) rows by `question_key`, keeping first-seen order.
+    The first row of each group is the one sent through the pipeline.
+    """
+    groups: Dict[Tuple[str, str], List[Tuple[int, dict]]] = {}
+    for i, q in rows:
+        groups.setdefault(question_key(q), []).append((i, q))
+    return list(groups.values())
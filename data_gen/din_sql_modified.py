@@ -1,17 +1,40 @@
+import gc
+import logging
 import os
+import sys
 import time
 import json
+import threading
 import multiprocessing
-from dataclasses import dataclass
-from typing import Any, Dict, List, Tuple
+import queue
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple, Union
 import pandas as pd
 from tqdm import tqdm
 import tiktoken
 from openai import OpenAI
 import argparse
 import re
-from multiprocessing import Manager
 import random
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+from backends import BACKENDS, create_backend
+from completion_engine import AsyncCompletionEngine
+from retry_policy import CircuitBreaker, RetriesExhausted, RetryPolicy
+from llm_cache import CompletionCache
+from schema_catalog import (EMPTY_RENDERING, DatabaseSchema, SchemaCatalog, build_schema_renderings,
+                            load_schema_catalog, parse_database_schemas, parse_schema_rows)
+from batch_mode import LOCAL_BATCH_COMMAND, CommandBatchExecutor, OpenAIBatchExecutor
+from stage_runner import BatchStageExecutor, InteractiveStageExecutor, STAGES, run_checkpointed_stage
+from metrics import UsageRecorder, format_summary, write_report
+from journal import ROW_INDEX, ResultJournal, completed_rows, merge_journals, part_files
+from result_writer import OUTPUT_FORMATS
+from dedup import group_duplicates
+from pipeline_logging import TRACE, RunLogging, configure_process, question_context
+from prompt_layout import LAYOUTS, ChatPrompt, PromptTemplate, messages_key, to_messages
+from sql_normalizer import extract_reasoning_and_sql
+from schema_validator import VALIDATION_MODES, SchemaIndex
 # Prompts
 
 system_prompt_sql = """
@@ -1000,27 +1023,169 @@ Label: "NESTED"
 
 # Initialize OpenAI API client
 oai_api_key = os.getenv('OPENAI_API_KEY')
-oai_client = OpenAI(api_key=oai_api_key)
 
-@dataclass
-class DatabaseSchema:
-    tables: Dict[str, List[str]]
-    foreign_keys: List[tuple]
-    primary_keys: Dict[str, str]
+# Default model; --backend/--model/--base-url select another API model, a local
+# OpenAI-compatible server or a local Hugging Face model (see backends.py)
+# chatgpt-4o-latest
+# gpt-4o-2024-11-20
+MODEL_NAME = "gpt-4o-2024-11-20"
+
+logger = logging.getLogger('din_sql')
+
+# Stage prompts, split into the instruction/few-shot prefix that is identical for every question
+# and the per-question part. The prefix goes first (as a system message by default) so the
+# provider's prefix cache can serve it; see prompt_layout.py.
+SCHEMA_LINKING_TEMPLATE_USER = """
+        Here is the Current Schema Information
+        {schema_text}
+        Here are the foreign keys
+        {fk_text}
+
+        The SQL query that needs to be solved: "{question}"
+
+    """
+SCHEMA_LINKING_TEMPLATE = PromptTemplate(f"""
+
+        You are a SQL database management expert. You are given a database schema (tables, columns, primary keys, foreign keys). You're tasked with finding the schema links to solve a query. Find the ONLY required tables and columns.
+    
+        Here are examples of Schema Links
+        {schema_linking_prompt}
+
+        Instructions:
+        1. Analyze the question and identify required tables and columns from the schema below.
+        2. ONLY use tables and columns that exist in the schema. DO NOT assume or create tables/columns that aren't listed in the schema.
+        3. Include any necessary foreign key relationships.
+        4. Do not include unecessary columns and joins for tables.
+        4. **IMPORTANT**: Output the schema links in the following format without any Markdown formatting, asterisks, or parentheses: Schema Links: [table1.column1, table2.column2, table1.column3 = table2.column3]
+""", SCHEMA_LINKING_TEMPLATE_USER)
+
+CLASSIFICATION_TEMPLATE = PromptTemplate(f'''
+        For the given question, classify it as EASY, NON-NESTED, or NESTED based on nested queries and JOIN. Learn from the following examples.
+        {classification_prompt}
+        \n\n''', '''Q: "{question}
+schema_links: {schema_links}
+A: Let's think step by step.''')
+
+# Opt-in single request for schema linking and classification (--fused-linking)
+FUSED_LINKING_TEMPLATE = PromptTemplate(f"""
+
+        You are a SQL database management expert. You are given a database schema (tables, columns, primary keys, foreign keys). For the given question you have two tasks:
+        1. Find the schema links to solve the query: the ONLY required tables and columns, the foreign key relationships and the cell values.
+        2. Classify the question as EASY, NON-NESTED, or NESTED based on nested queries and JOIN.
+
+        Here are examples of Schema Links
+        {schema_linking_prompt}
+
+        Here are examples of the classification
+        {classification_prompt}
+
+        Instructions:
+        1. Analyze the question and identify required tables and columns from the schema below.
+        2. ONLY use tables and columns that exist in the schema. DO NOT assume or create tables/columns that aren't listed in the schema.
+        3. Include any necessary foreign key relationships.
+        4. Do not include unecessary columns and joins for tables.
+        5. Decide whether the query needs JOIN and whether it needs nested queries (INTERSECT, UNION, EXCEPT, IN, NOT IN), and list the sub-questions a nested query has to answer.
+        6. **IMPORTANT**: End your answer with exactly these three lines, without any Markdown formatting, asterisks, or parentheses:
+        Schema Links: [table1.column1, table2.column2, table1.column3 = table2.column3]
+        questions = ["sub-question 1", "sub-question 2"]
+        Label: "EASY" or "NON-NESTED" or "NESTED"
+""", SCHEMA_LINKING_TEMPLATE_USER)
+FUSED_LABEL_PATTERN = re.compile(r'Label:\s*"?\s*(EASY|NON-NESTED|NESTED)\b', re.IGNORECASE)
+
+_GENERATION_TEMPLATE = """# User question
+Question: "{question}"
+
+# Relevant schema
+Schema_links: {schema_links}
+
+# Foreign keys
+{foreign_keys}
+
+"""
+EASY_TEMPLATE = PromptTemplate(EASY_PROMPT + "\n", _GENERATION_TEMPLATE)
+MEDIUM_TEMPLATE = PromptTemplate(MEDIUM_PROMPT + "\n", _GENERATION_TEMPLATE)
+HARD_TEMPLATE = PromptTemplate(HARD_PROMPT + "\n", _GENERATION_TEMPLATE.replace("# User question\n", "# User question: \n"))
+
+CORRECTION_TEMPLATE = PromptTemplate(f"""
+
+    #### For the given question, use the provided tables, columns, foreign keys, and primary keys to fix the given SQLite SQL QUERY for any issues. If there are any problems, fix them. If there are no issues, return the SQLite SQL QUERY as is.
+    #### Use the following instructions for fixing the SQL QUERY:
+    1) Use the database values that are explicitly mentioned in the question.
+    2) Pay attention to the columns that are used for the JOIN by using the Foreign_keys.
+    3) Use DESC and DISTINCT when needed.
+    4) Pay attention to the columns that are used for the GROUP BY statement.
+    5) Pay attention to the columns that are used for the SELECT statement.
+    6) Only change the GROUP BY clause when necessary (Avoid redundant columns in GROUP BY).
+    7) Use GROUP BY on one column only.
+
+    # Ensure that the query is the most succinct version. Explicitly check for redundancy and unecessary JOIN, columns, and aggregations.
+    # If there are issues, fix them.
+    # If there are no issues, return the SQLite SQL QUERY as is.
+
+    #### Only make changes to the SQL query if there are actual errors. Do not modify the SQL query if it is already correct.
+
+    #### IMPORTANT: 
+    {system_prompt_sql}
 
+    """, """
+{fields}
+#### Question: {question}
+#### Reasoning steps
+{reasoning}
+#### SQLite QUERY
+{sql}
+#### SQLite FIXED SQL QUERY
+<REASONING>
+""")
 
 class DINSQLPipeline:
-    def __init__(self):
-        """Initialize pipeline with OpenAI API key"""
-        # chatgpt-4o-latest
-        # gpt-4o-2024-11-20
-        self.model = f"gpt-4o-2024-11-20"
-        self.tokenizer = tiktoken.encoding_for_model(self.model)  # Use GPT-4o-mini
-        self.client = oai_client
-        self.current_results = {}
+    def __init__(self, max_in_flight: int = 16, rpm: float = None, tpm: float = None,
+                 cache_path: str = None, cache_max_bytes: int = 1024 ** 3, prompt_layout: str = 'system-prefix',
+                 backend_config: Dict[str, Any] = None, fused_linking: bool = False,
+                 retry_config: Dict[str, Any] = None, link_validation: str = 'repair'):
+        """Initialize pipeline with the completion backend described by `backend_config` (OpenAI API by default)"""
+        self.backend = create_backend(backend_config or {'kind': 'openai', 'model': MODEL_NAME})
+        self.model = self.backend.model
+        self.tokenizer = self.backend.tokenizer or self._tiktoken_encoding(self.model)
+        # One retry policy for every request; the breaker state may be shared with the other worker processes
+        retry_config = dict(retry_config or {})
+        breaker = CircuitBreaker(**retry_config.pop('breaker', {}))
+        # All threads of this process share one engine, so the in-flight and rate limits are per process
+        self.engine = AsyncCompletionEngine(self.backend, self.tokenizer,
+                                            max_in_flight=max_in_flight, rpm=rpm, tpm=tpm,
+                                            retry_policy=RetryPolicy(**retry_config), breaker=breaker)
+        # Byte-identical prompts are answered from disk instead of the API
+        self.cache = CompletionCache(cache_path, max_bytes=cache_max_bytes) if cache_path else None
+        # How the stage prompts' invariant prefix is sent (see prompt_layout.LAYOUTS)
+        self.prompt_layout = prompt_layout
+        # Ask for schema links and classification in one request (see link_and_classify)
+        self.fused_linking = fused_linking
+        # Check schema links against a per-database index (see schema_validator.VALIDATION_MODES)
+        self.link_validation = link_validation
+        self._schema_indexes: Dict[str, SchemaIndex] = {}
+        # Per-stage tokens, latency, retries and errors of every completion request
+        self.usage = UsageRecorder()
+        # Questions may be processed concurrently from several threads, so keep per-question state thread-local
+        self._local = threading.local()
         self.spider_schema = None
         self.spider_primary = None
         self.spider_foreign = None
+        # db_id -> SchemaRendering, filled by creating_schema or attach_catalog so prompt makers only do a dict lookup
+        self.schema_renderings = {}
+
+    @staticmethod
+    def _tiktoken_encoding(model: str):
+        # Models served by local OpenAI-compatible servers are unknown to tiktoken; the count only feeds the TPM limiter
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+
+    @property
+    def current_results(self) -> Dict[str, Any]:
+        if not hasattr(self._local, 'current_results'):
+            self._local.current_results = {}
+        return self._local.current_results
 
     def store_intermediate_result(self, step: str, data: Any):
         """Store intermediate result from any step"""
@@ -1036,142 +1201,33 @@ class DINSQLPipeline:
 
     def load_schema(self, schema_file: str) -> Dict[str, DatabaseSchema]:
         """Load database schemas from tables.json"""
-        print(f"\nLoading schema from: {schema_file}")
+        logger.info("Loading schema from: %s", schema_file)
         with open(schema_file) as f:
             schemas = json.load(f)
 
-        print(f"Loaded {len(schemas)} database schemas")
+        logger.info("Loaded %d database schemas", len(schemas))
 
-        processed_schemas = {}
-        for db in schemas:
-            try:
-                db_id = db['db_id']
-                print(f"\nProcessing schema for database: {db_id}")
-
-                # Process tables and columns
-                tables = {}
-                for i, table in enumerate(db['table_names_original']):
-                    columns = []
-                    for col_idx, (tab_idx, col_name) in enumerate(db['column_names_original']):
-                        if tab_idx == i:
-                            columns.append(col_name)
-                    tables[table] = columns
-
-                # Process foreign keys
-                foreign_keys = []
-                for fk in db['foreign_keys']:
-                    try:
-                        col1 = db['column_names_original'][fk[0]][1]
-                        tab1 = db['table_names_original'][db['column_names_original'][fk[0]][0]]
-                        col2 = db['column_names_original'][fk[1]][1]
-                        tab2 = db['table_names_original'][db['column_names_original'][fk[1]][0]]
-                        foreign_keys.append((f"{tab1}.{col1}", f"{tab2}.{col2}"))
-                    except Exception as e:
-                        print(f"Error processing foreign key {fk}: {str(e)}")
-
-                # Process primary keys
-                primary_keys = {}
-                for pk in db['primary_keys']:
-                    try:
-                        table_idx = db['column_names_original'][pk][0]
-                        col_name = db['column_names_original'][pk][1]
-                        table_name = db['table_names_original'][table_idx]
-                        primary_keys[table_name] = col_name
-                    except Exception as e:
-                        print(f"Error processing primary key {pk}: {str(e)}")
-
-                processed_schemas[db_id] = DatabaseSchema(
-                    tables=tables,
-                    foreign_keys=foreign_keys,
-                    primary_keys=primary_keys
-                )
-
-            except Exception as e:
-                print(f"Error processing database {db.get('db_id', 'unknown')}: {str(e)}")
-                continue
+        return parse_database_schemas(schemas)
 
-        return processed_schemas
+    def attach_catalog(self, catalog: SchemaCatalog) -> Dict[str, DatabaseSchema]:
+        """Use a schema catalog parsed once by the parent process instead of re-reading tables.json"""
+        self.schema_renderings = catalog.renderings
+        return catalog.schemas
 
     def creating_schema(self, DATASET_JSON):
         """Create schema DataFrames from tables.json"""
-        print("\n=== Starting Schema Processing ===")
-        print(f"Reading JSON from: {DATASET_JSON}")
+        logger.info("Reading schema JSON from: %s", DATASET_JSON)
 
         try:
-            schema_df = pd.read_json(DATASET_JSON)
+            with open(DATASET_JSON) as f:
+                databases = json.load(f)
         except Exception as e:
-            print(f"Error in initial schema reading: {str(e)}")
+            logger.error("Error in initial schema reading: %s", e)
             return None, None, None
 
-        try:
-            schema_df = schema_df.drop(['column_names', 'table_names'], axis=1)
-        except Exception as e:
-            print(f"Warning in dropping columns: {str(e)}")
-
-        schema = []
-        f_keys = []
-        p_keys = []
+        schema, p_keys, f_keys = parse_schema_rows(databases)
 
-        for index, row in schema_df.iterrows():
-            try:
-                db_id = row['db_id']
-                tables = row['table_names_original']
-                col_names = row['column_names_original']
-                col_types = row['column_types']
-                foreign_keys = row['foreign_keys']
-                primary_keys = row['primary_keys']
-
-                # Process columns
-                for col, col_type in zip(col_names, col_types):
-                    index, col_name = col
-                    if index == -1:
-                        for table in tables:
-                            schema.append([db_id, table, '*', 'text'])
-                    else:
-                        try:
-                            table_name = tables[index]
-                            schema.append([db_id, table_name, col_name, col_type])
-                        except IndexError:
-                            print(f"Warning: Invalid table index {index} for column {col_name}")
-                            continue
-
-                # Process primary keys
-                for pk in primary_keys:
-                    try:
-                        table_idx, col_name = col_names[pk]
-                        if table_idx >= 0:  # Skip the * columns
-                            p_keys.append([db_id, tables[table_idx], col_name])
-                    except IndexError:
-                        print(f"Warning: Invalid primary key index {pk}")
-                        continue
-
-                # Process foreign keys
-                for fk_pair in foreign_keys:
-                    try:
-                        fk1, fk2 = fk_pair
-                        # Get first key info
-                        tab1_idx, col1_name = col_names[fk1]
-                        # Get second key info
-                        tab2_idx, col2_name = col_names[fk2]
-
-                        if tab1_idx >= 0 and tab2_idx >= 0:  # Skip the * columns
-                            f_keys.append([
-                                db_id,
-                                tables[tab1_idx],
-                                tables[tab2_idx],
-                                col1_name,
-                                col2_name
-                            ])
-                    except IndexError:
-                        print(f"Warning: Invalid foreign key indices {fk_pair}")
-                        continue
-
-            except Exception as e:
-                print(f"Error processing database {row.get('db_id', 'unknown')}: {str(e)}")
-                print(f"Error details: {type(e).__name__}")
-                continue
-
-        print("\n=== Creating Final DataFrames ===")
+        logger.info("Creating schema DataFrames")
 
         # Create DataFrames
         self.spider_schema = pd.DataFrame(schema,
@@ -1182,59 +1238,37 @@ class DINSQLPipeline:
                                            columns=['Database name', 'First Table Name', 'Second Table Name',
                                                     'First Table Foreign Key', 'Second Table Foreign Key'])
 
+        self.schema_renderings = build_schema_renderings(schema, p_keys, f_keys)
+
         if len(schema) == 0:
-            print("\nWARNING: No schema entries were created!")
+            logger.warning("No schema entries were created!")
         if len(p_keys) == 0:
-            print("\nWARNING: No primary keys were found!")
+            logger.warning("No primary keys were found!")
         if len(f_keys) == 0:
-            print("\nWARNING: No foreign keys were found!")
+            logger.warning("No foreign keys were found!")
 
         return self.spider_schema, self.spider_primary, self.spider_foreign
 
     # Helper Functions Defined
     def find_fields_MYSQL_like(self, db_name):
-        """Format fields in MySQL-like syntax"""
-        df = self.spider_schema[self.spider_schema['Database name'] == db_name]
-        df = df.groupby('Table Name')
-        output = ""
-        for name, group in df:
-            output += "Table " + name + ', columns = ['
-            for index, row in group.iterrows():
-                output += row["Field Name"] + ','
-            output = output[:-1]
-            output += "]\n"
-        return output
+        """Format fields in MySQL-like syntax (precomputed by creating_schema)"""
+        return self.schema_renderings.get(db_name, EMPTY_RENDERING).fields
 
     def find_primary_keys_MYSQL_like(self, db_name):
-        """Format primary keys in MySQL-like syntax"""
-        df = self.spider_primary[self.spider_primary['Database name'] == db_name]
-        output = "["
-        for index, row in df.iterrows():
-            output += row['Table Name'] + '.' + row['Primary Key'] + ','
-        output = output[:-1] + "]" if output != "[" else "[]"
-        return output
+        """Format primary keys in MySQL-like syntax (precomputed by creating_schema)"""
+        return self.schema_renderings.get(db_name, EMPTY_RENDERING).primary_keys
 
     def find_foreign_keys_MYSQL_like(self, db_name):
-        """Format foreign keys in MySQL-like syntax"""
-        df = self.spider_foreign[self.spider_foreign['Database name'] == db_name]
-        output = "["
-        for index, row in df.iterrows():
-            output += row['First Table Name'] + '.' + row['First Table Foreign Key'] + \
-                      " = " + row['Second Table Name'] + '.' + row['Second Table Foreign Key'] + ','
-        output = output[:-1] + "]" if output != "[" else "[]"
-        return output
+        """Format foreign keys in MySQL-like syntax (precomputed by creating_schema)"""
+        return self.schema_renderings.get(db_name, EMPTY_RENDERING).foreign_keys
 
-    def schema_linking(self, question: str, schema: DatabaseSchema, db_id: str) -> str:
-        """Step 1: Schema Linking with improved schema validation"""
-        print("\nSchema Linking Step:")
-        print(f"Question: {question}")
-        print(f"Available tables: {list(schema.tables.keys())}")
+    def _schema_linking_context(self, schema: DatabaseSchema) -> Tuple[str, str]:
         # Format schema information more explicitly
         schema_text = "Database Schema:\n"
         for table_name, columns in schema.tables.items():
             schema_text += f"Table {table_name}, columns = [{','.join(columns)}]\n"
         
-        print(f'The following are the {schema_text}')
+        logger.log(TRACE, "The following are the %s", schema_text)
 
         # Format foreign keys with better readability
         if schema.foreign_keys:
@@ -1245,182 +1279,120 @@ class DINSQLPipeline:
         else:
             fk_text = "No Foreign Keys\nForeign_keys = []"
         
-        print(f'Here are the Foreign Keys {fk_text} \n Those are all the FKs')
-
-
-        # SQL Schema Linking Task
-
-        prompt = f"""
-
-        You are a SQL database management expert. You are given a database schema (tables, columns, primary keys, foreign keys). You're tasked with finding the schema links to solve a query. Find the ONLY required tables and columns.
-    
-        Here are examples of Schema Links
-        {schema_linking_prompt}
-
-        Here is the Current Schema Information
-        {schema_text}
-        Here are the foreign keys
-        {fk_text}
-
-        The SQL query that needs to be solved: "{question}"
+        logger.log(TRACE, "Here are the Foreign Keys %s", fk_text)
+        return schema_text, fk_text
+
+    def schema_linking_prompt_maker(self, question: str, schema: DatabaseSchema) -> ChatPrompt:
+        schema_text, fk_text = self._schema_linking_context(schema)
+        return SCHEMA_LINKING_TEMPLATE.render(schema_text=schema_text, fk_text=fk_text, question=question)
+
+    def fused_linking_prompt_maker(self, question: str, schema: DatabaseSchema) -> ChatPrompt:
+        schema_text, fk_text = self._schema_linking_context(schema)
+        return FUSED_LINKING_TEMPLATE.render(schema_text=schema_text, fk_text=fk_text, question=question)
+
+    def _parse_fused_response(self, response: str) -> Tuple[Optional[str], Optional[str]]:
+        """Schema links and EASY / NON-NESTED / NESTED label of a fused response (None for a part that is missing)"""
+        schema_links = None
+        if any(line.strip().startswith('Schema Links:') for line in response.split('\n')):
+            schema_links = self._extract_schema_links(response)
+        match = FUSED_LABEL_PATTERN.search(response)
+        return schema_links, match.group(1).upper() if match else None
+
+    def link_and_classify(self, question: str, schema: DatabaseSchema, db_id: str) -> Tuple[str, str, str]:
+        """
+        Steps 1+2 in one request: schema links, label and sub-questions from a single response.
+        Falls back to the separate schema linking and/or classification calls for whatever
+        part of the response could not be parsed.
+        """
+        prompt = self.fused_linking_prompt_maker(question, schema)
+        response = self._get_completion(prompt, stage='fused_linking')
+        logger.log(TRACE, "LLM Response for fused schema linking and classification:\n%s", response)
+        schema_links, query_type = self._parse_fused_response(response)
 
-        Instructions:
-        1. Analyze the question and identify required tables and columns from the schema above.
-        2. ONLY use tables and columns that exist in the schema. DO NOT assume or create tables/columns that aren't listed in the schema.
-        3. Include any necessary foreign key relationships.
-        4. Do not include unecessary columns and joins for tables.
-        4. **IMPORTANT**: Output the schema links in the following format without any Markdown formatting, asterisks, or parentheses: Schema Links: [table1.column1, table2.column2, table1.column3 = table2.column3]
+        if schema_links is None:
+            logger.debug("Fused response has no schema links, falling back to separate calls")
+            schema_links = self.schema_linking(question, schema, db_id)
+            query_type = None
+        else:
+            schema_links = self._validate_schema_links(schema_links, schema, db_id)
+        if query_type is None:
+            logger.debug("Fused response has no usable label, falling back to the classification call")
+            return (schema_links,) + self.classify_query(question, schema_links, schema, db_id)
+        # The response carries `questions = [...]` in the same format the classification step uses
+        return schema_links, query_type, response
 
-    """
-        response = self._get_completion(prompt)
-        print(f"LLM Response for schema linking:\n{response}")
+    def schema_linking(self, question: str, schema: DatabaseSchema, db_id: str) -> str:
+        """Step 1: Schema Linking with improved schema validation"""
+        logger.debug("Schema linking: %s (tables: %s)", question, ", ".join(schema.tables))
+        prompt = self.schema_linking_prompt_maker(question, schema)
+        response = self._get_completion(prompt, stage='schema_linking')
+        logger.log(TRACE, "LLM Response for schema linking:\n%s", response)
 
         # Extract and validate schema links
         schema_links = self._extract_schema_links(response)
-        #validated_links = self._validate_schema_links(schema_links, schema)
-
-        #if validated_links != schema_links:
-            #print(f"Warning: Invalid schema links were removed or corrected")
-            #print(f"Original: {schema_links}")
-            #print(f"Validated: {validated_links}")
-            #return validated_links
-
-        return schema_links
+        return self._validate_schema_links(schema_links, schema, db_id)
 
     def classification_prompt_maker(self, test_sample_text, database, schema_links):
-        instruction = (f'''
-        For the given question, classify it as EASY, NON-NESTED, or NESTED based on nested queries and JOIN. Learn from the following examples.
-        {classification_prompt}
-        \n\n''')
-
-        fields = self.find_fields_MYSQL_like(database)
-        fields += "Foreign_keys = " + self.find_foreign_keys_MYSQL_like(database) + '\n'
-        fields += "\n"
-        prompt = instruction + 'Q: "' + test_sample_text + '\nschema_links: ' + schema_links + """\nA: Let's think step by step."""
-        return prompt
+        return CLASSIFICATION_TEMPLATE.render(question=test_sample_text, schema_links=schema_links)
 
     def classify_query(self, question: str, schema_links: str, schema: DatabaseSchema, db_id: str) -> tuple[str, str]:
         """Step 2: Query Classification - returns both classification and full response"""
-        classification = None
-        while classification is None:
-            try:
-                prompt = self.classification_prompt_maker(question, db_id, schema_links[1:])
-                classification = self._get_completion(prompt)
-                print(f'Classification LLM Response ******* {classification} *********')
-            except:
-                time.sleep(3)
-                continue
+        # Transient API errors are retried (bounded) by the completion engine
+        prompt = self.classification_prompt_maker(question, db_id, schema_links[1:])
+        classification = self._get_completion(prompt, stage='classification')
+        logger.log(TRACE, "Classification LLM Response:\n%s", classification)
+
+        return self._parse_classification(classification), classification
 
+    def _parse_classification(self, classification: str) -> str:
+        """Extract the EASY / NON-NESTED / NESTED label from a classification response"""
         try:
             predicted_class = classification.split('Label: "')[1].split('"')[0]
         except:
-            print("Slicing error for the classification module")
+            logger.debug("Slicing error for the classification module, defaulting to NESTED")
             predicted_class = "NESTED"
-
-        return predicted_class, classification
+        return predicted_class
 
     def easy_prompt_maker(self, test_sample_text, database, schema_links):
-        instruction = EASY_PROMPT
         # Get the current database schema
         fields = self.find_fields_MYSQL_like(database)
         foreign_keys = "Foreign_keys = " + self.find_foreign_keys_MYSQL_like(database) + '\n'
-
-        prompt_old = f"""{instruction}
-User question database schema:
-{fields}
-{foreign_keys}
-
-# User question
-Question: "{test_sample_text}"
-
-# Relevant schema
-Schema_links: {schema_links}
-"""
-
-        prompt = f"""{instruction}
-# User question
-Question: "{test_sample_text}"
-
-# Relevant schema
-Schema_links: {schema_links}
-
-# Foreign keys
-{foreign_keys}
-
-"""
+        prompt = EASY_TEMPLATE.render(question=test_sample_text, schema_links=schema_links, foreign_keys=foreign_keys)
         return prompt, fields, foreign_keys
 
 
     def medium_prompt_maker(self, test_sample_text, database, schema_links):
-        instruction = MEDIUM_PROMPT
-
         # Current database schema
         fields = self.find_fields_MYSQL_like(database)
         foreign_keys = "Foreign_keys = " + self.find_foreign_keys_MYSQL_like(database) + '\n'
-        prompt_old = f"""{instruction}
-User question database schema:
-{fields}
-{foreign_keys}
-
-# User question
-Question: "{test_sample_text}"
-
-# Relevant schema
-Schema_links: {schema_links}
-"""
-
-        prompt = f"""{instruction}
-# User question
-Question: "{test_sample_text}"
-
-# Relevant schema
-Schema_links: {schema_links}
-
-# Foreign keys
-{foreign_keys}
-
-"""
+        prompt = MEDIUM_TEMPLATE.render(question=test_sample_text, schema_links=schema_links, foreign_keys=foreign_keys)
         return prompt, fields, foreign_keys
 
 
     def hard_prompt_maker(self, test_sample_text, database, schema_links, sub_questions):
-        instruction = HARD_PROMPT
-
         # Current database schema
         fields = self.find_fields_MYSQL_like(database)
         foreign_keys = "Foreign_keys = " + self.find_foreign_keys_MYSQL_like(database) + '\n'
+        prompt = HARD_TEMPLATE.render(question=test_sample_text, schema_links=schema_links, foreign_keys=foreign_keys)
+        return prompt, fields, foreign_keys
 
-        stepping = f"""Let's solve "{test_sample_text}" by following the reasoning structure and breaking it down:
-        1. Required Schema Links: {schema_links}
-        2. Sub-questions to solve: "{sub_questions}"
-        3. Using only the tables and columns from our schema links."""
-
-        prompt_old = f"""{instruction}
-User question database schema:
-{fields}
-{foreign_keys}
-
-# User question: 
-Question: "{test_sample_text}"
-
-# Relevant schema
-Schema_links: {schema_links}
-
-        """
-
-        prompt = f"""{instruction}
-# User question: 
-Question: "{test_sample_text}"
 
-# Relevant schema
-Schema_links: {schema_links}
-
-# Foreign keys
-{foreign_keys}
-
-"""
-        return prompt, fields, foreign_keys
+    def _extract_sub_questions(self, classification_response: str, question: str) -> str:
+        try:
+            return classification_response.split('questions = ["')[1].split('"]')[0]
+        except:
+            logger.debug("Error extracting sub-questions, using original question")
+            return question
 
+    def generation_prompt_maker(self, question: str, db_id: str, schema_links: str, query_type: str,
+                                classification_response: str) -> Tuple[str, str, str]:
+        """Pick the EASY / NON-NESTED / NESTED prompt for a classified question"""
+        if query_type == "EASY":
+            return self.easy_prompt_maker(question, db_id, schema_links)
+        elif query_type == "NON-NESTED":
+            return self.medium_prompt_maker(question, db_id, schema_links)
+        sub_questions = self._extract_sub_questions(classification_response, question)
+        return self.hard_prompt_maker(question, db_id, schema_links, sub_questions)
 
     def generate_sql(self, question: str, schema_links: str, query_type: str,
                 classification_response: str, schema: DatabaseSchema, db_id: str) -> str:
@@ -1431,8 +1403,8 @@ Schema_links: {schema_links}
 
         if query_type == "EASY":
             prompt, fields, foreign_keys = self.easy_prompt_maker(question, db_id, schema_links)
-            response = self._get_completion(prompt)
-            print(f'SQL Generation Step: The full response is \n {response}')
+            response = self._get_completion(prompt, stage='generation')
+            logger.log(TRACE, "SQL generation response:\n%s", response)
             # Extract reasoning and SQL
             reasoning, sql = self._extract_reasoning_and_sql(response)
             # Store the reasoning and SQL
@@ -1442,8 +1414,8 @@ Schema_links: {schema_links}
 
         elif query_type == "NON-NESTED":
             prompt, fields, foreign_keys = self.medium_prompt_maker(question, db_id, schema_links)
-            response = self._get_completion(prompt)
-            print(f'SQL Generation Step: The full response is \n {response}')
+            response = self._get_completion(prompt, stage='generation')
+            logger.log(TRACE, "SQL generation response:\n%s", response)
             # Extract reasoning and SQL
             reasoning, sql = self._extract_reasoning_and_sql(response)
             # Store the reasoning and SQL
@@ -1452,68 +1424,36 @@ Schema_links: {schema_links}
             return reasoning, sql, query_type, fields, foreign_keys
 
         else:  # NESTED queries
-            try:
-                sub_questions = classification_response.split('questions = ["')[1].split('"]')[0]
-            except:
-                print("Error extracting sub-questions, using original question")
-                sub_questions = question
-
-            SQL = None # Use 'SQL' in caps for HARD questions
-            while SQL is None:
-                try:
-                    prompt, fields, foreign_keys = self.hard_prompt_maker(question, db_id, schema_links, sub_questions)
-                    response = self._get_completion(prompt)
-                    print(f'SQL Generation Step: The full response is \n {response}')
-                    # Extract reasoning and SQL
-                    reasoning, SQL = self._extract_reasoning_and_sql(response)
-                    # Store the reasoning and SQL
-                    self.store_intermediate_result('sql_reasoning', reasoning)
-                    self.store_intermediate_result('generated_sql', SQL)
-                    if SQL == "SELECT":  # If extraction failed
-                        continue
-                except:
-                    time.sleep(3)
-                    continue
+            sub_questions = self._extract_sub_questions(classification_response, question)
+
+            # Use 'SQL' in caps for HARD questions. Transient API errors are retried (bounded) by the
+            # completion engine; a response without tags is kept like in the other branches, since
+            # resending the same prompt at temperature 0 (or from the cache) returns the same text.
+            prompt, fields, foreign_keys = self.hard_prompt_maker(question, db_id, schema_links, sub_questions)
+            response = self._get_completion(prompt, stage='generation')
+            logger.log(TRACE, "SQL generation response:\n%s", response)
+            # Extract reasoning and SQL
+            reasoning, SQL = self._extract_reasoning_and_sql(response)
+            # Store the reasoning and SQL
+            self.store_intermediate_result('sql_reasoning', reasoning)
+            self.store_intermediate_result('generated_sql', SQL)
             return reasoning, SQL, query_type, fields, foreign_keys
 
 
     def sql_query_corrector(self, test_sample_text, database, reasoning, sql):
         """ Validate and correct SQL query based on schema and question context. """
-        instruction = f"""
-
-    #### For the given question, use the provided tables, columns, foreign keys, and primary keys to fix the given SQLite SQL QUERY for any issues. If there are any problems, fix them. If there are no issues, return the SQLite SQL QUERY as is.
-    #### Use the following instructions for fixing the SQL QUERY:
-    1) Use the database values that are explicitly mentioned in the question.
-    2) Pay attention to the columns that are used for the JOIN by using the Foreign_keys.
-    3) Use DESC and DISTINCT when needed.
-    4) Pay attention to the columns that are used for the GROUP BY statement.
-    5) Pay attention to the columns that are used for the SELECT statement.
-    6) Only change the GROUP BY clause when necessary (Avoid redundant columns in GROUP BY).
-    7) Use GROUP BY on one column only.
-
-    # Ensure that the query is the most succinct version. Explicitly check for redundancy and unecessary JOIN, columns, and aggregations.
-    # If there are issues, fix them.
-    # If there are no issues, return the SQLite SQL QUERY as is.
-
-    #### Only make changes to the SQL query if there are actual errors. Do not modify the SQL query if it is already correct.
-
-    #### IMPORTANT: 
-    {system_prompt_sql}
-
-    """
         fields = self.find_fields_MYSQL_like(database)
         fields += "Foreign_keys = " + self.find_foreign_keys_MYSQL_like(database) + '\n'
         fields += "Primary_keys = " + self.find_primary_keys_MYSQL_like(database)
-        prompt = (instruction + '\n' + fields + '\n#### Question: ' + test_sample_text + '\n#### Reasoning steps\n' + reasoning
-        + '\n#### SQLite QUERY\n' + sql + '\n#### SQLite FIXED SQL QUERY\n<REASONING>\n')
-        print(f'**** The fields for self correction are {fields}')
+        prompt = CORRECTION_TEMPLATE.render(fields=fields, question=test_sample_text, reasoning=reasoning, sql=sql)
+        logger.log(TRACE, "The fields for self correction are %s", fields)
         
         return prompt
 
     def self_correction(self, reasoning: str, sql: str, question: str, schema: DatabaseSchema, db_id: str) -> Tuple[str, str]:
         """Step 4: SQL Query Correction"""
         prompt = self.sql_query_corrector(test_sample_text=question, database=db_id, reasoning=reasoning, sql=sql)
-        response = self._get_completion(prompt)
+        response = self._get_completion(prompt, stage='correction')
         corrected_reasoning, corrected_sql = self._extract_reasoning_and_sql(response)
         
         # Store the reasoning and corrected SQL
@@ -1524,111 +1464,53 @@ Schema_links: {schema_links}
 
     def _extract_reasoning_and_sql(self, response: str) -> Tuple[str, str]:
         """Extract reasoning and SQL from response."""
-        pattern = ""
-        
-        if "<REASONING>" in response:
-            pattern = re.compile(
-                r'<REASONING>\s*(.*?)\s*</REASONING>.*?<SQL>\s*(.*?)\s*</SQL>',
-                re.DOTALL | re.IGNORECASE
-            )
-        if "<chains>" in response:
-            pattern = re.compile(
-                r'<chains>\s*(.*?)\s*</chains>.*?<SQL>\s*(.*?)\s*</SQL>',
-                re.DOTALL | re.IGNORECASE
-            )
-
-        # pattern = re.compile(
-        #     r'<REASONING>\s*(.*?)\s*</REASONING>.*?<SQL>\s*(.*?)\s*</SQL>',
-        #     re.DOTALL | re.IGNORECASE
-        # )
-        match = pattern.search(response)
-        if match:
-
-            # Strip reasoning and sql responses from tags
-            reasoning = match.group(1).strip()
-            sql = match.group(2).strip()
-
-            # Remove the excess white space and \n characters
-            reasoning = ' '.join(reasoning.split())
-            sql = ' '.join(sql.split())
-
-            # Capitalize SQL Characters
-            keywords = ['SELECT', 'FROM', 'WHERE', 'JOIN', 'ON', 'GROUP BY', 'ORDER BY', 'LIMIT', 'HAVING', 'COUNT', 'SUM', 'AVG', 'MIN', 'MAX']
-            for kw in keywords:
-                sql = re.sub(r'\b' + kw + r'\b', kw, sql, flags=re.IGNORECASE)
-
-            return reasoning, sql
-        
-        else:
+        extracted = extract_reasoning_and_sql(response)
+        if extracted is None:
             # If tags are not found, handle accordingly
-            print("No <REASONING> and/or <SQL> tags found in the response.")
+            logger.debug("No <REASONING> and/or <SQL> tags found in the response.")
             return response.strip(), "SELECT"
+        return extracted
+
+    def _get_completion(self, prompt: Union[str, ChatPrompt], stage: str = 'other') -> str:
+        """Get completion from the response cache, or from OpenAI API through the rate-limited async engine"""
+        messages = to_messages(prompt, self.prompt_layout)
+        if self.cache is not None:
+            key = self.cache.make_key(self.model, messages_key(messages), self.engine.temperature,
+                                      self.engine.max_tokens, backend=self.backend.kind,
+                                      base_url=self.backend.base_url)
+            response = self.cache.get(key)
+            if response is not None:
+                self.usage.record(stage, cached=True)
+                return response
 
-    def _get_completion(self, prompt: str) -> str:
-        """Get completion from OpenAI API with retry logic"""
-        max_retries = 3
-        delay = 20
-
-        for attempt in range(max_retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": prompt}
-                    ],
-                    temperature=0,
-                    max_tokens=1000
-                )
-
-                return response.choices[0].message.content
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"Retrying after error: {str(e)}")
-                    time.sleep(delay)
-                else:
-                    raise e
-
-    def _validate_schema_links(self, schema_links: str, schema: DatabaseSchema) -> str:
-        """Validate that schema links only reference existing tables and columns"""
-        # Remove brackets and split by comma
-        links = schema_links.strip('[]').split(',')
-        valid_links = []
-
-        # Get all valid table names and columns
-        valid_tables = set(schema.tables.keys())
-        valid_columns = {col: table for table, cols in schema.tables.items() for col in cols}
-
-        for link in links:
-            link = link.strip()
-            if not link:
-                continue
-
-            # Check if it's a foreign key relationship
-            if '=' in link:
-                left, right = link.split('=')
-                left = left.strip()
-                right = right.strip()
-
-                # Validate both sides of the relationship
-                if '.' in left and '.' in right:
-                    left_table, left_col = left.split('.')
-                    right_table, right_col = right.split('.')
-
-                    if (left_table in valid_tables and
-                            right_table in valid_tables and
-                            left_col in schema.tables[left_table] and
-                            right_col in schema.tables[right_table]):
-                        valid_links.append(f"{left} = {right}")
-
-            # Check if it's a column reference
-            elif '.' in link:
-                table, column = link.split('.')
-                if table in valid_tables and column in schema.tables[table]:
-                    valid_links.append(link)
-
-        return f"[{', '.join(valid_links)}]"
+        try:
+            result = self.engine.complete(messages)
+        except RetriesExhausted as e:
+            self.usage.record(stage, retries=e.attempts - 1, error=True)
+            raise
+        except Exception:
+            self.usage.record(stage, error=True)
+            raise
+        self.usage.record(stage, result.prompt_tokens, result.completion_tokens,
+                          latency=result.latency, elapsed=result.elapsed, retries=result.retries,
+                          cached_prompt_tokens=result.cached_prompt_tokens)
+
+        response = result.text
+        if self.cache is not None and response is not None:
+            self.cache.put(key, self.model, response)
+        return response
+
+    def _validate_schema_links(self, schema_links: str, schema: DatabaseSchema, db_id: str) -> str:
+        """Repair or drop schema links to tables and columns that do not exist (see schema_validator)"""
+        if self.link_validation == 'off':
+            return schema_links
+        index = self._schema_indexes.get(db_id)
+        if index is None:
+            index = self._schema_indexes[db_id] = SchemaIndex(schema)
+        check = index.check(schema_links, fuzzy=self.link_validation == 'repair')
+        if check.changed:
+            logger.debug("Schema links repaired: %s, dropped: %s", check.repaired, check.dropped)
+        return check.links
 
     def _extract_schema_links(self, response: str) -> str:
         """Extract and validate schema links"""
@@ -1642,7 +1524,7 @@ Schema_links: {schema_links}
                     schema_links_line = line.strip()
                     break
             if not schema_links_line:
-                print("Schema links not found in the response.")
+                logger.debug("Schema links not found in the response.")
                 return "[]"
 
             # Extract the schema links after 'Schema Links:'
@@ -1657,7 +1539,7 @@ Schema_links: {schema_links}
             # Re-add square brackets to standardize the format
             return f"[{links}]"
         except Exception as e:
-            print(f"Error extracting schema links: {str(e)}")
+            logger.debug("Error extracting schema links: %s", e)
             return "[]"
 
     def process_question(self, question: str, db_id: str, schemas: Dict[str, DatabaseSchema]) -> str:
@@ -1667,13 +1549,18 @@ Schema_links: {schema_links}
         try:
             schema = schemas[db_id]
 
-            # Step 1: Schema Linking - print only once
-            schema_links = self.schema_linking(question, schema, db_id)
-            print(f'Schema Links {schema_links}')
+            if self.fused_linking:
+                # Steps 1+2 in a single request
+                schema_links, query_type, classification_response = self.link_and_classify(question, schema, db_id)
+                logger.debug("Schema links: %s, query type: %s", schema_links, query_type)
+            else:
+                # Step 1: Schema Linking - print only once
+                schema_links = self.schema_linking(question, schema, db_id)
+                logger.debug("Schema links: %s", schema_links)
 
-            # Step 2: Query Classification - print only once
-            query_type, classification_response = self.classify_query(question, schema_links, schema, db_id)
-            print(f"Query Type: {query_type}")
+                # Step 2: Query Classification - print only once
+                query_type, classification_response = self.classify_query(question, schema_links, schema, db_id)
+                logger.debug("Query type: %s", query_type)
 
             # Step 3: SQL Generation - single detailed print
             reasoning, generated_query, generated_query_type, fields, foreign_keys = self.generate_sql(question, 
@@ -1681,7 +1568,7 @@ Schema_links: {schema_links}
                                                                                                         query_type, 
                                                                                                         classification_response, 
                                                                                                         schema, db_id)
-            print(f"Generated SQL: {generated_query}")
+            logger.debug("Generated SQL: %s", generated_query)
 
             # Step 4: Self-correction - only print if different from generated SQL
             # final_reasoning, final_sql = self.self_correction(question=question, schema=schema, db_id=db_id, reasoning=reasoning, sql=generated_query)
@@ -1689,117 +1576,376 @@ Schema_links: {schema_links}
             final_sql = generated_query
             
             if final_sql != generated_query:
-                print(f"Corrected SQL: {final_sql}")
+                logger.debug("Corrected SQL: %s", final_sql)
 
             return final_reasoning, final_sql, generated_query_type, schema_links, fields, foreign_keys
             # return "", "", "", schema_links, "", ""
 
         except Exception as e:
-            print(f"\nError processing question: {str(e)}")
+            logger.debug("Error processing question: %s", e)
             raise
 
 
-def process_question_batch(args):
-    """Process a batch of questions in a separate process"""
-    questions_batch, schema_file, process_output_file = args
-
-    random.shuffle(questions_batch)
+def process_question_batch(worker_id, task_queue, progress_queue, catalog, process_output_file, pipeline_config):
+    """Worker process: pull small chunks of questions from the shared queue until it is drained"""
+    configure_process(pipeline_config['logging'])
 
     # Initialize pipeline for this process
-    pipeline = DINSQLPipeline()
-    # Load schemas
-    schemas = pipeline.load_schema(schema_file)
-
-    # Create schema DataFrames for this process
-    pipeline.creating_schema(schema_file)
-
-    batch_results = []
-
-    n_processed = 0  # Counter for the number of questions processed
-
-    for i, q in enumerate(questions_batch):
+    pipeline = DINSQLPipeline(max_in_flight=pipeline_config['max_in_flight'],
+                              rpm=pipeline_config['rpm'],
+                              tpm=pipeline_config['tpm'],
+                              cache_path=pipeline_config['cache_path'],
+                              cache_max_bytes=pipeline_config['cache_max_bytes'],
+                              prompt_layout=pipeline_config['prompt_layout'],
+                              backend_config=pipeline_config['backend'],
+                              fused_linking=pipeline_config['fused_linking'],
+                              retry_config=pipeline_config['retry'],
+                              link_validation=pipeline_config['link_validation'])
+    # The catalog was parsed once by the parent and inherited through fork (pickled once under spawn)
+    schemas = pipeline.attach_catalog(catalog)
+
+    # Finished questions are appended to this worker's journal instead of rewriting the whole batch
+    journal = ResultJournal(process_output_file, fsync_every=pipeline_config['fsync_every'])
+    journal_lock = threading.Lock()
+
+    def run_group(group):
+        """Process the first row of a group of duplicate questions and write a result for every row"""
+        i, q = group[0]
+        started = time.perf_counter()
+        with question_context(str(i + 1)):
+            return process_group(group, i, q, started)
+
+    def process_group(group, i, q, started):
         try:
-            print(f"\nProcessing question {i + 1}")
+            logger.debug("Processing question %d: %s", i + 1, q['question'])
 
             if q['db_id'] not in schemas:
-                print(f"Warning: No schema found for database {q['db_id']}")
-                continue
+                logger.warning("No schema found for database %s", q['db_id'])
+                return len(group), 0
 
             reasoning, sql, gen_query_type, schema_links, fields, foreign_keys = pipeline.process_question(q['question'], 
                                                                                                             q['db_id'], 
                                                                                                             schemas)
 
             if not sql or sql == "SELECT":
-                print("Warning: Generated SQL appears to be empty or invalid")
+                logger.warning("Generated SQL appears to be empty or invalid")
 
-            result = {
-                'question': q['question'],
+            # Every original row keeps its own question text and gold SQL
+            results = [{
+                'question': row['question'],
                 'schema_links': schema_links,
                 'fields': fields,
                 'foriegn keys': foreign_keys,
                 'classification': gen_query_type,
                 'predicted_sql': sql,
-                'gold_sql': q.get('query', ''),
-                'db_id': q['db_id'],
-                'reasoning': reasoning
-                
-            }
-
-            print(f'This reuslt is \n {result}')
-
-            # Append the result to batch_results
-            batch_results.append(result)
+                'gold_sql': row.get('query', ''),
+                'db_id': row['db_id'],
+                'reasoning': reasoning,
+                ROW_INDEX: row_index
+            } for row_index, row in group]
 
-            # Optionally, write results to file after each question
-            with open(process_output_file, 'w') as f:
-                json.dump(batch_results, f, indent=2)
+            logger.log(TRACE, "Result record: %s", results[0])
 
-            print(f"Processed question {i + 1}")
+            with journal_lock:
+                for result in results:
+                    journal.append(result)
 
-            # Increment the processed counter
-            n_processed += 1
-
-            # Add delay to handle rate limits
-            time.sleep(1)
+            # The one INFO record per question
+            logger.info("ok db=%s type=%s copies=%d %.1fs sql=%s", q['db_id'], gen_query_type, len(group),
+                        time.perf_counter() - started, sql)
+            return len(group), len(group)
 
         except Exception as e:
-            print(f"\nError processing question {i + 1}: {str(e)}")
-            print(f"Question was: {q['question']}")
-            print(f"Database was: {q['db_id']}")
-            continue
-
-    # Return the number of questions processed for progress bar update
-    return n_processed
-
+            logger.warning("failed db=%s copies=%d %.1fs error=%s question=%r", q['db_id'], len(group),
+                           time.perf_counter() - started, e, q['question'])
+            return len(group), 0
+
+    # Keep at most `concurrency` questions running and only take a new chunk when a slot frees up,
+    # so the remaining work stays in the queue where idle workers can pick it up
+    concurrency = pipeline_config['concurrency']
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                chunk = task_queue.get()
+                if chunk is None:
+                    exhausted = True
+                    break
+                pending.update(executor.submit(run_group, group) for group in chunk)
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                progress_queue.put(('question', worker_id, future.result()))
+
+    journal.close()
+    pipeline.engine.close()
+    if pipeline.cache is not None:
+        logger.info("Completion cache for %s: %s", process_output_file, pipeline.cache.stats())
+        pipeline.cache.close()
+
+    progress_queue.put(('usage', worker_id, pipeline.usage.drain()))
+    progress_queue.put(('done', worker_id, 0))
+
+
+def process_dataset_parallel(schema_file: str, input_file: str, output_file: str, num_processes: int = 4,
+                             pipeline_config: Dict[str, Any] = None, resume: bool = False,
+                             chunk_size: int = 4, usage: UsageRecorder = None) -> Tuple[int, int, int]:
+    """
+    Run the pipeline over the input file with a pool of worker processes sharing one work queue.
+    Usage records reported by the workers are collected into `usage`.
 
-def process_dataset_parallel(schema_file: str, input_file: str, output_file: str, num_processes: int = 4):
-    print("\n=== Starting Parallel Processing ===")
+    Questions that only differ in case and whitespace on the same database are
+    processed once and their result is written for every copy.
 
+    Returns (questions scheduled, questions successfully processed, questions done in an earlier run).
+    """
     # Load questions
-    print("\n=== Loading Questions ===")
     with open(input_file) as f:
         questions = json.load(f)
     # questions = questions[:1]
-    # Calculate batch sizes
-    total_questions = len(questions)
-    batch_size = total_questions // num_processes or 1
-    if batch_size == 0:
-        batch_size = 1
-        num_processes = total_questions
-
-    # Prepare arguments for each process
-    process_args = []
+
+    # Rows keep their position in the input file, which is what the journals record
+    rows = list(enumerate(questions))
+    existing_parts = part_files(output_file)
+    n_done = 0
+    if resume:
+        # Skip rows already recorded in the journals of an earlier run
+        done = completed_rows(output_file, questions)
+        rows = [(i, q) for i, q in rows if i not in done]
+        n_done = len(questions) - len(rows)
+        logger.info("Resuming: %d questions already done, %d remaining", n_done, len(rows))
+    else:
+        for path in existing_parts:
+            os.remove(path)
+    # New journals must not collide with parts kept from an earlier run
+    first_part = 0
+    if resume and existing_parts:
+        first_part = max(int(path.rsplit('_part_', 1)[1].split('.')[0]) for path in existing_parts) + 1
+
+    total_questions = len(rows)
+    num_processes = max(1, min(num_processes, total_questions))
+
+    # Duplicate questions are scheduled once, as a group that fans out to every copy
+    groups = group_duplicates(rows)
+    logger.info("%d questions, %d unique after normalization", total_questions, len(groups))
+    num_processes = max(1, min(num_processes, len(groups)))
+
+    # Shuffle once so expensive NESTED questions are spread over the whole queue
+    random.shuffle(groups)
+
+    # Parse tables.json once here instead of twice in every worker
+    catalog = load_schema_catalog(schema_file)
+    logger.info("Loaded %d database schemas from %s", len(catalog.schemas), schema_file)
+
+    # Prefer fork so workers share the parent's catalog pages instead of each holding a copy
+    ctx = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    task_queue = ctx.Queue()
+    progress_queue = ctx.Queue()
+    # Open-until time of the circuit breaker, shared so one worker tripping it pauses them all
+    retry_config = dict(pipeline_config['retry'])
+    retry_config['breaker'] = dict(retry_config.get('breaker', {}), state=ctx.Value('d', 0.0))
+    pipeline_config = dict(pipeline_config, retry=retry_config)
+    for start_idx in range(0, len(groups), chunk_size):
+        task_queue.put(groups[start_idx:start_idx + chunk_size])
+    # One sentinel per worker marks the end of the queue
+    for _ in range(num_processes):
+        task_queue.put(None)
+
+    # Move everything allocated so far out of the collector's reach, so gc passes in the
+    # workers do not touch (and copy-on-write) the inherited catalog pages
+    gc.freeze()
+
+    workers = []
     for i in range(num_processes):
-        start_idx = i * batch_size
-        # Ensure we cover all questions in the last batch
-        end_idx = start_idx + batch_size if i < num_processes - 1 else total_questions
         # Generate a unique output filename for this process
-        process_output_file = f"{output_file}_part_{i}.json"
-        # Slice the questions list for this batch
-        questions_batch = questions[start_idx:end_idx]
-        process_args.append((questions_batch, schema_file, process_output_file))
+        process_output_file = f"{output_file}_part_{first_part + i}.jsonl"
+        worker = ctx.Process(target=process_question_batch,
+                             args=(i, task_queue, progress_queue, catalog,
+                                   process_output_file, pipeline_config))
+        worker.start()
+        workers.append(worker)
+
+    logger.info("Processing with %d processes", num_processes)
+    n_processed = 0
+    finished = set()
+    with tqdm(total=total_questions + n_done, initial=n_done, desc="Processing questions") as pbar:
+        while len(finished) < num_processes:
+            try:
+                kind, worker_id, payload = progress_queue.get(timeout=5)
+            except queue.Empty:
+                # A worker that died without reporting must not hang the parent
+                for i, worker in enumerate(workers):
+                    if i not in finished and not worker.is_alive():
+                        logger.error("Worker %d exited with code %s before finishing", i, worker.exitcode)
+                        finished.add(i)
+                continue
+            if kind == 'done':
+                finished.add(worker_id)
+            elif kind == 'usage':
+                if usage is not None:
+                    usage.extend(payload)
+            else:
+                n_rows, n_ok = payload
+                n_processed += n_ok
+                pbar.update(n_rows)
+                pbar.set_postfix(ok=n_processed)
+
+    for worker in workers:
+        worker.join()
+
+    return total_questions, n_processed, n_done
+
+def process_dataset_stage_major(schema_file: str, input_file: str, output_file: str, stage_dir: str,
+                                pipeline_config: Dict[str, Any], batch_executor=None,
+                                stage_concurrency: Dict[str, int] = None, rerun_stages: List[str] = (),
+                                correction: bool = False, usage: UsageRecorder = None) -> Tuple[int, int]:
+    """
+    Run the pipeline stage by stage over the whole dataset.
+
+    Schema linking runs for every question, then classification, then generation
+    and (optionally) correction, each building its prompts from the previous
+    stage's results. With fused linking the first two stages only run for the
+    questions whose combined response did not parse. Every stage is checkpointed in `stage_dir`, so only questions
+    whose prompt changed are sent again. Stages go either through the interactive
+    API with a per-stage concurrency limit, or as one batch each when
+    `batch_executor` is given. Returns (questions scheduled, results written).
+    """
+    os.makedirs(stage_dir, exist_ok=True)
+
+    with open(input_file) as f:
+        questions = json.load(f)
+
+    pipeline = DINSQLPipeline(max_in_flight=pipeline_config['max_in_flight'],
+                              rpm=pipeline_config['rpm'],
+                              tpm=pipeline_config['tpm'],
+                              cache_path=pipeline_config['cache_path'],
+                              cache_max_bytes=pipeline_config['cache_max_bytes'],
+                              prompt_layout=pipeline_config['prompt_layout'],
+                              backend_config=pipeline_config['backend'],
+                              fused_linking=pipeline_config['fused_linking'],
+                              retry_config=pipeline_config['retry'],
+                              link_validation=pipeline_config['link_validation'])
+    schemas = pipeline.attach_catalog(load_schema_catalog(schema_file))
+
+    if batch_executor is not None:
+        executor = BatchStageExecutor(batch_executor, stage_dir, pipeline.model, pipeline.engine.temperature,
+                                      pipeline.engine.max_tokens, cache=pipeline.cache, usage=pipeline.usage,
+                                      layout=pipeline.prompt_layout, backend=pipeline.backend.kind,
+                                      base_url=pipeline.backend.base_url)
+    else:
+        executor = InteractiveStageExecutor(pipeline._get_completion, stage_concurrency or {},
+                                            default_concurrency=pipeline_config['concurrency'])
+
+    # custom_id of every request is the question's position in the input file. Only the first
+    # of a group of duplicate questions gets requests; its results are written for every copy.
+    pending = {}
+    copies = {}
+    rows = [(str(i), q) for i, q in enumerate(questions)]
+    for group in group_duplicates(rows):
+        i, q = group[0]
+        if q['db_id'] not in schemas:
+            logger.warning("No schema found for database %s", q['db_id'])
+            continue
+        pending[i] = q
+        copies[i] = group
+    logger.info("%d questions, %d unique after normalization", len(questions), len(pending))
+
+    # Checkpointed responses are only reused for the same backend, model and generation settings
+    request_settings = {
+        'backend': {key: pipeline_config['backend'].get(key) for key in ('kind', 'model', 'base_url', 'dtype')},
+        'temperature': pipeline.engine.temperature,
+        'max_tokens': pipeline.engine.max_tokens,
+        'prompt_layout': pipeline.prompt_layout,
+    }
+
+    def run_stage(name, prompts):
+        return run_checkpointed_stage(name, prompts, executor, stage_dir, force=name in rerun_stages,
+                                      settings=request_settings)
+
+    schema_links = {}
+    classifications = {}
+    query_types = {}
+    if pipeline.fused_linking:
+        # Steps 1+2 in one request; questions whose response does not parse go through the separate stages
+        fused = run_stage('fused_linking', {
+            i: pipeline.fused_linking_prompt_maker(q['question'], schemas[q['db_id']])
+            for i, q in pending.items()})
+        for i, response in fused.items():
+            links, query_type = pipeline._parse_fused_response(response)
+            if links is not None:
+                schema_links[i] = pipeline._validate_schema_links(links, schemas[pending[i]['db_id']],
+                                                                  pending[i]['db_id'])
+                if query_type is not None:
+                    classifications[i] = response
+                    query_types[i] = query_type
+        logger.info("Fused linking: %d/%d parsed, %d fall back to schema linking, %d to classification",
+                    len(query_types), len(pending), len(pending) - len(schema_links), len(pending) - len(query_types))
+
+    # Step 1: Schema Linking
+    responses = run_stage('schema_linking', {
+        i: pipeline.schema_linking_prompt_maker(q['question'], schemas[q['db_id']])
+        for i, q in pending.items() if i not in schema_links})
+    schema_links.update({i: pipeline._validate_schema_links(pipeline._extract_schema_links(response),
+                                                            schemas[pending[i]['db_id']], pending[i]['db_id'])
+                         for i, response in responses.items()})
+
+    # Step 2: Query Classification
+    classifications.update(run_stage('classification', {
+        i: pipeline.classification_prompt_maker(pending[i]['question'], pending[i]['db_id'], links[1:])
+        for i, links in schema_links.items() if i not in classifications}))
+
+    # Step 3: SQL Generation
+    prompts = {}
+    generation_info = {}
+    for i, classification in classifications.items():
+        q = pending[i]
+        query_type = query_types.get(i) or pipeline._parse_classification(classification)
+        prompt, fields, foreign_keys = pipeline.generation_prompt_maker(q['question'], q['db_id'], schema_links[i],
+                                                                        query_type, classification)
+        prompts[i] = prompt
+        generation_info[i] = (query_type, fields, foreign_keys)
+    generated = {i: pipeline._extract_reasoning_and_sql(response)
+                 for i, response in run_stage('generation', prompts).items()}
+
+    # Step 4: Self-correction
+    if correction:
+        corrected = run_stage('correction', {
+            i: pipeline.sql_query_corrector(pending[i]['question'], pending[i]['db_id'], reasoning, sql)
+            for i, (reasoning, sql) in generated.items()})
+        for i, response in corrected.items():
+            generated[i] = pipeline._extract_reasoning_and_sql(response)
+
+    for path in part_files(output_file):
+        os.remove(path)
+    with ResultJournal(f"{output_file}_part_0.jsonl", fsync_every=pipeline_config['fsync_every']) as journal:
+        written = sorted(((row_id, q, i) for i in generated for row_id, q in copies[i]),
+                         key=lambda row: int(row[0]))
+        for row_id, q, i in written:
+            reasoning, sql = generated[i]
+            query_type, fields, foreign_keys = generation_info[i]
+            journal.append({
+                'question': q['question'],
+                'schema_links': schema_links[i],
+                'fields': fields,
+                'foriegn keys': foreign_keys,
+                'classification': query_type,
+                'predicted_sql': sql,
+                'gold_sql': q.get('query', ''),
+                'db_id': q['db_id'],
+                'reasoning': reasoning,
+                ROW_INDEX: int(row_id)
+            })
+
+    pipeline.engine.close()
+    if pipeline.cache is not None:
+        pipeline.cache.close()
+    if usage is not None:
+        usage.extend(pipeline.usage.drain())
+
+    return len(questions), len(written)
 
-    return process_args, total_questions
 
 def main():
     # Parse command line arguments
@@ -1814,52 +1960,250 @@ def main():
     parser.add_argument('--output', 
                        default="din_sql_results.json",
                        help='Path for output results (default: din_sql_results.json)')
+    parser.add_argument('--output-format',
+                       choices=OUTPUT_FORMATS,
+                       default=None,
+                       help='Result file format: JSON array, newline-delimited JSON or Parquet '
+                            '(default: from the --output extension, JSON array otherwise)')
+    parser.add_argument('--row-group-size',
+                       type=int,
+                       default=10000,
+                       help='Records per Parquet row group when streaming the results (default: 10000)')
     parser.add_argument('--processes',
                        type=int,
                        default=4,
                        help='Number of parallel processes to use (default: 4)')
+    parser.add_argument('--mode',
+                       choices=['interactive', 'stage-major', 'batch'],
+                       default='interactive',
+                       help='Run all stages per question, run each stage over the whole dataset, '
+                            'or send each stage as one batch (default: interactive)')
+    parser.add_argument('--stage-dir',
+                       default="stage_work",
+                       help='Directory for stage checkpoints and batch request/result files (default: stage_work)')
+    parser.add_argument('--stage-concurrency',
+                       default="",
+                       help='Per-stage concurrency in stage-major mode, e.g. schema_linking=16,generation=4 '
+                            '(default: --concurrency for every stage)')
+    parser.add_argument('--rerun-stages',
+                       default="",
+                       help=f'Comma-separated stages to run again even where the checkpoint matches ({",".join(STAGES)})')
+    parser.add_argument('--batch-executor',
+                       choices=['openai', 'command'],
+                       default='openai',
+                       help='Submit batches to the OpenAI Batch API or run --batch-command (default: openai)')
+    parser.add_argument('--batch-command',
+                       default=LOCAL_BATCH_COMMAND,
+                       help='Local batch stand-in; {input} and {output} are replaced by the file paths '
+                            '(default: local_batch_runner.py next to this script, run by this interpreter)')
+    parser.add_argument('--correction',
+                       action='store_true',
+                       help='Run the self-correction stage in stage-major and batch mode')
+    parser.add_argument('--chunk-size',
+                       type=int,
+                       default=4,
+                       help='Questions handed to a worker per pull from the shared queue (default: 4)')
+    parser.add_argument('--concurrency',
+                       type=int,
+                       default=8,
+                       help='Questions processed concurrently within each process (default: 8)')
+    parser.add_argument('--max-in-flight',
+                       type=int,
+                       default=16,
+                       help='Maximum outstanding API requests per process (default: 16)')
+    parser.add_argument('--rpm',
+                       type=float,
+                       default=None,
+                       help='Requests-per-minute limit for the whole run, split across processes (default: unlimited)')
+    parser.add_argument('--tpm',
+                       type=float,
+                       default=None,
+                       help='Tokens-per-minute limit for the whole run, split across processes (default: unlimited)')
+    parser.add_argument('--cache',
+                       default="llm_cache.sqlite",
+                       help='Path of the persistent completion cache (default: llm_cache.sqlite)')
+    parser.add_argument('--cache-max-mb',
+                       type=int,
+                       default=1024,
+                       help='Size limit of the completion cache in MB (default: 1024)')
+    parser.add_argument('--no-cache',
+                       action='store_true',
+                       help='Always call the API and do not read or write the completion cache')
+    parser.add_argument('--usage-report',
+                       default=None,
+                       help='Where to write the per-stage token/latency/cost report (default: <output>.usage.json)')
+    parser.add_argument('--resume',
+                       action='store_true',
+                       help='Keep the part journals of an interrupted run and skip questions already in them')
+    parser.add_argument('--fsync-every',
+                       type=int,
+                       default=16,
+                       help='Number of results appended to a journal between fsyncs (default: 16)')
+    parser.add_argument('--backend',
+                       choices=BACKENDS,
+                       default='openai',
+                       help='openai: OpenAI API or an OpenAI-compatible server (--base-url); '
+                            'hf: local Hugging Face causal LM (default: openai)')
+    parser.add_argument('--model',
+                       default=MODEL_NAME,
+                       help=f'Model name, or Hugging Face model id/path with --backend hf (default: {MODEL_NAME})')
+    parser.add_argument('--base-url',
+                       default=None,
+                       help='Base URL of an OpenAI-compatible server, e.g. http://localhost:8000/v1')
+    parser.add_argument('--device',
+                       default=None,
+                       help='Device of the hf backend (default: cuda if available, else cpu)')
+    parser.add_argument('--dtype',
+                       default='auto',
+                       help='Torch dtype of the hf backend, e.g. bfloat16 or float32 (default: auto)')
+    parser.add_argument('--hf-batch-size',
+                       type=int,
+                       default=8,
+                       help='Maximum prompts generated together by the hf backend (default: 8)')
+    parser.add_argument('--hf-batch-wait',
+                       type=float,
+                       default=0.05,
+                       help='Seconds the hf backend waits to fill a batch (default: 0.05)')
+    parser.add_argument('--max-attempts',
+                       type=int,
+                       default=6,
+                       help='Attempts per API request on rate limits, server and connection errors (default: 6)')
+    parser.add_argument('--backoff-base',
+                       type=float,
+                       default=1.0,
+                       help='Base of the jittered exponential backoff in seconds (default: 1)')
+    parser.add_argument('--backoff-max',
+                       type=float,
+                       default=60.0,
+                       help='Longest wait between attempts, including Retry-After, in seconds (default: 60)')
+    parser.add_argument('--breaker-error-rate',
+                       type=float,
+                       default=0.5,
+                       help='Share of failed requests within 30s that pauses all workers (default: 0.5)')
+    parser.add_argument('--breaker-cooldown',
+                       type=float,
+                       default=30.0,
+                       help='Seconds all workers pause once the circuit breaker opens (default: 30)')
+    parser.add_argument('--fused-linking',
+                       action='store_true',
+                       help='Get schema links and the classification from one request, falling back to '
+                            'the separate calls when the response does not parse')
+    parser.add_argument('--link-validation',
+                       choices=VALIDATION_MODES,
+                       default='repair',
+                       help='Check schema links against the schema: repair near misses (case, typos, table '
+                            'aliases) and drop unknown links, only fix case and drop, or keep them as returned '
+                            '(default: repair)')
+    parser.add_argument('--log-level',
+                       choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                       default='INFO',
+                       help='Console log level; INFO prints one line per question (default: INFO)')
+    parser.add_argument('--debug-sample',
+                       type=float,
+                       default=1.0,
+                       help='Fraction of questions whose DEBUG records are logged (default: 1.0)')
+    parser.add_argument('--trace-file',
+                       default=None,
+                       help='Write every record, including full prompts and responses, to this gzip file '
+                            '(e.g. run.trace.log.gz)')
+    parser.add_argument('--prompt-layout',
+                       choices=LAYOUTS,
+                       default='system-prefix',
+                       help='Send the invariant few-shot prefix as a system message, or everything as one '
+                            'user message (default: system-prefix)')
 
     args = parser.parse_args()
-    print(args)
-
-    # Get process arguments and total questions
-    process_args, total_questions = process_dataset_parallel(args.schema, args.input, args.output, args.processes)
-
-    # Create pool and process batches
-    print(f"\n=== Processing with {args.processes} processes ===")
-    with multiprocessing.Pool(processes=args.processes) as pool:
-        with tqdm(total=total_questions, desc="Processing questions") as pbar:
-            for n_processed in pool.imap_unordered(process_question_batch, process_args):
-                pbar.update(n_processed)
-
-    # Merge the individual output files into the final output file
-    all_results = []
-    for i in range(args.processes):
-        process_output_file = f"{args.output}_part_{i}.json"
-        try:
-            with open(process_output_file, 'r') as f:
-                results = json.load(f)
-                all_results.extend(results)
-            # Optionally, delete the process's output file
-            os.remove(process_output_file)
-        except Exception as e:
-            print(f"Error reading from {process_output_file}: {str(e)}")
-
-    # Write all results to the final output file
+    if args.backend == 'hf' and args.mode == 'batch':
+        parser.error("--mode batch submits requests to an OpenAI-compatible batch endpoint; "
+                     "use --mode stage-major with --backend hf")
+    run_logging = RunLogging(args.log_level, debug_sample=args.debug_sample, trace_file=args.trace_file)
+    logger.info("Arguments: %s", args)
+    if args.backend == 'hf' and args.processes > 1:
+        logger.warning("Every one of the %d processes loads its own copy of %s", args.processes, args.model)
+
+    # Only the interactive mode splits the rate limits across worker processes
+    n_processes = args.processes if args.mode == 'interactive' else 1
+    pipeline_config = {
+        'concurrency': args.concurrency,
+        'max_in_flight': args.max_in_flight,
+        'rpm': args.rpm / n_processes if args.rpm else None,
+        'tpm': args.tpm / n_processes if args.tpm else None,
+        'cache_path': None if args.no_cache else args.cache,
+        'cache_max_bytes': args.cache_max_mb * 1024 ** 2,
+        'fsync_every': args.fsync_every,
+        'prompt_layout': args.prompt_layout,
+        'fused_linking': args.fused_linking,
+        'link_validation': args.link_validation,
+        'logging': run_logging.config,
+        'retry': {
+            'max_attempts': args.max_attempts,
+            'base_delay': args.backoff_base,
+            'max_delay': args.backoff_max,
+            'breaker': {'error_rate': args.breaker_error_rate, 'cooldown': args.breaker_cooldown},
+        },
+        'backend': {
+            'kind': args.backend,
+            'model': args.model,
+            'base_url': args.base_url,
+            'device': args.device,
+            'dtype': args.dtype,
+            'batch_size': args.hf_batch_size,
+            'batch_wait': args.hf_batch_wait,
+        },
+    }
+
+    usage = UsageRecorder()
+    if args.mode in ('stage-major', 'batch'):
+        batch_executor = None
+        if args.mode == 'batch' and args.batch_executor == 'openai':
+            batch_executor = OpenAIBatchExecutor(OpenAI(api_key=oai_api_key, base_url=args.base_url))
+        elif args.mode == 'batch':
+            batch_executor = CommandBatchExecutor(args.batch_command)
+        stage_concurrency = {}
+        for item in filter(None, args.stage_concurrency.split(',')):
+            stage, value = item.split('=')
+            stage_concurrency[stage.strip()] = int(value)
+        rerun_stages = [stage.strip() for stage in args.rerun_stages.split(',') if stage.strip()]
+        total_questions, _ = process_dataset_stage_major(args.schema, args.input, args.output, args.stage_dir,
+                                                         pipeline_config, batch_executor=batch_executor,
+                                                         stage_concurrency=stage_concurrency,
+                                                         rerun_stages=rerun_stages,
+                                                         correction=args.correction, usage=usage)
+        n_done = 0
+    else:
+        # Workers pull questions from a shared queue and report progress per question
+        total_questions, _, n_done = process_dataset_parallel(args.schema, args.input, args.output, args.processes,
+                                                              pipeline_config, resume=args.resume,
+                                                              chunk_size=args.chunk_size, usage=usage)
+
+    # Stream the part journals into the final output file
     try:
-        with open(args.output, 'w') as f:
-            json.dump(all_results, f, indent=2)
+        n_results = merge_journals(args.output, output_format=args.output_format,
+                                   row_group_size=args.row_group_size)
         print(f"Successfully wrote results to {args.output}")
     except Exception as e:
+        n_results = 0
         print(f"Error writing to output file: {str(e)}")
 
     # Print final statistics
     print("\n=== Processing Summary ===")
-    print(f"Total questions processed: {total_questions}")
-    print(f"Successful generations: {len(all_results)}")
-    success_rate = (len(all_results) / total_questions) * 100 if total_questions else 0
+    print(f"Total questions processed: {total_questions + n_done}")
+    print(f"Successful generations: {n_results}")
+    success_rate = (n_results / (total_questions + n_done)) * 100 if total_questions + n_done else 0
     print(f"Success rate: {success_rate:.2f}%")
+    if not args.no_cache:
+        cache = CompletionCache(args.cache)
+        stats = cache.stats()
+        cache.close()
+        print(f"Completion cache: {stats['entries']} entries, {stats['bytes'] / 1024 ** 2:.1f} MB, "
+              f"{stats['total_hits']} hits / {stats['total_misses']} misses overall")
+    usage_report = args.usage_report or f"{args.output}.usage.json"
+    report = write_report(usage_report, usage.records, args.model)
+    print("\n=== API Usage by Stage ===")
+    print(format_summary(report))
+    print(f"Usage report saved to: {usage_report}")
     print(f"Results saved to: {args.output}")
+    run_logging.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,247 @@
+"""
+Execution scoring for generated SQL.
+
+Runs `predicted_sql` and `gold_sql` of every result record against the Spider
+SQLite databases and adds the columns the fine-tuning data is filtered on:
+
+    pred_results, gold_results   repr() of the fetched rows
+    pred_error, gold_error       error message ('' when the query ran)
+    score                        1.0 when the prediction matches the gold result, else 0.0
+
+Records are scored in chunks by a process pool and written back in input order.
+Each worker opens every database once, read-only, interrupts queries after
+--timeout seconds, fetches at most --max-rows rows and caches gold results per
+(db_id, gold_sql), with gold queries that differ only in spacing, keyword case or
+identifier quoting sharing an entry (sql_hash).
+
+    python execution_scoring.py --input din_sql_results.json --output din_sql_scored.jsonl
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import Counter, OrderedDict, deque
+from itertools import islice
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+from result_writer import OUTPUT_FORMATS, RESULT_COLUMNS, iter_result_file, open_result_writer
+from sql_normalizer import sql_hash
+
+SCORE_COLUMNS = ['pred_results', 'gold_results', 'pred_error', 'gold_error', 'score']
+SCORED_COLUMNS = RESULT_COLUMNS + SCORE_COLUMNS
+
+# rows:                same multiset of rows as the gold result, in the same order when the
+#                      gold query has ORDER BY
+# gold-columns-subset: heuristic, opt-in only; every gold column's values appear in some
+#                      predicted column, so extra columns and rows (even SELECT *) still score 1.
+#                      It reproduces most of the shipped score labels but inflates them.
+MATCH_MODES = ('rows', 'gold-columns-subset')
+_ORDER_BY = re.compile(r'\border\s+by\b', re.IGNORECASE)
+
+_worker = None
+
+
+def database_path(db_dir: str, db_id: str) -> str:
+    return os.path.join(db_dir, db_id, f"{db_id}.sqlite")
+
+
+def connect_read_only(path: str) -> sqlite3.Connection:
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No database at {path}")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute("PRAGMA query_only = ON")
+    # Some Spider databases hold text that is not valid UTF-8
+    conn.text_factory = lambda data: data.decode('utf-8', errors='replace')
+    return conn
+
+
+def run_query(conn: sqlite3.Connection, sql: str, timeout: float, max_rows: int) -> Tuple[list, str]:
+    """Rows of `sql` (at most `max_rows`) and an error message ('' on success)"""
+    deadline = time.monotonic() + timeout
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+    try:
+        cursor = conn.execute(sql)
+        rows = cursor.fetchmany(max_rows + 1)
+        cursor.close()
+    except sqlite3.OperationalError as e:
+        if str(e) == 'interrupted':
+            return [], f"Timed out after {timeout:g}s"
+        return [], str(e)
+    except Exception as e:
+        return [], str(e)
+    finally:
+        conn.set_progress_handler(None, 0)
+    if len(rows) > max_rows:
+        return rows[:max_rows], f"Result truncated at {max_rows} rows"
+    return rows, ''
+
+
+def results_match(pred_rows: list, gold_rows: list, gold_sql: str, match: str = 'rows') -> bool:
+    if match == 'rows':
+        if _ORDER_BY.search(gold_sql):
+            return pred_rows == gold_rows
+        return Counter(pred_rows) == Counter(gold_rows)
+    if match != 'gold-columns-subset':
+        raise ValueError(f"Unknown match mode: {match} (expected one of {', '.join(MATCH_MODES)})")
+    if not gold_rows:
+        return not pred_rows
+    pred_columns = [set(column) for column in zip(*pred_rows)]
+    return all(any(set(gold_column) <= pred_column for pred_column in pred_columns)
+               for gold_column in zip(*gold_rows))
+
+
+class ScoringWorker:
+    """Per-process state: open connections and the gold result cache"""
+
+    def __init__(self, db_dir: str, timeout: float, max_rows: int, match: str, gold_cache_size: int):
+        self.db_dir = db_dir
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.match = match
+        self.gold_cache_size = gold_cache_size
+        self.connections: Dict[str, sqlite3.Connection] = {}
+        # (db_id, sql_hash(gold_sql)) -> (rows, error)
+        self.gold_cache: 'OrderedDict[Tuple[str, str], Tuple[list, str]]' = OrderedDict()
+        self.gold_hits = 0
+
+    def connection(self, db_id: str) -> sqlite3.Connection:
+        conn = self.connections.get(db_id)
+        if conn is None:
+            conn = self.connections[db_id] = connect_read_only(database_path(self.db_dir, db_id))
+        return conn
+
+    def gold(self, db_id: str, gold_sql: str) -> Tuple[list, str]:
+        key = (db_id, sql_hash(gold_sql))
+        cached = self.gold_cache.get(key)
+        if cached is not None:
+            self.gold_cache.move_to_end(key)
+            self.gold_hits += 1
+            return cached
+        cached = self.gold_cache[key] = run_query(self.connection(db_id), gold_sql, self.timeout, self.max_rows)
+        if len(self.gold_cache) > self.gold_cache_size:
+            self.gold_cache.popitem(last=False)
+        return cached
+
+    def score(self, record: dict) -> dict:
+        db_id, gold_sql = record['db_id'], record.get('gold_sql') or ''
+        pred_sql = record.get('predicted_sql') or ''
+        try:
+            gold_rows, gold_error = self.gold(db_id, gold_sql)
+            pred_rows, pred_error = run_query(self.connection(db_id), pred_sql, self.timeout, self.max_rows)
+        except FileNotFoundError as e:
+            gold_rows, pred_rows, gold_error, pred_error = [], [], str(e), str(e)
+        # A truncated result can still be compared; a failed query cannot
+        failed = any(error and not error.startswith('Result truncated') for error in (pred_error, gold_error))
+        score = 0.0 if failed else float(results_match(pred_rows, gold_rows, gold_sql, self.match))
+        return {
+            'pred_results': repr(pred_rows),
+            'gold_results': repr(gold_rows),
+            'pred_error': pred_error,
+            'gold_error': gold_error,
+            'score': score,
+        }
+
+
+def _init_worker(db_dir: str, timeout: float, max_rows: int, match: str, gold_cache_size: int):
+    global _worker
+    _worker = ScoringWorker(db_dir, timeout, max_rows, match, gold_cache_size)
+
+
+def _score_chunk(records: List[dict]) -> Tuple[List[dict], int]:
+    hits = _worker.gold_hits
+    for record in records:
+        record.update(_worker.score(record))
+    return records, _worker.gold_hits - hits
+
+
+def _chunks(records: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _write_scored(scored: Tuple[List[dict], int], writer, stats: Counter):
+    records, gold_hits = scored
+    stats['gold_cache_hits'] += gold_hits
+    for record in records:
+        writer.write(record)
+        stats['records'] += 1
+        stats['correct'] += record['score'] == 1.0
+        stats['pred_errors'] += bool(record['pred_error'])
+        stats['gold_errors'] += bool(record['gold_error'])
+
+
+def score_results(input_file: str, output_file: str, db_dir: str, processes: int = 4, timeout: float = 30.0,
+                  max_rows: int = 10000, match: str = 'rows', chunk_size: int = 64,
+                  gold_cache_size: int = 4096, output_format: Optional[str] = None,
+                  row_group_size: int = 10000) -> dict:
+    """
+    Score every record of `input_file` and stream them, with the score columns
+    added, to `output_file`. Returns summary statistics.
+    """
+    stats = Counter()
+    started = time.perf_counter()
+    initargs = (db_dir, timeout, max_rows, match, gold_cache_size)
+    with Pool(processes, initializer=_init_worker, initargs=initargs) as pool, \
+            open_result_writer(output_file, output_format, row_group_size=row_group_size,
+                               columns=SCORED_COLUMNS) as writer:
+        # A bounded window of chunks in flight (Pool.imap would read the whole input
+        # ahead); collecting them oldest first keeps the input order
+        pending = deque()
+        for chunk in _chunks(iter_result_file(input_file), chunk_size):
+            pending.append(pool.apply_async(_score_chunk, (chunk,)))
+            if len(pending) >= processes * 4:
+                _write_scored(pending.popleft().get(), writer, stats)
+        while pending:
+            _write_scored(pending.popleft().get(), writer, stats)
+    stats['seconds'] = time.perf_counter() - started
+    return dict(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Execution scoring of generated SQL against the Spider databases')
+    parser.add_argument('--input', required=True, help='DIN-SQL result file (JSON array, JSONL or Parquet)')
+    parser.add_argument('--output', required=True, help='Scored result file to write')
+    parser.add_argument('--db-dir', default="spider/database",
+                        help='Directory with <db_id>/<db_id>.sqlite databases (default: spider/database)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='Scoring processes (default: number of CPUs)')
+    parser.add_argument('--timeout', type=float, default=30, help='Per-query timeout in seconds (default: 30)')
+    parser.add_argument('--max-rows', type=int, default=10000, help='Rows fetched per query (default: 10000)')
+    parser.add_argument('--match', choices=MATCH_MODES, default='rows',
+                        help='How predicted and gold results are compared: rows (order-insensitive unless '
+                             'the gold query has ORDER BY) or the lenient gold-columns-subset heuristic '
+                             '(default: rows)')
+    parser.add_argument('--chunk-size', type=int, default=64, help='Records per pool task (default: 64)')
+    parser.add_argument('--gold-cache-size', type=int, default=4096,
+                        help='Gold results cached per process (default: 4096)')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default=None,
+                        help='Output format (default: from the --output extension, JSON array otherwise)')
+    parser.add_argument('--row-group-size', type=int, default=10000,
+                        help='Records per Parquet row group (default: 10000)')
+    args = parser.parse_args()
+
+    stats = score_results(args.input, args.output, args.db_dir, processes=args.processes, timeout=args.timeout,
+                          max_rows=args.max_rows, match=args.match, chunk_size=args.chunk_size,
+                          gold_cache_size=args.gold_cache_size, output_format=args.output_format,
+                          row_group_size=args.row_group_size)
+
+    n = stats.get('records', 0)
+    print(f"Scored {n} records in {stats['seconds']:.1f}s ({n / max(stats['seconds'], 1e-9):.0f}/s)")
+    if n:
+        print(f"Execution accuracy: {stats['correct'] / n:.2%}")
+    print(f"Prediction errors: {stats.get('pred_errors', 0)}, gold errors: {stats.get('gold_errors', 0)}, "
+          f"gold cache hits: {stats.get('gold_cache_hits', 0)}")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
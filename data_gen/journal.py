@@ -0,0 +1,158 @@
+import glob
+import json
+import logging
+import os
+from collections import Counter
+from typing import Hashable, Iterator, List, Optional, Set, Tuple
+
+from result_writer import open_result_writer
+
+logger = logging.getLogger(__name__)
+
+# Journal-only field: position of the record's row in the input file (not written to the output)
+ROW_INDEX = 'row_index'
+
+
+def result_key(record: dict) -> Tuple[str, str]:
+    """Identity of a question: (db_id, question)"""
+    return record['db_id'], record['question']
+
+
+def record_identity(record: dict) -> Hashable:
+    """
+    The input row a journal record belongs to. Duplicate questions get one record
+    per row, so rows are told apart by index; journals written before records
+    carried the index fall back to (db_id, question).
+    """
+    if ROW_INDEX in record:
+        return record[ROW_INDEX]
+    return result_key(record)
+
+
+def _truncate_torn_line(path: str):
+    """Cut off a partial last line so appended records start on a fresh line"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                pos += newline + 1
+                break
+        if pos != end:
+            f.truncate(pos)
+
+
+class ResultJournal:
+    """
+    Append-only JSONL journal of finished questions for one worker.
+
+    Every record is written and flushed as one line; the file is fsync'ed every
+    `fsync_every` records and on close, so a crash loses at most the last batch.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 16):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._pending = 0
+        _truncate_torn_line(path)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def append(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def part_files(output_file: str):
+    return sorted(glob.glob(f"{glob.escape(output_file)}_part_*.jsonl"))
+
+
+def iter_journal(path: str) -> Iterator[dict]:
+    """Yield the records of a journal, skipping a torn last line left by a killed worker"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Skipping corrupt journal line in %s", path)
+
+
+def completed_rows(output_file: str, questions: List[dict]) -> Set[int]:
+    """
+    Input rows of `questions` already recorded in the part journals of `output_file`.
+    Records without a row index (older journals) each account for the first
+    not-yet-done row with the same (db_id, question).
+    """
+    done = set()
+    unindexed = Counter()
+    for path in part_files(output_file):
+        for record in iter_journal(path):
+            if ROW_INDEX in record:
+                done.add(record[ROW_INDEX])
+            else:
+                unindexed[result_key(record)] += 1
+    if unindexed:
+        for i, q in enumerate(questions):
+            key = result_key(q)
+            if i not in done and unindexed[key] > 0:
+                unindexed[key] -= 1
+                done.add(i)
+    return done
+
+
+def merge_journals(output_file: str, remove_parts: bool = True, output_format: Optional[str] = None,
+                   row_group_size: int = 10000) -> int:
+    """
+    Stream every part journal into `output_file` as a JSON array, JSONL or Parquet
+    (see result_writer; inferred from the extension unless `output_format` is given).
+
+    Records are written one at a time (Parquet: one row group per `row_group_size`
+    records) to a temporary file which then atomically replaces the output, so
+    readers never see a half-written result file and memory stays bounded.
+    Every input row is written once, even when several rows hold the same question.
+    Returns the number of records written.
+    """
+    parts = part_files(output_file)
+    seen = set()
+
+    with open_result_writer(output_file, output_format, row_group_size=row_group_size) as writer:
+        for path in parts:
+            for record in iter_journal(path):
+                identity = record_identity(record)
+                if identity in seen:
+                    continue
+                seen.add(identity)
+                writer.write(record)
+
+    if remove_parts:
+        for path in parts:
+            os.remove(path)
+
+    return writer.n_written
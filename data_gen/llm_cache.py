@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CompletionCache:
+    """
+    Persistent, content-addressed cache of LLM completions backed by SQLite.
+
+    Entries are keyed by a SHA-256 of (backend kind, base_url, model, prompt, temperature,
+    max_tokens), so the same model name served by different backends never shares entries. The
+    database runs in WAL mode with a busy timeout, so every worker process can open
+    its own connection to the same file; within a process the connection is guarded
+    by a lock so it can be shared between threads. When the stored responses grow
+    past `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024 ** 3, evict_check_interval: int = 100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_check_interval = evict_check_interval
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_check = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions(last_access)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                hits INTEGER NOT NULL,
+                misses INTEGER NOT NULL
+            )""")
+        self._conn.execute("INSERT OR IGNORE INTO stats (id, hits, misses) VALUES (0, 0, 0)")
+
+    @staticmethod
+    def make_key(model: str, prompt: str, temperature: float, max_tokens: int, backend: str = 'openai',
+                 base_url: Optional[str] = None) -> str:
+        payload = json.dumps([backend, base_url, model, prompt, temperature, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                self._conn.execute("UPDATE stats SET misses = misses + 1 WHERE id = 0")
+                return None
+            self.hits += 1
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._conn.execute("UPDATE stats SET hits = hits + 1 WHERE id = 0")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now))
+            self._puts_since_check += 1
+            if self._puts_since_check >= self.evict_check_interval:
+                self._puts_since_check = 0
+                self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is back under 90% of max_bytes"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * 0.9)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            freed = 0
+            stale = []
+            for key, size in self._conn.execute("SELECT key, size FROM completions ORDER BY last_access"):
+                stale.append((key,))
+                freed += size
+                if freed >= target:
+                    break
+            self._conn.executemany("DELETE FROM completions WHERE key = ?", stale)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        logger.info("Evicted %d cached completions (%d bytes)", len(stale), freed)
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process plus the totals accumulated in the cache file"""
+        with self._lock:
+            hits, misses = self._conn.execute("SELECT hits, misses FROM stats WHERE id = 0").fetchone()
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_hits': hits,
+            'total_misses': misses,
+            'entries': entries,
+            'bytes': size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,82 @@
+"""
+Local stand-in for the OpenAI Batch API.
+
+Reads a Batch API request file, sends every request to an OpenAI-compatible
+chat completions server (vLLM, llama.cpp, a mock server, ...) and writes a
+result file in the Batch API output format, so the batch mode of
+din_sql_modified.py can run and be tested without the hosted API:
+
+    python din_sql_modified.py --mode batch --batch-executor command \
+        --batch-command "python local_batch_runner.py --input {input} --output {output} --base-url http://localhost:8000/v1"
+"""
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from retry_policy import RETRYABLE_STATUS, RetryPolicy, parse_retry_after
+
+
+def send_request(base_url: str, api_key: str, request: dict, timeout: float, policy: RetryPolicy) -> dict:
+    """Send one request, retrying rate limits, server and connection errors per `policy`"""
+    url = base_url.rstrip('/') + '/chat/completions'
+    data = json.dumps(request['body']).encode('utf-8')
+    http_request = urllib.request.Request(url, data=data, headers={
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {api_key}',
+    })
+    for attempt in range(policy.max_attempts):
+        last_attempt = attempt == policy.max_attempts - 1
+        try:
+            with urllib.request.urlopen(http_request, timeout=timeout) as response:
+                status, body = response.status, json.loads(response.read())
+            break
+        except urllib.error.HTTPError as e:
+            status, body = e.code, {"error": {"message": e.read().decode('utf-8', 'replace')}}
+            if status not in RETRYABLE_STATUS or last_attempt:
+                break
+            time.sleep(policy.delay(attempt, parse_retry_after(e.headers)))
+        except (urllib.error.URLError, ConnectionError, TimeoutError) as e:
+            if last_attempt:
+                return {"custom_id": request['custom_id'], "response": None,
+                        "error": {"code": type(e).__name__, "message": str(e)}}
+            time.sleep(policy.delay(attempt))
+        except Exception as e:
+            return {"custom_id": request['custom_id'], "response": None,
+                    "error": {"code": type(e).__name__, "message": str(e)}}
+    return {"custom_id": request['custom_id'],
+            "response": {"status_code": status, "body": body},
+            "error": None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Batch API stand-in')
+    parser.add_argument('--input', required=True, help='Batch request file (JSONL)')
+    parser.add_argument('--output', required=True, help='Batch result file to write (JSONL)')
+    parser.add_argument('--base-url', default="http://localhost:8000/v1",
+                        help='OpenAI-compatible server (default: http://localhost:8000/v1)')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent requests (default: 8)')
+    parser.add_argument('--timeout', type=float, default=600, help='Per-request timeout in seconds')
+    parser.add_argument('--max-attempts', type=int, default=6,
+                        help='Attempts per request on rate limits, server and connection errors (default: 6)')
+    args = parser.parse_args()
+    policy = RetryPolicy(max_attempts=args.max_attempts)
+
+    api_key = os.getenv('OPENAI_API_KEY', 'local')
+    with open(args.input, encoding='utf-8') as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = executor.map(lambda r: send_request(args.base_url, api_key, r, args.timeout, policy), requests)
+        with open(args.output, 'w', encoding='utf-8') as out:
+            for result in results:
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    print(f"Wrote {len(requests)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import json
+import math
+import threading
+from collections import defaultdict, namedtuple
+from typing import Iterable, List, Optional
+
+# USD per 1M tokens (input, cached input, output), used to estimate the bill in the usage report
+MODEL_PRICES = {
+    "gpt-4o-2024-11-20": (2.50, 1.25, 10.00),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+# One record per completion request; latency is the successful round trip, elapsed includes
+# queueing, rate limiting and retries (both in seconds, None for cache hits and batch results).
+# `cached` marks local completion cache hits, `cached_prompt_tokens` the provider's prefix cache.
+UsageRecord = namedtuple('UsageRecord', ['stage', 'prompt_tokens', 'completion_tokens', 'latency', 'elapsed',
+                                         'retries', 'error', 'cached', 'cached_prompt_tokens'])
+
+
+class UsageRecorder:
+    """Thread-safe collector of per-request token counts, timings, retries and errors"""
+
+    def __init__(self):
+        self.records: List[UsageRecord] = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+               latency: Optional[float] = None, elapsed: Optional[float] = None,
+               retries: int = 0, error: bool = False, cached: bool = False, cached_prompt_tokens: int = 0):
+        with self._lock:
+            self.records.append(UsageRecord(stage, prompt_tokens, completion_tokens, latency, elapsed,
+                                            retries, error, cached, cached_prompt_tokens))
+
+    def extend(self, records: Iterable[UsageRecord]):
+        with self._lock:
+            self.records.extend(records)
+
+    def drain(self) -> List[UsageRecord]:
+        """Return and clear the records (e.g. to ship them from a worker to the parent)"""
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+def _distribution(values: List[float]) -> dict:
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'total': sum(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1] if values else None,
+    }
+
+
+def summarize(records: Iterable[UsageRecord], model: str) -> dict:
+    """Per-stage and overall totals and percentiles of a run's completion requests"""
+    by_stage = defaultdict(list)
+    for record in records:
+        by_stage[record.stage].append(record)
+    by_stage['total'] = [record for stage in list(by_stage) for record in by_stage[stage]]
+
+    input_price, cached_input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0, 0.0))
+    report = {'model': model,
+              'price_per_1m_tokens': {'input': input_price, 'cached_input': cached_input_price,
+                                      'output': output_price},
+              'stages': {}}
+    for stage, stage_records in by_stage.items():
+        api_calls = [r for r in stage_records if not r.cached and not r.error]
+        prompt_tokens = sum(r.prompt_tokens for r in api_calls)
+        cached_prompt_tokens = sum(r.cached_prompt_tokens for r in api_calls)
+        completion_tokens = sum(r.completion_tokens for r in api_calls)
+        report['stages'][stage] = {
+            'requests': len(stage_records),
+            'api_calls': len(api_calls),
+            'cache_hits': sum(1 for r in stage_records if r.cached),
+            'errors': sum(1 for r in stage_records if r.error),
+            'retries': sum(r.retries for r in stage_records),
+            'prompt_tokens': _distribution([r.prompt_tokens for r in api_calls]),
+            'cached_prompt_tokens': cached_prompt_tokens,
+            'prompt_cache_hit_rate': cached_prompt_tokens / prompt_tokens if prompt_tokens else None,
+            'completion_tokens': _distribution([r.completion_tokens for r in api_calls]),
+            'latency_s': _distribution([r.latency for r in api_calls if r.latency is not None]),
+            'elapsed_s': _distribution([r.elapsed for r in api_calls if r.elapsed is not None]),
+            'cost_usd': ((prompt_tokens - cached_prompt_tokens) * input_price
+                         + cached_prompt_tokens * cached_input_price
+                         + completion_tokens * output_price) / 1e6,
+        }
+    return report
+
+
+def write_report(path: str, records: Iterable[UsageRecord], model: str) -> dict:
+    report = summarize(records, model)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def format_summary(report: dict) -> str:
+    """One line per stage for the end-of-run console summary"""
+    lines = []
+    for stage, stats in report['stages'].items():
+        latency = stats['latency_s']
+        p50 = f"{latency['p50']:.2f}s" if latency['p50'] is not None else "-"
+        p90 = f"{latency['p90']:.2f}s" if latency['p90'] is not None else "-"
+        hit_rate = stats['prompt_cache_hit_rate']
+        hit_rate = f"{hit_rate:.0%}" if hit_rate is not None else "-"
+        lines.append(f"{stage:>15}: {stats['api_calls']:6d} calls, {stats['cache_hits']:6d} cached, "
+                     f"{stats['errors']:4d} errors, {stats['retries']:4d} retries, "
+                     f"{stats['prompt_tokens']['total']:10d} in ({hit_rate} prefix-cached) / "
+                     f"{stats['completion_tokens']['total']:9d} out tokens, "
+                     f"p50 {p50} p90 {p90}, ${stats['cost_usd']:.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,118 @@
+"""
+Mock OpenAI-compatible chat completions server that injects failures, for exercising
+the retry policy and circuit breaker without touching the real API.
+
+Each request fails with 429 (with a Retry-After header) or a 5xx with the given
+probabilities; during an optional storm window every request gets a 429. Other
+requests return a canned completion with usage counts. Counters are printed on exit.
+
+    python mock_llm_server.py --port 8000 --p429 0.2 --p5xx 0.1
+    python din_sql_modified.py --base-url http://localhost:8000/v1 ...
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A response that every pipeline stage can parse
+CANNED_RESPONSE = """Schema Links: [singer.name]
+questions = [""]
+Label: "EASY"
+<REASONING>
+Select the name column of the singer table.
+</REASONING>
+<SQL>
+SELECT name FROM singer
+</SQL>"""
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    config = None
+    counts = Counter()
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def _send(self, status, body, headers=()):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        config = self.config
+        self._count('requests')
+        if config.latency:
+            time.sleep(config.latency)
+
+        elapsed = time.monotonic() - self.started
+        in_storm = config.storm_every and elapsed % config.storm_every < config.storm_length
+        roll = random.random()
+        if in_storm or roll < config.p429:
+            self._count('429')
+            self._send(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                       headers=[('Retry-After', str(config.retry_after))])
+            return
+        if roll < config.p429 + config.p5xx:
+            status = random.choice([500, 502, 503])
+            self._count(str(status))
+            self._send(status, {"error": {"message": "Server error (mock)", "type": "server_error"}})
+            return
+
+        self._count('200')
+        prompt = " ".join(message.get('content', '') for message in request.get('messages', []))
+        prompt_tokens = len(prompt.split())
+        self._send(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'mock'),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": CANNED_RESPONSE}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(CANNED_RESPONSE.split()),
+                      "total_tokens": prompt_tokens + len(CANNED_RESPONSE.split()),
+                      "prompt_tokens_details": {"cached_tokens": 0}},
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Failure-injecting mock chat completions server')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on (default: 8000)')
+    parser.add_argument('--p429', type=float, default=0.2, help='Probability of a 429 response (default: 0.2)')
+    parser.add_argument('--p5xx', type=float, default=0.1, help='Probability of a 5xx response (default: 0.1)')
+    parser.add_argument('--retry-after', type=float, default=2, help='Retry-After seconds sent with 429s (default: 2)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per request (default: 0.05)')
+    parser.add_argument('--storm-every', type=float, default=0,
+                        help='Start a 429 storm every N seconds (default: 0, no storms)')
+    parser.add_argument('--storm-length', type=float, default=5, help='Length of each storm in seconds (default: 5)')
+    args = parser.parse_args()
+
+    MockHandler.config = args
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), MockHandler)
+    print(f"Mock server on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(MockHandler.counts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Leveled logging for the data generation run.
+
+Every process (the parent and each worker) logs through a QueueHandler onto one
+multiprocessing queue; a single QueueListener in the parent formats the records
+and writes them, so workers never block on the shared stdout.
+
+Levels:
+    TRACE   full schema texts, prompts, LLM responses and result records
+            (only written to the optional gzip trace file)
+    DEBUG   per-step details; the console shows them for a deterministic sample
+            of questions (--debug-sample), the trace file for all of them
+    INFO    one compact record per question plus run-level progress
+"""
+import gzip
+import logging
+import logging.handlers
+import multiprocessing
+import sys
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Optional
+
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(processName)s q=%(qid)s %(message)s"
+
+# Chatty third-party loggers (httpx logs every request at INFO)
+QUIET_LOGGERS = ('httpx', 'httpcore', 'openai', 'urllib3')
+
+_context = threading.local()
+_debug_sample = 1.0
+_keep_unsampled = False
+
+
+def is_sampled(question_id: str) -> bool:
+    """Deterministic per-question sampling decision for DEBUG records"""
+    if _debug_sample >= 1:
+        return True
+    return zlib.crc32(question_id.encode('utf-8')) % 10000 < _debug_sample * 10000
+
+
+@contextmanager
+def question_context(question_id: str):
+    """Tag the records logged by this thread with `question_id` while processing it"""
+    previous = getattr(_context, 'question_id', None), getattr(_context, 'sampled', True)
+    _context.question_id = question_id
+    _context.sampled = is_sampled(question_id)
+    try:
+        yield
+    finally:
+        _context.question_id, _context.sampled = previous
+
+
+class QuestionFilter(logging.Filter):
+    """
+    Adds the current question id to records. DEBUG records of questions outside the
+    sample are dropped, unless a trace file wants them (the console then skips them).
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.qid = getattr(_context, 'question_id', None) or '-'
+        record.sampled = record.levelno != logging.DEBUG or getattr(_context, 'sampled', True)
+        return record.sampled or _keep_unsampled
+
+
+def _sampled_only(record: logging.LogRecord) -> bool:
+    return getattr(record, 'sampled', True)
+
+
+class GzipTraceHandler(logging.StreamHandler):
+    """Writes records to a gzip-compressed text file"""
+
+    def __init__(self, path: str):
+        super().__init__(gzip.open(path, 'at', encoding='utf-8'))
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.flush()
+                self.stream.close()
+                self.stream = None
+        finally:
+            self.release()
+        super().close()
+
+
+def configure_process(log_config: dict):
+    """Route this process's records to the parent's listener (call at the start of every worker)"""
+    global _debug_sample, _keep_unsampled
+    _debug_sample = log_config['debug_sample']
+    _keep_unsampled = log_config['trace']
+
+    handler = logging.handlers.QueueHandler(log_config['queue'])
+    handler.addFilter(QuestionFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(log_config['level'])
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+class RunLogging:
+    """Owns the log queue, the listener thread and its handlers for one run"""
+
+    def __init__(self, level: str = 'INFO', debug_sample: float = 1.0, trace_file: Optional[str] = None):
+        console_level = logging.getLevelName(level.upper())
+        formatter = logging.Formatter(LOG_FORMAT)
+
+        console = logging.StreamHandler(sys.stdout)
+        console.setLevel(console_level)
+        console.setFormatter(formatter)
+        console.addFilter(_sampled_only)
+        self.handlers = [console]
+        if trace_file:
+            trace = GzipTraceHandler(trace_file)
+            trace.setLevel(TRACE)
+            trace.setFormatter(formatter)
+            self.handlers.append(trace)
+
+        self.queue = multiprocessing.Queue()
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        # Picklable settings handed to the workers
+        self.config = {
+            'queue': self.queue,
+            'level': TRACE if trace_file else console_level,
+            'debug_sample': debug_sample,
+            'trace': bool(trace_file),
+        }
+        configure_process(self.config)
+
+    def close(self):
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
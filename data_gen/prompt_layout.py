@@ -0,0 +1,58 @@
+import json
+from dataclasses import dataclass
+from string import Formatter
+from typing import Dict, List, Union
+
+# How a ChatPrompt is sent: the invariant prefix as its own system message, or both parts
+# concatenated into one user message (same token prefix, for providers without system roles)
+LAYOUTS = ('system-prefix', 'single-message')
+
+
+@dataclass(frozen=True)
+class ChatPrompt:
+    """A prompt split into a prefix shared by every question of a stage and the per-question part"""
+    system: str
+    user: str
+
+    def text(self) -> str:
+        return self.system + self.user
+
+
+class PromptTemplate:
+    """
+    A stage prompt compiled once: a fixed few-shot/instruction prefix followed by a
+    template for the variable question/schema part.
+
+    The variable template is parsed a single time into literal and field pieces, so
+    rendering is a join. Keeping every invariant token in the prefix lets the
+    provider's automatic prefix caching serve it for every question of the stage.
+    """
+
+    def __init__(self, prefix: str, template: str):
+        self.prefix = prefix
+        self._pieces = [(literal, field) for literal, field, _, _ in Formatter().parse(template)]
+
+    def render(self, **values) -> ChatPrompt:
+        parts = []
+        for literal, field in self._pieces:
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(values[field]))
+        return ChatPrompt(self.prefix, "".join(parts))
+
+
+def to_messages(prompt: Union[str, ChatPrompt], layout: str = 'system-prefix') -> List[Dict[str, str]]:
+    if isinstance(prompt, str):
+        return [{"role": "user", "content": prompt}]
+    if layout == 'single-message' or not prompt.system:
+        return [{"role": "user", "content": prompt.text()}]
+    return [{"role": "system", "content": prompt.system}, {"role": "user", "content": prompt.user}]
+
+
+def prompt_text(prompt: Union[str, ChatPrompt]) -> str:
+    return prompt if isinstance(prompt, str) else prompt.text()
+
+
+def messages_key(messages: List[Dict[str, str]]) -> str:
+    """Canonical text of a message list, for cache keys and checkpoint hashes"""
+    return json.dumps(messages, ensure_ascii=False, sort_keys=True)
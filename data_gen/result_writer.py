@@ -0,0 +1,189 @@
+"""
+Streaming writers for the final DIN-SQL result file.
+
+Records are written one at a time (JSON array, JSONL) or in fixed-size row groups
+(Parquet), so producing the output never holds the whole dataset in memory.
+Every writer targets a temporary file that atomically replaces the output on close.
+"""
+import json
+import os
+import textwrap
+from typing import Iterator, List, Optional
+
+OUTPUT_FORMATS = ('json', 'jsonl', 'parquet')
+
+# Columns of a result record, in output order (the misspelled key is what downstream code reads)
+RESULT_COLUMNS = ['question', 'schema_links', 'fields', 'foriegn keys', 'classification',
+                  'predicted_sql', 'gold_sql', 'db_id', 'reasoning']
+
+# Parquet column types other than string
+_PARQUET_TYPES = {'score': 'float64'}
+
+
+def infer_format(path: str) -> str:
+    """Output format implied by the file extension (JSON array unless .jsonl/.ndjson/.parquet)"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    return 'json'
+
+
+def iter_result_file(path: str, input_format: Optional[str] = None) -> Iterator[dict]:
+    """
+    Yield the records of a result file. JSONL and Parquet are read incrementally
+    (one line / one row group at a time); a JSON array is loaded in one piece.
+    """
+    input_format = input_format or infer_format(path)
+    if input_format == 'jsonl':
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif input_format == 'parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        for i in range(parquet_file.num_row_groups):
+            yield from parquet_file.read_row_group(i).to_pylist()
+    else:
+        with open(path, encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+class _AtomicWriter:
+    def __init__(self, path: str, columns: Optional[List[str]] = None):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.columns = columns or RESULT_COLUMNS
+        self.n_written = 0
+
+    def _project(self, record: dict) -> dict:
+        return {column: record.get(column) for column in self.columns}
+
+    def write(self, record: dict):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+    def close(self):
+        self._finish()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        try:
+            self._finish()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonArrayWriter(_AtomicWriter):
+    """One indented JSON array, the format the downstream tools read by default"""
+
+    def __init__(self, path: str, columns: Optional[List[str]] = None):
+        super().__init__(path, columns)
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+        self._file.write('[')
+
+    def write(self, record: dict):
+        self._file.write(',\n' if self.n_written else '\n')
+        self._file.write(textwrap.indent(json.dumps(self._project(record), indent=2), '  '))
+        self.n_written += 1
+
+    def _finish(self):
+        if self._file.closed:
+            return
+        self._file.write('\n]\n' if self.n_written else ']\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+class JsonlWriter(_AtomicWriter):
+    """Newline-delimited JSON, one record per line (pd.read_json(path, lines=True))"""
+
+    def __init__(self, path: str, columns: Optional[List[str]] = None):
+        super().__init__(path, columns)
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(self._project(record), ensure_ascii=False) + '\n')
+        self.n_written += 1
+
+    def _finish(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+class ParquetWriter(_AtomicWriter):
+    """Parquet file with one column per result field, flushed every `row_group_size` records"""
+
+    def __init__(self, path: str, row_group_size: int = 10000, columns: Optional[List[str]] = None):
+        super().__init__(path, columns)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)") from e
+        self._pa = pa
+        self._schema = pa.schema([(column, getattr(pa, _PARQUET_TYPES.get(column, 'string'))())
+                                  for column in self.columns])
+        self._writer = pq.ParquetWriter(self.tmp_path, self._schema)
+        self.row_group_size = row_group_size
+        self._columns = {column: [] for column in self.columns}
+        self._buffered = 0
+
+    def write(self, record: dict):
+        for column in self.columns:
+            value = record.get(column)
+            if value is not None and column not in _PARQUET_TYPES and not isinstance(value, str):
+                value = json.dumps(value, ensure_ascii=False)
+            self._columns[column].append(value)
+        self._buffered += 1
+        self.n_written += 1
+        if self._buffered >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffered:
+            return
+        table = self._pa.Table.from_pydict(self._columns, schema=self._schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self._columns = {column: [] for column in self.columns}
+        self._buffered = 0
+
+    def _finish(self):
+        if self._writer is None:
+            return
+        try:
+            self._flush()
+        finally:
+            self._writer.close()
+            self._writer = None
+
+
+def open_result_writer(path: str, output_format: Optional[str] = None, row_group_size: int = 10000,
+                       columns: Optional[List[str]] = None) -> _AtomicWriter:
+    """Writer for `path` in `output_format` (inferred from the extension when None)"""
+    output_format = output_format or infer_format(path)
+    if output_format == 'jsonl':
+        return JsonlWriter(path, columns)
+    if output_format == 'parquet':
+        return ParquetWriter(path, row_group_size=row_group_size, columns=columns)
+    if output_format == 'json':
+        return JsonArrayWriter(path, columns)
+    raise ValueError(f"Unknown output format: {output_format} (expected one of {', '.join(OUTPUT_FORMATS)})")
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth another attempt: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TransientError(Exception):
+    """A failed request that may succeed when sent again (rate limited, server error, connection lost)"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RetriesExhausted(Exception):
+    """Raised by the completion engine once a request failed `attempts` times with transient errors"""
+
+    def __init__(self, last_error: Exception, attempts: int):
+        super().__init__(f"Giving up after {attempts} attempts: {last_error}")
+        self.last_error = last_error
+        self.attempts = attempts
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds to wait according to `retry-after-ms` / `retry-after` (delta-seconds or HTTP date)"""
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Capped exponential backoff with full jitter: attempt n waits a random time in
+    [0, min(max_delay, base_delay * 2**n)], unless the server sent Retry-After.
+    """
+
+    def __init__(self, max_attempts: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, error: Exception) -> bool:
+        return isinstance(error, (TransientError, ConnectionError, TimeoutError, asyncio.TimeoutError))
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Pauses every request while the recent error rate is too high.
+
+    Outcomes of the last `window` seconds are tracked per process; once at least
+    `min_requests` were seen and `error_rate` of them failed, the breaker opens for
+    `cooldown` seconds. The open-until time lives in `state` (a multiprocessing
+    Value('d') created by the parent), so a breaker tripped in one worker process
+    pauses all of them. A 429 with Retry-After opens it for that long as well,
+    since rate limits apply to the whole account rather than one worker.
+    """
+
+    def __init__(self, error_rate: float = 0.5, window: float = 30.0, min_requests: int = 10,
+                 cooldown: float = 30.0, state=None):
+        self.error_rate = error_rate
+        self.window = window
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self._state = state
+        self._open_until = 0.0
+        self._outcomes = deque()
+
+    def open_until(self) -> float:
+        return self._state.value if self._state is not None else self._open_until
+
+    def remaining(self) -> float:
+        return max(0.0, self.open_until() - time.time())
+
+    def open_for(self, seconds: float, reason: str):
+        until = time.time() + seconds
+        if self._state is not None:
+            with self._state.get_lock():
+                if self._state.value >= until:
+                    return
+                self._state.value = until
+        else:
+            if self._open_until >= until:
+                return
+            self._open_until = until
+        logger.warning("Circuit breaker open for %.1fs: %s", seconds, reason)
+
+    def record(self, failed: bool):
+        now = time.monotonic()
+        self._outcomes.append((now, failed))
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+        errors = sum(1 for _, outcome in self._outcomes if outcome)
+        if len(self._outcomes) >= self.min_requests and errors / len(self._outcomes) >= self.error_rate:
+            self.open_for(self.cooldown, f"{errors}/{len(self._outcomes)} requests failed "
+                                         f"in the last {self.window:.0f}s")
+            self._outcomes.clear()
+
+    async def wait(self):
+        """Block until the breaker is closed"""
+        while True:
+            remaining = self.remaining()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
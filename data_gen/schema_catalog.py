@@ -0,0 +1,202 @@
+import json
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DatabaseSchema:
+    tables: Dict[str, Tuple[str, ...]]
+    foreign_keys: Tuple[tuple, ...]
+    primary_keys: Dict[str, str]
+
+
+@dataclass(frozen=True)
+class SchemaRendering:
+    """Prompt-ready strings for one database, rendered once when the schema is loaded"""
+    fields: str
+    foreign_keys: str
+    primary_keys: str
+
+
+EMPTY_RENDERING = SchemaRendering(fields="", foreign_keys="[]", primary_keys="[]")
+
+
+@dataclass(frozen=True)
+class SchemaCatalog:
+    """
+    Everything the pipeline needs from tables.json, parsed once by the parent process.
+
+    Only strings and tuples live in here, so forked workers can share the pages
+    read-only instead of each parsing the file and building their own DataFrames.
+    """
+    schemas: Dict[str, DatabaseSchema]
+    renderings: Dict[str, SchemaRendering]
+
+
+def load_schema_catalog(schema_file: str) -> SchemaCatalog:
+    with open(schema_file) as f:
+        databases = json.load(f)
+    return SchemaCatalog(
+        schemas=parse_database_schemas(databases),
+        renderings=build_schema_renderings(*parse_schema_rows(databases)),
+    )
+
+
+def parse_database_schemas(databases: List[dict]) -> Dict[str, DatabaseSchema]:
+    """Build the table/column, foreign key and primary key view of every database"""
+    processed_schemas = {}
+    for db in databases:
+        try:
+            db_id = db['db_id']
+            table_names = db['table_names_original']
+            column_names = db['column_names_original']
+
+            # Process tables and columns
+            columns = defaultdict(list)
+            for tab_idx, col_name in column_names:
+                columns[tab_idx].append(col_name)
+            tables = {table: tuple(columns[i]) for i, table in enumerate(table_names)}
+
+            # Process foreign keys
+            foreign_keys = []
+            for fk in db['foreign_keys']:
+                try:
+                    col1 = column_names[fk[0]][1]
+                    tab1 = table_names[column_names[fk[0]][0]]
+                    col2 = column_names[fk[1]][1]
+                    tab2 = table_names[column_names[fk[1]][0]]
+                    foreign_keys.append((f"{tab1}.{col1}", f"{tab2}.{col2}"))
+                except Exception as e:
+                    logger.warning("Error processing foreign key %s: %s", fk, e)
+
+            # Process primary keys
+            primary_keys = {}
+            for pk in db['primary_keys']:
+                try:
+                    table_idx = column_names[pk][0]
+                    col_name = column_names[pk][1]
+                    table_name = table_names[table_idx]
+                    primary_keys[table_name] = col_name
+                except Exception as e:
+                    logger.warning("Error processing primary key %s: %s", pk, e)
+
+            processed_schemas[db_id] = DatabaseSchema(
+                tables=tables,
+                foreign_keys=tuple(foreign_keys),
+                primary_keys=primary_keys
+            )
+
+        except Exception as e:
+            logger.warning("Error processing database %s: %s", db.get('db_id', 'unknown'), e)
+            continue
+
+    return processed_schemas
+
+
+def parse_schema_rows(databases: List[dict]) -> Tuple[List[list], List[list], List[list]]:
+    """
+    Flatten the databases of a Spider tables.json into schema, primary key and foreign key rows:
+    [db, table, field, type], [db, table, pk] and [db, table1, table2, fk1, fk2]
+    """
+    schema = []
+    f_keys = []
+    p_keys = []
+
+    for row in databases:
+        try:
+            db_id = row['db_id']
+            tables = row['table_names_original']
+            col_names = row['column_names_original']
+            col_types = row['column_types']
+            foreign_keys = row['foreign_keys']
+            primary_keys = row['primary_keys']
+
+            # Process columns
+            for col, col_type in zip(col_names, col_types):
+                index, col_name = col
+                if index == -1:
+                    for table in tables:
+                        schema.append([db_id, table, '*', 'text'])
+                else:
+                    try:
+                        table_name = tables[index]
+                        schema.append([db_id, table_name, col_name, col_type])
+                    except IndexError:
+                        logger.warning("Invalid table index %s for column %s", index, col_name)
+                        continue
+
+            # Process primary keys
+            for pk in primary_keys:
+                try:
+                    table_idx, col_name = col_names[pk]
+                    if table_idx >= 0:  # Skip the * columns
+                        p_keys.append([db_id, tables[table_idx], col_name])
+                except IndexError:
+                    logger.warning("Invalid primary key index %s", pk)
+                    continue
+
+            # Process foreign keys
+            for fk_pair in foreign_keys:
+                try:
+                    fk1, fk2 = fk_pair
+                    # Get first key info
+                    tab1_idx, col1_name = col_names[fk1]
+                    # Get second key info
+                    tab2_idx, col2_name = col_names[fk2]
+
+                    if tab1_idx >= 0 and tab2_idx >= 0:  # Skip the * columns
+                        f_keys.append([
+                            db_id,
+                            tables[tab1_idx],
+                            tables[tab2_idx],
+                            col1_name,
+                            col2_name
+                        ])
+                except IndexError:
+                    logger.warning("Invalid foreign key indices %s", fk_pair)
+                    continue
+
+        except Exception as e:
+            logger.warning("Error processing database %s: %s: %s", row.get('db_id', 'unknown'),
+                           type(e).__name__, e)
+            continue
+
+    return schema, p_keys, f_keys
+
+
+def build_schema_renderings(schema: List[list], p_keys: List[list], f_keys: List[list]) -> Dict[str, SchemaRendering]:
+    """
+    Render the MySQL-like schema strings for every database.
+
+    Takes the row lists built by `parse_schema_rows` and produces exactly what the
+    old per-call DataFrame filtering produced: tables in sorted order with their
+    fields in schema order, and keys in schema order.
+    """
+    tables = defaultdict(lambda: defaultdict(list))
+    for db_id, table_name, field_name, _ in schema:
+        tables[db_id][table_name].append(field_name)
+
+    primary = defaultdict(list)
+    for db_id, table_name, primary_key in p_keys:
+        primary[db_id].append(f"{table_name}.{primary_key}")
+
+    foreign = defaultdict(list)
+    for db_id, first_table, second_table, first_key, second_key in f_keys:
+        foreign[db_id].append(f"{first_table}.{first_key} = {second_table}.{second_key}")
+
+    renderings = {}
+    for db_id in set(tables) | set(primary) | set(foreign):
+        fields = "".join(
+            "Table " + table_name + ', columns = [' + ','.join(columns) + "]\n"
+            for table_name, columns in sorted(tables[db_id].items())
+        )
+        renderings[db_id] = SchemaRendering(
+            fields=fields,
+            foreign_keys="[" + ",".join(foreign[db_id]) + "]",
+            primary_keys="[" + ",".join(primary[db_id]) + "]",
+        )
+    return renderings
@@ -0,0 +1,187 @@
+"""
+Validation and local repair of the schema links returned by the schema linking step.
+
+Every database gets a SchemaIndex (built once, then reused for all its questions)
+with case-insensitive lookups of tables, of columns per table, of the tables that
+own each column name and of the foreign-key partners of each column. A link such
+as `Singer.nme` or `T1.Name` is repaired to the schema's spelling when the lookup
+(or, in repair mode, a small edit-distance search) finds exactly one candidate;
+links that resolve to nothing are dropped. Values (`'France'`, `10`) are kept.
+"""
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from schema_catalog import DatabaseSchema
+
+# repair: case-insensitive and edit-distance repair; drop: case-insensitive only; off: keep links as returned
+VALIDATION_MODES = ('repair', 'drop', 'off')
+
+# Items of a link list, keeping quoted values that contain commas together
+_ITEM_PATTERN = re.compile(r"""'(?:[^']|'')*'|"[^"]*"|[^,]+""")
+# table.column, optionally quoted; anything with spaces ("Mr. Smith") is a value
+_COLUMN_PATTERN = re.compile(r"""^[`"]?([^\W\d]\w*)[`"]?\.[`"]?(\*|\w+)[`"]?$""")
+_JOIN_PATTERN = re.compile(r"^(.+?)\s*==?\s*(.+)$")
+
+
+def bounded_distance(a: str, b: str, limit: int) -> Optional[int]:
+    """Levenshtein distance of `a` and `b`, or None once it must exceed `limit`"""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+def _distance_limit(name: str, max_distance: int) -> int:
+    # Short names such as "id" or "age" are too easy to turn into other valid names
+    return min(max_distance, len(name) // 4)
+
+
+def closest_name(name: str, candidates: Dict[str, str], max_distance: int) -> Optional[str]:
+    """candidates[key] for the unique closest key within the edit-distance limit, None if absent or ambiguous"""
+    limit = _distance_limit(name, max_distance)
+    best, best_distance, tied = None, limit + 1, False
+    for key, value in candidates.items():
+        distance = bounded_distance(name, key, min(limit, best_distance))
+        if distance is None:
+            continue
+        if distance < best_distance:
+            best, best_distance, tied = value, distance, False
+        elif distance == best_distance:
+            tied = True
+    return None if tied else best
+
+
+@dataclass
+class LinkCheck:
+    """Validated link list with the changes made to it"""
+    links: str
+    repaired: List[Tuple[str, str]] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.repaired or self.dropped)
+
+
+class SchemaIndex:
+    """Case-insensitive lookups over one database's tables, columns and foreign keys"""
+
+    def __init__(self, schema: DatabaseSchema, max_distance: int = 2):
+        self.max_distance = max_distance
+        self.tables = {table.lower(): table for table in schema.tables}
+        self.columns = {table.lower(): {column.lower(): column for column in columns}
+                        for table, columns in schema.tables.items()}
+        owners = defaultdict(list)
+        for table, columns in schema.tables.items():
+            for column in columns:
+                owners[column.lower()].append((table, column))
+        # Same-named columns of different tables stay apart (id, name, ...)
+        self.column_owners = {name: tuple(refs) for name, refs in owners.items()}
+        self._column_names = {name: name for name in self.column_owners}
+        # Links spelled exactly like the schema skip the pattern matching
+        self.references = frozenset(f"{table}.{column}" for table, columns in schema.tables.items()
+                                    for column in columns + ('*',))
+        self.foreign_keys = defaultdict(list)
+        for left, right in schema.foreign_keys:
+            left_ref, right_ref = tuple(left.split('.', 1)), tuple(right.split('.', 1))
+            self.foreign_keys[(left_ref[0].lower(), left_ref[1].lower())].append(right_ref)
+            self.foreign_keys[(right_ref[0].lower(), right_ref[1].lower())].append(left_ref)
+
+    def table(self, name: str, fuzzy: bool) -> Optional[str]:
+        key = name.lower()
+        table = self.tables.get(key)
+        if table is None and fuzzy:
+            table = closest_name(key, self.tables, self.max_distance)
+        return table
+
+    def column(self, table_name: str, column_name: str, fuzzy: bool) -> Optional[Tuple[str, str]]:
+        """(table, column) as spelled in the schema for a `table.column` reference"""
+        column_key = column_name.lower()
+        table = self.table(table_name, fuzzy)
+        if table is not None:
+            if column_key == '*':
+                return table, '*'
+            columns = self.columns[table.lower()]
+            column = columns.get(column_key)
+            if column is None and fuzzy:
+                column = closest_name(column_key, columns, self.max_distance)
+            if column is not None:
+                return table, column
+        # Unknown table (often an alias such as T1) or a column of another table
+        owners = self.column_owners.get(column_key)
+        if owners is None and fuzzy and column_key != '*':
+            name = closest_name(column_key, self._column_names, self.max_distance)
+            owners = self.column_owners.get(name) if name else None
+        if owners and len(owners) == 1:
+            return owners[0]
+        return None
+
+    def foreign_key_partner(self, ref: Tuple[str, str]) -> Optional[Tuple[str, str]]:
+        partners = self.foreign_keys.get((ref[0].lower(), ref[1].lower()), [])
+        return partners[0] if len(partners) == 1 else None
+
+    def _reference(self, text: str, fuzzy: bool) -> Tuple[bool, Optional[Tuple[str, str]]]:
+        match = _COLUMN_PATTERN.match(text)
+        if not match:
+            return False, None
+        return True, self.column(match.group(1), match.group(2), fuzzy)
+
+    def check(self, schema_links: str, fuzzy: bool = True) -> LinkCheck:
+        """Validate a `[a.b, c.d = e.f, 'value']` link list, repairing near misses when `fuzzy`"""
+        items = [item.strip() for item in _ITEM_PATTERN.findall(schema_links.strip().strip('[]'))]
+        result = LinkCheck(schema_links)
+        kept = []
+        for item in items:
+            if not item:
+                continue
+            if item in self.references:
+                kept.append(item)
+                continue
+            left, equals, right = item.partition('=')
+            if equals and left.strip() in self.references and right.strip().lstrip('=').strip() in self.references:
+                kept.append(item)
+                continue
+            join = _JOIN_PATTERN.match(item)
+            if join:
+                left_is_ref, left = self._reference(join.group(1), fuzzy)
+                right_is_ref, right = self._reference(join.group(2), fuzzy)
+                if not (left_is_ref and right_is_ref):
+                    kept.append(item)  # a condition on a value, not a join
+                    continue
+                # One side unknown: the declared foreign key of the other side
+                if left is None and right is not None:
+                    left = self.foreign_key_partner(right)
+                elif right is None and left is not None:
+                    right = self.foreign_key_partner(left)
+                if left is None or right is None:
+                    result.dropped.append(item)
+                    continue
+                fixed = f"{left[0]}.{left[1]} = {right[0]}.{right[1]}"
+            else:
+                is_ref, ref = self._reference(item, fuzzy)
+                if not is_ref:
+                    kept.append(item)  # a value from the question
+                    continue
+                if ref is None:
+                    result.dropped.append(item)
+                    continue
+                fixed = f"{ref[0]}.{ref[1]}"
+            if fixed.replace(' ', '') != item.replace(' ', ''):
+                result.repaired.append((item, fixed))
+            kept.append(fixed)
+        if result.changed:
+            result.links = f"[{', '.join(kept)}]"
+        return result
+
+
+def build_schema_indexes(schemas: Dict[str, DatabaseSchema], max_distance: int = 2) -> Dict[str, SchemaIndex]:
+    return {db_id: SchemaIndex(schema, max_distance) for db_id, schema in schemas.items()}
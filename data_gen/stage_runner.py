@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from batch_mode import run_batch_stage
+from prompt_layout import prompt_text, to_messages
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['fused_linking', 'schema_linking', 'classification', 'generation', 'correction']
+
+
+def prompt_hash(prompt, settings: Optional[dict] = None) -> str:
+    """
+    Checkpoint key of a request: the prompt plus the settings that shape its response
+    (backend, model, temperature, max_tokens, ...), like the completion cache key
+    """
+    payload = json.dumps([prompt_text(prompt), settings or {}], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class InteractiveStageExecutor:
+    """Run one stage's prompts through the interactive API with a per-stage concurrency limit"""
+
+    def __init__(self, complete: Callable[[str, str], str], concurrency: Dict[str, int], default_concurrency: int = 8):
+        self.complete = complete
+        self.concurrency = concurrency
+        self.default_concurrency = default_concurrency
+
+    def run_stage(self, name: str, prompts: Dict[str, str]) -> Dict[str, Optional[str]]:
+        def run_one(custom_id):
+            try:
+                return custom_id, self.complete(prompts[custom_id], name)
+            except Exception as e:
+                logger.warning("Stage %s: request %s failed: %s", name, custom_id, e)
+                return custom_id, None
+
+        workers = self.concurrency.get(name, self.default_concurrency)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(run_one, prompts))
+
+
+class BatchStageExecutor:
+    """Run one stage's prompts as a single batch (see batch_mode.run_batch_stage)"""
+
+    def __init__(self, executor, work_dir: str, model: str, temperature: float, max_tokens: int, cache=None,
+                 usage=None, layout: str = 'system-prefix', backend: str = 'openai', base_url: Optional[str] = None):
+        self.executor = executor
+        self.work_dir = work_dir
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.cache = cache
+        self.usage = usage
+        self.layout = layout
+        self.backend = backend
+        self.base_url = base_url
+
+    def run_stage(self, name: str, prompts: Dict[str, str]) -> Dict[str, Optional[str]]:
+        messages = {custom_id: to_messages(prompt, self.layout) for custom_id, prompt in prompts.items()}
+        return run_batch_stage(name, messages, self.work_dir, self.executor, self.model,
+                               self.temperature, self.max_tokens, cache=self.cache, usage=self.usage,
+                               backend=self.backend, base_url=self.base_url)
+
+
+def load_checkpoint(path: str) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        entries = (json.loads(line) for line in f if line.strip())
+        return {entry['id']: entry for entry in entries}
+
+
+def save_checkpoint(path: str, entries: Dict[str, dict]):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for entry in entries.values():
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def run_checkpointed_stage(name: str, prompts: Dict[str, str], executor, stage_dir: str,
+                           force: bool = False, settings: Optional[dict] = None) -> Dict[str, str]:
+    """
+    Run one stage over the whole dataset, reusing its checkpoint where possible.
+
+    The checkpoint `<stage_dir>/<name>.jsonl` records the prompt hash and response of
+    every question. A question is only sent again when its prompt changed (because
+    this stage's template or an upstream result changed), when the request
+    `settings` (backend, model, sampling parameters) differ from the run that wrote
+    the checkpoint, or when `force` is set, so editing one stage's prompt only
+    re-runs that stage and what depends on it.
+    Returns the successful responses by question id.
+    """
+    path = os.path.join(stage_dir, f"{name}.jsonl")
+    checkpoint = {} if force else load_checkpoint(path)
+
+    entries = {}
+    pending = {}
+    for custom_id, prompt in prompts.items():
+        digest = prompt_hash(prompt, settings)
+        entry = checkpoint.get(custom_id)
+        if entry is not None and entry['prompt_hash'] == digest:
+            entries[custom_id] = entry
+        else:
+            pending[custom_id] = prompt
+
+    logger.info("Stage %s: %d reused from checkpoint, %d to run", name, len(entries), len(pending))
+    if pending:
+        for custom_id, response in executor.run_stage(name, pending).items():
+            if response is not None:
+                entries[custom_id] = {'id': custom_id, 'prompt_hash': prompt_hash(pending[custom_id], settings),
+                                      'response': response}
+        save_checkpoint(path, entries)
+
+    return {custom_id: entry['response'] for custom_id, entry in entries.items()}
@@ -1,4 +1,6 @@
+import os
 import re
+import sys
 
 from typing import List
 
@@ -6,6 +8,9 @@ import pandas as pd
 
 from datasets import Dataset, DatasetDict
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from result_reader import read_results
+
 template = """\
 You are an SQL expert. The task you are going to perform is to generate reasoning chains and SQL query given user questions, relevant schema, and a thought process. Always follow the instructions given to you as it will help you generate reasoning chains and SQL in a structured manner. Give your output in a txt code block. Do not use asterisk to highlight SQL keywords. Encapsulate chains within <chains> and </chains>. Encapsulate SQL within <SQL> and </SQL>:
 
@@ -60,8 +65,8 @@ def get_dataset(load_easy: bool = True) -> DatasetDict:
     train_path = "./dataset/full_train_gpt4o_mini_query_gen_gpt4o_query_correction.json"
     eval_path = "./dataset/full_val_gpt4o_mini_query_gen_gpt4o_query_correction.json"
 
-    train_df = pd.read_json(train_path)
-    eval_df = pd.read_json(eval_path)
+    train_df = read_results(train_path)
+    eval_df = read_results(eval_path)
 
     if load_easy:
         train_df = train_df[train_df["classification"] == "EASY"]
@@ -76,7 +81,7 @@ def get_dataset(load_easy: bool = True) -> DatasetDict:
 
 
 if __name__ == "__main__":
-    df = pd.read_json(
+    df = read_results(
         "./dataset/full_train_gpt4o_mini_query_gen_gpt4o_query_correction.json"
     )
 
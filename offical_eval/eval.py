@@ -1,5 +1,7 @@
 from transformers import AutoTokenizer, AutoModelForCausalLM
+import os
 import re
+import sys
 
 from typing import List
 
@@ -9,6 +11,9 @@ from datasets import Dataset, DatasetDict
 
 from peft import PeftModel
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from sharding import current_shard, shard_frame
+
 template = """\
 You are an SQL expert. The task you are going to perform is to generate reasoning chains and SQL query given user questions, relevant schema, and a thought process. Always follow the instructions given to you as it will help you generate reasoning chains and SQL in a structured manner. Give your output in a txt code block. Do not use asterisk to highlight SQL keywords. Encapsulate chains within <chains> and </chains>. Encapsulate SQL within <SQL> and </SQL>:
 
@@ -88,10 +93,13 @@ def evaluate_model():
     eval_df = pd.read_json(eval_file)
     eval_df = eval_df[eval_df["score"] == 1]
     eval_df = eval_df[eval_df["classification"] == "EASY"]
+    # One contiguous slice of the rows per shard_runner.py worker or SLURM array task
+    shard = current_shard()
+    eval_df = shard_frame(eval_df, shard)
     eval = process_dataset(eval_df)
     print("here")
-    with open(output_file, "w") as out_f:
-        for idx, sample in enumerate(eval):
+    with open(shard.path(output_file), "w") as out_f:
+        for idx, sample in zip(eval_df.index, eval):
             # Tokenize the input
             inputs = tokenizer(sample, return_tensors="pt", truncation=True)
             #print("here 2")
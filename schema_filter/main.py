@@ -11,6 +11,9 @@ sys.path.append(module_path)
 
 from schema_filter import filter_func, SchemaItemClassifierInference
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from result_reader import read_results
+
 
 # Parameters used by CodeS
 num_top_k_tables = 6
@@ -82,7 +85,7 @@ def get_db_schema_sequence(schema, foreign_keys):
 
 
 def main(path: str):
-    df = pd.read_json(path)
+    df = read_results(path)
     # df = df[:2]
 
     dataset = [process_row(row) for _, row in df.iterrows()]
@@ -0,0 +1,54 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The pipeline modules import each other by flat name, as when run from their own directory
+for directory in ('data_gen', 'common'):
+    path = os.path.join(ROOT, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def mock_server():
+    """
+    Start data_gen/mock_llm_server.py with the given options and return its base URL;
+    every server started is stopped after the test.
+    """
+    servers = []
+
+    def start(p429=0.0, p5xx=0.0, retry_after=2, latency=0.0):
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'data_gen', 'mock_llm_server.py'), '--port', str(port),
+             '--p429', str(p429), '--p5xx', str(p5xx), '--retry-after', str(retry_after),
+             '--latency', str(latency)],
+            stdout=subprocess.DEVNULL)
+        servers.append(server)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("Mock server did not start")
+                time.sleep(0.05)
+        return f"http://127.0.0.1:{port}/v1"
+
+    yield start
+    for server in servers:
+        server.terminate()
+        server.wait()
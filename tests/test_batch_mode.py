@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from batch_mode import LOCAL_BATCH_COMMAND, CommandBatchExecutor, run_batch_stage
+from llm_cache import CompletionCache
+from metrics import UsageRecorder
+from mock_llm_server import CANNED_RESPONSE
+
+TABLES = [{
+    'db_id': 'concert_singer',
+    'table_names_original': ['singer', 'concert'],
+    'column_names_original': [[-1, '*'], [0, 'singer_id'], [0, 'name'], [0, 'country'],
+                              [1, 'concert_id'], [1, 'singer_id']],
+    'column_types': ['text', 'number', 'text', 'text', 'number', 'number'],
+    'foreign_keys': [[5, 1]],
+    'primary_keys': [1, 4],
+}]
+
+QUESTIONS = [
+    {'db_id': 'concert_singer', 'question': 'What are the names of all singers?', 'query': 'SELECT name FROM singer'},
+    {'db_id': 'concert_singer', 'question': 'How many concerts are there?', 'query': 'SELECT count(*) FROM concert'},
+    {'db_id': 'concert_singer', 'question': 'what are the names of all singers?', 'query': 'SELECT name FROM singer'},
+]
+
+
+class NoBatches:
+    """Batch executor for runs that must be answered entirely from the completion cache"""
+
+    def run(self, requests_path, results_path):
+        raise AssertionError(f"Unexpected batch submission of {requests_path}")
+
+
+def test_batch_stage_through_local_runner(tmp_path, monkeypatch, mock_server):
+    base_url = mock_server()
+    # The default command must not depend on the working directory
+    monkeypatch.chdir(tmp_path)
+    executor = CommandBatchExecutor(f"{LOCAL_BATCH_COMMAND} --base-url {base_url}")
+    prompts = {str(i): [{'role': 'user', 'content': q['question']}] for i, q in enumerate(QUESTIONS)}
+    cache = CompletionCache(str(tmp_path / 'cache.sqlite'))
+    usage = UsageRecorder()
+
+    responses = run_batch_stage('generation', prompts, str(tmp_path), executor, 'mock', 0, 100,
+                                cache=cache, usage=usage)
+    assert responses == {custom_id: CANNED_RESPONSE for custom_id in prompts}
+    assert len(usage.drain()) == len(prompts)
+
+    # Every prompt is now cached, so no batch is submitted
+    again = run_batch_stage('generation', prompts, str(tmp_path), NoBatches(), 'mock', 0, 100, cache=cache)
+    assert again == responses
+    assert cache.stats()['hits'] == len(prompts)
+    cache.close()
+
+
+def test_stage_major_pipeline_in_batch_mode(tmp_path, monkeypatch, mock_server):
+    for module in ('pandas', 'tqdm', 'tiktoken', 'openai'):
+        pytest.importorskip(module)
+    import din_sql_modified
+    from journal import merge_journals
+
+    class WordTokenizer:
+        def encode(self, text):
+            return text.split()
+
+    # tiktoken would download its encoding; the count only feeds the rate limiter
+    monkeypatch.setattr(din_sql_modified.DINSQLPipeline, '_tiktoken_encoding', staticmethod(lambda model: WordTokenizer()))
+    base_url = mock_server()
+    schema_file, input_file = tmp_path / 'tables.json', tmp_path / 'dev.json'
+    schema_file.write_text(json.dumps(TABLES))
+    input_file.write_text(json.dumps(QUESTIONS))
+    config = {
+        'concurrency': 2, 'max_in_flight': 2, 'rpm': None, 'tpm': None,
+        'cache_path': str(tmp_path / 'cache.sqlite'), 'cache_max_bytes': 1024 ** 2, 'fsync_every': 1,
+        'prompt_layout': 'system-prefix', 'fused_linking': False, 'link_validation': 'repair',
+        'retry': {'max_attempts': 2, 'base_delay': 0.01, 'max_delay': 0.1},
+        'backend': {'kind': 'openai', 'model': 'mock', 'base_url': base_url},
+    }
+
+    def run(output_file, stage_dir, executor):
+        scheduled, written = din_sql_modified.process_dataset_stage_major(
+            str(schema_file), str(input_file), str(output_file), str(stage_dir), config, batch_executor=executor)
+        merge_journals(str(output_file))
+        with open(output_file, encoding='utf-8') as f:
+            return scheduled, written, json.load(f)
+
+    executor = CommandBatchExecutor(f"{LOCAL_BATCH_COMMAND} --base-url {base_url}")
+    scheduled, written, results = run(tmp_path / 'out.json', tmp_path / 'stages', executor)
+    assert (scheduled, written) == (3, 3)
+    assert [r['question'] for r in results] == [q['question'] for q in QUESTIONS]
+    assert all(r['predicted_sql'] == 'SELECT name FROM singer' for r in results)
+    assert (tmp_path / 'stages' / 'generation.results.jsonl').exists()
+
+    # Without the stage checkpoints every request is answered from the filled cache
+    _, _, cached = run(tmp_path / 'cached.json', tmp_path / 'stages-2', NoBatches())
+    assert cached == results
@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+
+for module in ('numpy', 'torch', 'transformers', 'tokenizers', 'accelerate', 'tqdm'):
+    pytest.importorskip(module)
+
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TABLES = [{
+    'db_id': 'concert_singer',
+    'table_names_original': ['singer'],
+    'column_names_original': [[-1, '*'], [0, 'singer_id'], [0, 'name'], [0, 'age']],
+    'column_types': ['text', 'number', 'text', 'number'],
+    'foreign_keys': [],
+    'primary_keys': [1],
+}]
+
+DEV = [
+    {'db_id': 'concert_singer', 'question': 'How many singers are there?', 'query': 'SELECT count(*) FROM singer'},
+    {'db_id': 'concert_singer', 'question': 'What are the names of all singers?', 'query': 'SELECT name FROM singer'},
+    {'db_id': 'concert_singer', 'question': 'What is the average age of all singers?',
+     'query': 'SELECT avg(age) FROM singer'},
+]
+
+
+def save_tiny_model(path: str, texts):
+    """A randomly initialised two-layer GPT-2 with a word-level tokenizer over `texts`, built offline"""
+    words = sorted({word for text in texts for word in text.split()})
+    vocab = {token: i for i, token in enumerate(['<unk>', '<pad>', '<eos>'] + words)}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token='<unk>'))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, unk_token='<unk>', pad_token='<pad>',
+                                        eos_token='<eos>', model_input_names=['input_ids', 'attention_mask'])
+    tokenizer.save_pretrained(path)
+    config = GPT2Config(vocab_size=len(vocab), n_positions=1024, n_embd=32, n_layer=2, n_head=2,
+                        pad_token_id=vocab['<pad>'], eos_token_id=vocab['<eos>'], bos_token_id=vocab['<eos>'])
+    GPT2LMHeadModel(config).save_pretrained(path)
+
+
+@pytest.fixture
+def spider_dir(tmp_path, monkeypatch):
+    """Working directory with a three-row Spider dev set where evaluate_model looks for it"""
+    data_dir = tmp_path / 'benchmarks' / 'spider_data'
+    data_dir.mkdir(parents=True)
+    (data_dir / 'dev.json').write_text(json.dumps(DEV))
+    (data_dir / 'tables.json').write_text(json.dumps(TABLES))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(os.path.join(ROOT, 'baseline_models', 'src'))
+    for name in ('NUM_SHARDS', 'SHARD_INDEX', 'SLURM_ARRAY_TASK_COUNT'):
+        monkeypatch.delenv(name, raising=False)
+    return tmp_path
+
+
+@pytest.mark.parametrize('dynamic_padding', [False, True])
+def test_evaluate_model_on_cpu(spider_dir, dynamic_padding):
+    from spider_dataset import build_prompt, parse_spider_schemas, parse_spider_queries
+    import evaluate_model
+
+    schemas = parse_spider_schemas('benchmarks/spider_data/tables.json')
+    prompts = [build_prompt(query, schemas) for query in parse_spider_queries('benchmarks/spider_data/dev.json')]
+    model_dir = str(spider_dir / 'tiny-gpt2')
+    save_tiny_model(model_dir, prompts)
+
+    # The second run reads the tokenized prompts from the prompt cache
+    for run in ('first', 'cached'):
+        output_dir = spider_dir / run
+        evaluate_model.main(
+            model_name=model_dir,
+            batch_size=2,
+            dynamic_padding=dynamic_padding,
+            prompt_cache=str(spider_dir / 'cache'),
+            num_workers=0,
+            decoding='greedy',
+            max_new_tokens=4,
+            output_dir=str(output_dir),
+            device='cpu',
+            dtype='float32',
+            threads=1,
+        )
+
+        with open(output_dir / 'gold_query.txt') as f:
+            assert f.read().splitlines() == [f"{row['query']}\t{row['db_id']}" for row in DEV]
+        with open(output_dir / 'generated.txt') as f:
+            assert len(f.read().splitlines()) == len(DEV)
+        with open(output_dir / 'throughput.json') as f:
+            throughput = json.load(f)
+        assert throughput['decoding'] == 'greedy'
+        assert throughput['examples'] == len(DEV)
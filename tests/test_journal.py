@@ -0,0 +1,64 @@
+import json
+
+from dedup import group_duplicates
+from journal import ROW_INDEX, ResultJournal, completed_rows, iter_journal, merge_journals, part_files
+
+QUESTIONS = [
+    {'db_id': 'concert_singer', 'question': 'How many singers are there?'},
+    {'db_id': 'concert_singer', 'question': 'How  many singers are there? '},
+    {'db_id': 'concert_singer', 'question': 'How many singers are there?'},
+    {'db_id': 'pets_1', 'question': 'How many singers are there?'},
+]
+
+
+def record(row_index, **fields):
+    return dict(QUESTIONS[row_index], predicted_sql='SELECT COUNT(*) FROM singer', **{ROW_INDEX: row_index}, **fields)
+
+
+def test_torn_last_line_is_skipped_and_truncated(tmp_path):
+    path = str(tmp_path / 'out.json_part_0.jsonl')
+    with ResultJournal(path) as journal:
+        journal.append(record(0))
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"db_id": "concert_singer", "quest')
+
+    assert [r[ROW_INDEX] for r in iter_journal(path)] == [0]
+
+    with ResultJournal(path) as journal:
+        journal.append(record(1))
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line)[ROW_INDEX] for line in lines] == [0, 1]
+
+
+def test_merge_keeps_one_record_per_row_index(tmp_path):
+    output = str(tmp_path / 'out.json')
+    # Rows 0 and 2 hold the same question; row 1 was journaled by two workers
+    with ResultJournal(output + '_part_0.jsonl') as journal:
+        journal.append(record(0))
+        journal.append(record(1))
+    with ResultJournal(output + '_part_1.jsonl') as journal:
+        journal.append(record(1))
+        journal.append(record(2))
+
+    assert merge_journals(output) == 3
+    with open(output, encoding='utf-8') as f:
+        merged = json.load(f)
+    assert [r['question'] for r in merged] == [QUESTIONS[i]['question'] for i in (0, 1, 2)]
+    assert all(ROW_INDEX not in r for r in merged)
+    assert part_files(output) == []
+
+
+def test_completed_rows_by_index_and_legacy_records(tmp_path):
+    output = str(tmp_path / 'out.json')
+    with ResultJournal(output + '_part_0.jsonl') as journal:
+        journal.append(record(3))
+        # Written before records carried the row index: counts for the first matching row
+        journal.append(dict(QUESTIONS[0]))
+
+    assert completed_rows(output, QUESTIONS) == {0, 3}
+
+
+def test_group_duplicates_by_db_and_normalized_question():
+    groups = group_duplicates(enumerate(QUESTIONS))
+    assert [[i for i, _ in group] for group in groups] == [[0, 1, 2], [3]]
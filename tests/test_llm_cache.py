@@ -0,0 +1,52 @@
+from llm_cache import CompletionCache
+
+
+def test_key_depends_on_every_request_setting():
+    key = CompletionCache.make_key('gpt-4', 'prompt', 0, 100)
+    assert key == CompletionCache.make_key('gpt-4', 'prompt', 0, 100)
+    assert len({key,
+                CompletionCache.make_key('gpt-3.5', 'prompt', 0, 100),
+                CompletionCache.make_key('gpt-4', 'other prompt', 0, 100),
+                CompletionCache.make_key('gpt-4', 'prompt', 0.7, 100),
+                CompletionCache.make_key('gpt-4', 'prompt', 0, 200)}) == 5
+
+
+def test_key_depends_on_backend_and_server():
+    keys = {CompletionCache.make_key('codes-7b', 'prompt', 0, 100, backend='hf'),
+            CompletionCache.make_key('codes-7b', 'prompt', 0, 100, backend='openai'),
+            CompletionCache.make_key('codes-7b', 'prompt', 0, 100, backend='openai',
+                                     base_url='http://localhost:8000/v1'),
+            CompletionCache.make_key('codes-7b', 'prompt', 0, 100, backend='openai',
+                                     base_url='http://gpu-node:8000/v1')}
+    assert len(keys) == 4
+
+
+def test_get_put_and_persistent_stats(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = CompletionCache(path)
+    key = cache.make_key('gpt-4', 'prompt', 0, 100)
+    assert cache.get(key) is None
+    cache.put(key, 'gpt-4', 'SELECT 1')
+    assert cache.get(key) == 'SELECT 1'
+    cache.close()
+
+    reopened = CompletionCache(path)
+    assert reopened.get(key) == 'SELECT 1'
+    stats = reopened.stats()
+    reopened.close()
+    assert (stats['hits'], stats['misses']) == (1, 0)
+    assert (stats['total_hits'], stats['total_misses'], stats['entries']) == (2, 1, 1)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = CompletionCache(str(tmp_path / 'cache.sqlite'), max_bytes=100, evict_check_interval=1)
+    keys = [cache.make_key('gpt-4', f'prompt {i}', 0, 100) for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, 'gpt-4', 'x' * 30)
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[3], 'gpt-4', 'x' * 30)
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.stats()['bytes'] <= 90
+    cache.close()
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import multiprocessing
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from backends import BackendResponse
+from completion_engine import AsyncCompletionEngine
+from retry_policy import RETRYABLE_STATUS, CircuitBreaker, RetriesExhausted, RetryPolicy, TransientError, \
+    parse_retry_after
+
+MESSAGES = [{'role': 'user', 'content': 'What are the names of all singers?'}]
+
+
+class WordTokenizer:
+    def encode(self, text):
+        return text.split()
+
+
+class HTTPBackend:
+    """OpenAIBackend's error mapping over urllib, so the tests also run without the openai package"""
+
+    def __init__(self, base_url):
+        self.url = base_url.rstrip('/') + '/chat/completions'
+
+    def _post(self, body):
+        request = urllib.request.Request(self.url, data=json.dumps(body).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code not in RETRYABLE_STATUS:
+                raise
+            raise TransientError(str(e), status=e.code, retry_after=parse_retry_after(e.headers)) from e
+        except urllib.error.URLError as e:
+            raise TransientError(str(e)) from e
+
+    async def acreate(self, messages, temperature, max_tokens):
+        body = {'model': 'mock', 'messages': messages, 'temperature': temperature, 'max_tokens': max_tokens}
+        response = await asyncio.get_running_loop().run_in_executor(None, self._post, body)
+        usage = response['usage']
+        return BackendResponse(response['choices'][0]['message']['content'], usage['prompt_tokens'],
+                               usage['completion_tokens'])
+
+
+class RecordingBackend:
+    """Records the wall-clock time and outcome of every request"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = []
+
+    async def acreate(self, messages, temperature, max_tokens):
+        sent = time.time()
+        try:
+            response = await self.backend.acreate(messages, temperature, max_tokens)
+        except TransientError as e:
+            self.calls.append((sent, e.status))
+            raise
+        self.calls.append((sent, 200))
+        return response
+
+
+@pytest.fixture(params=['openai', 'http'])
+def make_backend(request):
+    if request.param == 'openai':
+        pytest.importorskip('openai')
+        from backends import OpenAIBackend
+        return lambda base_url: RecordingBackend(OpenAIBackend('mock', base_url=base_url))
+    return lambda base_url: RecordingBackend(HTTPBackend(base_url))
+
+
+def make_engine(backend, max_attempts, breaker=None):
+    return AsyncCompletionEngine(backend, WordTokenizer(), max_tokens=100,
+                                 retry_policy=RetryPolicy(max_attempts, base_delay=0.01, max_delay=5),
+                                 breaker=breaker or CircuitBreaker(min_requests=1000))
+
+
+def complete(engine):
+    try:
+        return engine.complete(MESSAGES)
+    finally:
+        engine.close()
+
+
+def test_success_without_failures(mock_server, make_backend):
+    backend = make_backend(mock_server())
+    result = complete(make_engine(backend, max_attempts=1))
+    assert result.text.startswith('Schema Links:')
+    assert result.retries == 0
+    assert [status for _, status in backend.calls] == [200]
+
+
+def test_retry_after_is_honoured_until_retries_are_exhausted(mock_server, make_backend):
+    backend = make_backend(mock_server(p429=1, retry_after=0.5))
+    with pytest.raises(RetriesExhausted) as raised:
+        complete(make_engine(backend, max_attempts=3))
+
+    assert raised.value.attempts == 3
+    assert raised.value.last_error.status == 429
+    assert [status for _, status in backend.calls] == [429] * 3
+    sent = [at for at, _ in backend.calls]
+    # Every retry waits for the server's Retry-After instead of the 10 ms backoff
+    assert all(later - earlier >= 0.45 for earlier, later in zip(sent, sent[1:]))
+
+
+def test_server_errors_exhaust_retries(mock_server, make_backend):
+    backend = make_backend(mock_server(p5xx=1))
+    with pytest.raises(RetriesExhausted) as raised:
+        complete(make_engine(backend, max_attempts=4))
+
+    assert raised.value.attempts == 4
+    assert all(status in (500, 502, 503) for _, status in backend.calls)
+    assert len(backend.calls) == 4
+
+
+def run_concurrently(first, second, state):
+    """Start `first`, then `second` once `first` has opened the shared breaker; returns the open-until time"""
+    errors = []
+
+    def call(engine):
+        try:
+            complete(engine)
+        except RetriesExhausted as e:
+            errors.append(e)
+
+    first_thread = threading.Thread(target=call, args=(first,))
+    first_thread.start()
+    deadline = time.monotonic() + 10
+    while state.value == 0:
+        assert time.monotonic() < deadline, "The shared breaker never opened"
+        time.sleep(0.005)
+    open_until = state.value
+    call(second)
+    first_thread.join()
+    return open_until, errors
+
+
+def test_rate_limit_pauses_every_caller_sharing_the_breaker(mock_server, make_backend):
+    base_url = mock_server(p429=1, retry_after=0.5)
+    state = multiprocessing.Value('d', 0.0)
+    # Two engines stand in for two worker processes: separate event loops, one breaker state
+    first, second = make_backend(base_url), make_backend(base_url)
+    open_until, errors = run_concurrently(make_engine(first, 2, CircuitBreaker(min_requests=1000, state=state)),
+                                          make_engine(second, 2, CircuitBreaker(min_requests=1000, state=state)),
+                                          state)
+
+    assert len(errors) == 2
+    # The second caller sent nothing while the first caller's Retry-After was running
+    assert second.calls[0][0] >= open_until - 0.01
+
+
+def test_error_rate_trip_pauses_every_caller_sharing_the_breaker(mock_server, make_backend):
+    base_url = mock_server(p5xx=1)
+    state = multiprocessing.Value('d', 0.0)
+    first, second = make_backend(base_url), make_backend(base_url)
+    open_until, errors = run_concurrently(
+        make_engine(first, 3, CircuitBreaker(error_rate=0.5, min_requests=2, cooldown=0.5, state=state)),
+        make_engine(second, 1, CircuitBreaker(min_requests=1000, state=state)),
+        state)
+
+    assert len(errors) == 2
+    # The first caller's third attempt and the second caller's only one both waited out the cooldown
+    assert first.calls[2][0] >= open_until - 0.01
+    assert second.calls[0][0] >= open_until - 0.01
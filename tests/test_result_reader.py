@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+pytest.importorskip('pandas')
+
+from result_reader import read_results
+
+RECORDS = [
+    {'question': 'How many singers are there?', 'predicted_sql': 'SELECT COUNT(*) FROM singer', 'score': 1},
+    {'question': 'What are the names of all singers?', 'predicted_sql': 'SELECT name FROM singer', 'score': 0},
+]
+
+
+@pytest.mark.parametrize('name', ['results.json', 'results.jsonl'])
+def test_read_results_by_extension(tmp_path, name):
+    path = tmp_path / name
+    if name.endswith('.jsonl'):
+        path.write_text(''.join(json.dumps(record) + '\n' for record in RECORDS))
+    else:
+        path.write_text(json.dumps(RECORDS))
+
+    df = read_results(str(path))
+    assert df.to_dict('records') == RECORDS
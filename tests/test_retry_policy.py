@@ -0,0 +1,104 @@
+import multiprocessing
+import time
+from email.utils import formatdate
+
+import pytest
+
+from backends import BackendResponse
+from completion_engine import AsyncCompletionEngine
+from retry_policy import CircuitBreaker, RetriesExhausted, RetryPolicy, TransientError, parse_retry_after
+
+MESSAGES = [{'role': 'user', 'content': 'How many singers are there?'}]
+
+
+class WordTokenizer:
+    def encode(self, text):
+        return text.split()
+
+
+class ScriptedBackend:
+    """Raises the queued errors one per call, then answers"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def acreate(self, messages, temperature, max_tokens):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return BackendResponse('SELECT COUNT(*) FROM singer', prompt_tokens=5, completion_tokens=4)
+
+
+def make_engine(backend, max_attempts=3):
+    return AsyncCompletionEngine(backend, WordTokenizer(), retry_policy=RetryPolicy(max_attempts, 0.001, 0.01),
+                                 breaker=CircuitBreaker(min_requests=100))
+
+
+def test_parse_retry_after():
+    assert parse_retry_after({'retry-after-ms': '1500', 'retry-after': '9'}) == 1.5
+    assert parse_retry_after({'retry-after': '3'}) == 3.0
+    assert 8 < parse_retry_after({'retry-after': formatdate(time.time() + 10, usegmt=True)}) <= 10
+    assert parse_retry_after({'retry-after': 'soon'}) is None
+    assert parse_retry_after(None) is None
+
+
+def test_delay_is_capped_and_honours_retry_after():
+    policy = RetryPolicy(base_delay=1.0, max_delay=4.0)
+    assert all(0 <= policy.delay(attempt) <= 4.0 for attempt in range(10))
+    assert policy.delay(0, retry_after=2.5) == 2.5
+    assert policy.delay(0, retry_after=100) == 4.0
+
+
+def test_breaker_opens_at_error_rate():
+    breaker = CircuitBreaker(error_rate=0.5, min_requests=4, cooldown=30)
+    for failed in (False, True, False):
+        breaker.record(failed)
+    assert breaker.remaining() == 0
+    breaker.record(True)
+    assert 29 < breaker.remaining() <= 30
+
+
+def test_breaker_state_is_shared():
+    state = multiprocessing.Value('d', 0.0)
+    first, second = CircuitBreaker(state=state), CircuitBreaker(state=state)
+    first.open_for(10, 'test')
+    assert 9 < second.remaining() <= 10
+    # A shorter opening never shortens the current one
+    second.open_for(1, 'test')
+    assert first.remaining() > 9
+
+
+def test_engine_retries_transient_errors():
+    backend = ScriptedBackend([TransientError('busy', status=503), ConnectionError('reset')])
+    engine = make_engine(backend)
+    try:
+        result = engine.complete(MESSAGES)
+    finally:
+        engine.close()
+    assert result.text == 'SELECT COUNT(*) FROM singer'
+    assert result.retries == 2
+    assert backend.calls == 3
+
+
+def test_engine_gives_up_after_max_attempts():
+    backend = ScriptedBackend([TransientError('busy', status=503)] * 5)
+    engine = make_engine(backend, max_attempts=3)
+    try:
+        with pytest.raises(RetriesExhausted) as raised:
+            engine.complete(MESSAGES)
+    finally:
+        engine.close()
+    assert raised.value.attempts == 3
+    assert backend.calls == 3
+
+
+def test_engine_raises_other_errors_right_away():
+    backend = ScriptedBackend([ValueError('bad request')])
+    engine = make_engine(backend)
+    try:
+        with pytest.raises(ValueError):
+            engine.complete(MESSAGES)
+    finally:
+        engine.close()
+    assert backend.calls == 1
@@ -0,0 +1,48 @@
+from schema_catalog import DatabaseSchema
+from schema_validator import SchemaIndex, bounded_distance, closest_name
+
+SCHEMA = DatabaseSchema(
+    tables={'singer': ('singer_id', 'name', 'country'), 'concert': ('concert_id', 'singer_id', 'year')},
+    foreign_keys=(('concert.singer_id', 'singer.singer_id'),),
+    primary_keys={'singer': 'singer_id', 'concert': 'concert_id'},
+)
+
+
+def test_bounded_distance():
+    assert bounded_distance('country', 'contry', 2) == 1
+    assert bounded_distance('country', 'year', 2) is None
+
+
+def test_closest_name_rejects_ties():
+    assert closest_name('contry', {'country': 'Country', 'name': 'Name'}, 2) == 'Country'
+    assert closest_name('abcdx', {'abcde': 1, 'abcdf': 2}, 2) is None
+
+
+def test_exact_links_are_unchanged():
+    check = SchemaIndex(SCHEMA).check('[singer.name, concert.singer_id = singer.singer_id]')
+    assert not check.changed
+    assert check.links == '[singer.name, concert.singer_id = singer.singer_id]'
+
+
+def test_aliases_and_case_are_repaired():
+    check = SchemaIndex(SCHEMA).check('[T1.name, Singer.Country, T2.year]')
+    assert check.links == '[singer.name, singer.country, concert.year]'
+    assert ('T1.name', 'singer.name') in check.repaired
+
+
+def test_aliased_join_side_resolved_through_foreign_key():
+    check = SchemaIndex(SCHEMA).check('[T2.singer_id = singer.singer_id]')
+    assert check.links == '[concert.singer_id = singer.singer_id]'
+
+
+def test_typos_repaired_only_when_fuzzy():
+    index = SchemaIndex(SCHEMA)
+    assert index.check('[singer.contry]').links == '[singer.country]'
+    strict = index.check('[singer.contry]', fuzzy=False)
+    assert strict.dropped == ['singer.contry']
+
+
+def test_values_kept_and_unknown_links_dropped():
+    check = SchemaIndex(SCHEMA).check("[singer.country = 'France', foo.bar, 10]")
+    assert check.links == "[singer.country = 'France', 10]"
+    assert check.dropped == ['foo.bar']
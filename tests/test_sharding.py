@@ -0,0 +1,50 @@
+import json
+import os
+
+import pytest
+
+from sharding import Shard, current_shard, merge_shards, shard_frame, shard_paths
+
+
+def test_shards_cover_every_row_once():
+    rows = list(range(10))
+    parts = [rows[Shard(index, 4).slice(len(rows))] for index in range(4)]
+    assert [len(part) for part in parts] == [2, 3, 2, 3]
+    assert [row for part in parts for row in part] == rows
+
+
+def test_paths_and_environment(monkeypatch):
+    assert Shard().path('out/generated.txt') == 'out/generated.txt'
+    assert Shard(1, 4).path('out/generated.txt') == 'out/generated.shard-00001-of-00004.txt'
+    monkeypatch.delenv('NUM_SHARDS', raising=False)
+    monkeypatch.setenv('SLURM_ARRAY_TASK_COUNT', '4')
+    monkeypatch.setenv('SLURM_ARRAY_TASK_ID', '3')
+    monkeypatch.setenv('SLURM_ARRAY_TASK_MIN', '1')
+    assert current_shard() == Shard(2, 4)
+
+
+def test_merge_shards_in_order(tmp_path):
+    lines, table = str(tmp_path / 'generated.txt'), str(tmp_path / 'predictions.json')
+    for index, path in enumerate(shard_paths(lines, 2)):
+        with open(path, 'w') as f:
+            f.write(f"SELECT {index}")
+    for index, path in enumerate(shard_paths(table, 2)):
+        with open(path, 'w') as f:
+            json.dump({'model_predicted_sql': {str(index): f"SELECT {index}"}}, f)
+
+    merge_shards(lines, 2)
+    merge_shards(table, 2)
+    with open(lines) as f:
+        assert f.read() == "SELECT 0\nSELECT 1\n"
+    with open(table) as f:
+        assert json.load(f) == {'model_predicted_sql': {'0': 'SELECT 0', '1': 'SELECT 1'}}
+    assert not any(os.path.exists(part) for part in shard_paths(lines, 2) + shard_paths(table, 2))
+
+
+def test_shard_frame_labels_rows_by_position():
+    pd = pytest.importorskip('pandas')
+    df = pd.DataFrame({'question': list('abcdef'), 'score': [1, 0, 1, 1, 0, 1]})
+    filtered = df[df['score'] == 1]
+    parts = [shard_frame(filtered, Shard(index, 2)) for index in range(2)]
+    assert [list(part.index) for part in parts] == [[0, 1], [2, 3]]
+    assert [q for part in parts for q in part['question']] == ['a', 'c', 'd', 'f']
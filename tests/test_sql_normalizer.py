@@ -0,0 +1,50 @@
+from sql_normalizer import (
+    canonical_sql,
+    extract_after_marker,
+    extract_reasoning_and_sql,
+    format_sql,
+    normalize_sql,
+    sql_hash,
+)
+
+
+def test_canonical_sql_ignores_case_quoting_spacing_and_semicolon():
+    variants = [
+        'select T1.name from singer as T1 where T1.age > 20;',
+        'SELECT  t1.Name FROM Singer AS t1 WHERE t1.Age>20',
+        'SELECT `t1`.[Name] FROM singer AS T1\n WHERE T1.age > 20',
+    ]
+    assert {canonical_sql(sql) for sql in variants} == {'SELECT t1.name FROM singer AS t1 WHERE t1.age > 20'}
+    assert len({sql_hash(sql) for sql in variants}) == 1
+
+
+def test_canonical_sql_keeps_string_literals():
+    upper = "select name from singer where country = 'France'"
+    lower = "select name from singer where country = 'france'"
+    assert canonical_sql(upper) == "SELECT name FROM singer WHERE country = 'France'"
+    assert sql_hash(upper) != sql_hash(lower)
+
+
+def test_canonical_sql_drops_comments():
+    assert canonical_sql('select count(*) from singer -- all of them') == 'SELECT COUNT(*) FROM singer'
+
+
+def test_normalize_sql_keeps_identifiers_as_written():
+    assert normalize_sql('select  T1.Name\nfrom Singer as T1') == 'SELECT T1.Name FROM Singer AS T1'
+
+
+def test_format_sql_upper_cases_only_the_output_keywords():
+    assert format_sql("select distinct name from singer as T1 group  by country having count(*) > 1 order by age desc") \
+        == "SELECT distinct name FROM singer as T1 GROUP BY country HAVING COUNT(*) > 1 ORDER BY age desc"
+    assert format_sql("select 'from where' from t") == "SELECT 'from where' FROM t"
+
+
+def test_extract_reasoning_and_sql():
+    response = '<REASONING> Pick\n the name. </REASONING>\n<SQL>\nselect name\n from singer\n</SQL>'
+    assert extract_reasoning_and_sql(response) == ('Pick the name.', 'SELECT name FROM singer')
+    assert extract_reasoning_and_sql('SELECT name FROM singer') is None
+
+
+def test_extract_after_marker():
+    output = '[QUESTION] q [SQL] select name\nfrom singer [/SQL] [QUESTION] next'
+    assert extract_after_marker(output) == 'select name from singer'